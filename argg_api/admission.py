@@ -0,0 +1,213 @@
+"""
+Purpose: Limit how often each client may make requests (such as registrations),
+so a misbehaving script or a double-submitted form can't flood the BC Data
+Catalog or the mail relay.
+
+Each limit is a token bucket: a key (e.g. a submitter's email address) may make
+'burst' requests at once, and after that 'rate' requests per minute.  Buckets
+are stored with the generic cell rate algorithm, which needs only one number
+per key: the "theoretical arrival time" (TAT) at which the key's bucket would
+be full again.  A key whose TAT has passed has a full bucket, which is the
+same as not being stored at all, so such keys are simply deleted (lazily).  The
+store only ever holds the keys which have made requests recently.
+
+Buckets are kept in a pluggable store: in memory (per worker process) or in a
+SQLite file (shared by all worker processes on a host).
+"""
+import math
+import threading
+import time
+from .sqlitedb import connect, enable_wal
+
+class RateLimited(Exception):
+  """
+  Raised when a request exceeds a rate limit
+  """
+
+  def __init__(self, msg, retry_after):
+    """
+    :param retry_after: the number of seconds after which the request would be
+      allowed
+    """
+    super(RateLimited, self).__init__(msg)
+    self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class TokenBucket(object):
+  """
+  The parameters of a token bucket limit
+  """
+
+  def __init__(self, rate, burst):
+    """
+    :param rate: the number of requests per minute a key may make (once its
+      burst is used up)
+    :param burst: the number of requests a key may make at once
+    """
+    self.rate = rate
+    self.burst = max(1, burst)
+    #seconds between requests at the sustained rate
+    self.interval = 60.0 / rate
+    #how far a key's TAT may be ahead of the current time
+    self.tolerance = self.interval * (self.burst - 1)
+
+  def update(self, tat, now):
+    """
+    :param tat: the key's stored TAT (or None)
+    :return: a tuple (new tat, retry_after).  retry_after is 0 if the request
+      is allowed, otherwise the number of seconds until it would be
+    """
+    tat = max(tat or now, now)
+    if tat - now > self.tolerance:
+      return tat, tat - self.tolerance - now
+    return tat + self.interval, 0
+
+class RateLimitStore(object):
+  """
+  Base class for stores of TATs by key
+  """
+
+  def update(self, buckets, now):
+    """
+    Atomically checks a request against several buckets.  The TATs are only
+    updated if the request is allowed by all of them.
+    :param buckets: a list of (key, TokenBucket) pairs
+    :return: a list of the retry_after of each bucket (all 0 if the request is
+      allowed)
+    """
+    raise NotImplementedError()
+
+  def size(self):
+    raise NotImplementedError()
+
+def _update_all(buckets, tats, now):
+  """
+  :param tats: the stored TAT of each bucket's key (or None)
+  :return: a tuple (new tats, retry_afters)
+  """
+  updates = [bucket.update(tat, now) for (key, bucket), tat in zip(buckets, tats)]
+  return [tat for tat, retry_after in updates], [retry_after for tat, retry_after in updates]
+
+class MemoryRateLimitStore(RateLimitStore):
+  """
+  Keeps TATs in a dictionary.  Only requests handled by the same process share
+  buckets.
+  """
+
+  def __init__(self, purge_interval=60):
+    self.purge_interval = purge_interval
+    self._tats = {}
+    self._purged_at = time.time()
+    self._lock = threading.Lock()
+
+  def update(self, buckets, now):
+    with self._lock:
+      if now - self._purged_at >= self.purge_interval:
+        self._tats = dict((key, tat) for key, tat in self._tats.items() if tat > now)
+        self._purged_at = now
+      new_tats, retry_afters = _update_all(buckets, [self._tats.get(key) for key, bucket in buckets], now)
+      if not any(retry_afters):
+        for (key, bucket), tat in zip(buckets, new_tats):
+          self._tats[key] = tat
+      return retry_afters
+
+  def size(self):
+    return len(self._tats)
+
+class SQLiteRateLimitStore(RateLimitStore):
+  """
+  Keeps TATs in a SQLite database file, so all the worker processes on a host
+  share buckets
+  """
+
+  def __init__(self, path, purge_interval=60):
+    self.path = path
+    self.purge_interval = purge_interval
+    self._purged_at = 0
+    enable_wal(path)
+    with connect(self.path) as conn:
+      conn.execute("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+      conn.execute("CREATE INDEX IF NOT EXISTS rate_limits_tat ON rate_limits (tat)")
+
+  def update(self, buckets, now):
+    with connect(self.path) as conn:
+      #take the write lock first, so the check and the update are atomic
+      conn.execute("BEGIN IMMEDIATE")
+      if now - self._purged_at >= self.purge_interval:
+        conn.execute("DELETE FROM rate_limits WHERE tat <= ?", (now,))
+        self._purged_at = now
+      tats = []
+      for key, bucket in buckets:
+        row = conn.execute("SELECT tat FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        tats.append(row[0] if row else None)
+      new_tats, retry_afters = _update_all(buckets, tats, now)
+      if not any(retry_afters):
+        conn.executemany("INSERT OR REPLACE INTO rate_limits (key, tat) VALUES (?, ?)",
+          [(key, tat) for (key, bucket), tat in zip(buckets, new_tats)])
+      return retry_afters
+
+  def size(self):
+    with connect(self.path) as conn:
+      return conn.execute("SELECT COUNT(*) FROM rate_limits WHERE tat > ?", (time.time(),)).fetchone()[0]
+
+def create_rate_limit_store(kind, path=None):
+  """
+  Creates a rate limit store
+  :param kind: one of "memory" or "sqlite"
+  :param path: the database file for a sqlite store
+  """
+  if kind == "memory":
+    return MemoryRateLimitStore()
+  if kind == "sqlite":
+    return SQLiteRateLimitStore(path)
+  raise ValueError("Unknown rate limit store '{}'.  Expecting 'memory' or 'sqlite'.".format(kind))
+
+class RateLimiter(object):
+  """
+  Applies named token bucket limits to requests
+  """
+
+  def __init__(self, store, limits):
+    """
+    :param store: the RateLimitStore in which buckets are kept
+    :param limits: a dictionary of TokenBuckets by name (e.g. "ip").  Limits
+      which are None are disabled.
+    """
+    self.store = store
+    self.limits = dict((name, bucket) for name, bucket in limits.items() if bucket)
+
+  def admit(self, keys):
+    """
+    Counts a request against the limits
+    :param keys: a dictionary of the request's key for each limit, e.g.
+      {"ip": "10.0.0.1"}.  Empty keys and keys of disabled limits are ignored.
+    :raises RateLimited: if the request exceeds any of the limits (in which
+      case it isn't counted against any of them)
+    """
+    self.admit_all([keys])
+
+  def admit_all(self, requests):
+    """
+    Counts several requests made together (e.g. the registrations in a batch)
+    as one request against each limit: a key which several of them share is
+    only counted once.  Either all of them are allowed or none are.
+    :param requests: a list of dictionaries of each request's keys (as for
+      admit)
+    :raises RateLimited: if the requests exceed any of the limits
+    """
+    keys = set()
+    for request_keys in requests:
+      keys.update((name, key) for name, key in request_keys.items() if key and name in self.limits)
+    buckets = [("{}:{}".format(name, key), self.limits[name], name) for name, key in sorted(keys)]
+    if not buckets:
+      return
+    retry_afters = self.store.update([(key, bucket) for key, bucket, name in buckets], time.time())
+    exceeded = [(retry_after, name) for (key, bucket, name), retry_after in zip(buckets, retry_afters) if retry_after]
+    if exceeded:
+      retry_after, name = max(exceeded)
+      raise RateLimited("Too many requests (by {})".format(name), retry_after)
+
+  def stats(self):
+    return {
+      "limits": dict((name, {"rate": bucket.rate, "burst": bucket.burst}) for name, bucket in self.limits.items()),
+      "keys": self.store.size()
+    }
@@ -0,0 +1,61 @@
+"""
+Purpose: Serve this API's OpenAPI specification efficiently.  The specification
+is read from disk once.  It is rendered (with the ${HOST} placeholder replaced)
+once per distinct base URL, and each rendering is kept with a gzipped copy and 
+strong ETags so repeated requests can be answered without any work (or with 
+HTTP 304 Not Modified).
+"""
+import gzip
+import hashlib
+import io
+import json
+from .cache import TTLCache
+
+HOST_PLACEHOLDER = "${HOST}"
+
+class SpecVariant(object):
+  """
+  The specification rendered for one base URL
+  """
+  __slots__ = ("body", "etag", "gzip_body", "gzip_etag")
+
+  def __init__(self, text):
+    self.body = text.encode("utf-8")
+    digest = hashlib.sha256(self.body).hexdigest()[:32]
+    self.etag = digest
+    #a compressed representation is a different representation, so it has its own etag
+    self.gzip_body = _gzip(self.body)
+    self.gzip_etag = "{}-gzip".format(digest)
+
+class ApiSpec(object):
+  """
+  An OpenAPI specification file containing a ${HOST} placeholder for the base URL
+  """
+
+  def __init__(self, filename, max_variants=16):
+    """
+    :param filename: the specification file
+    :param max_variants: the maximum number of base URLs to keep renderings for
+    """
+    with open(filename) as f:
+      self.source = f.read()
+    #the parsed specification (for its schemas)
+    self.document = json.loads(self.source)
+    self._variants = TTLCache(ttl=float("inf"), max_size=max_variants, name="api spec")
+
+  def render(self, base_url):
+    """
+    :param base_url: the base URL of this API, as seen by the client
+    :return: a SpecVariant
+    """
+    return self._variants.get(base_url, self._render)
+
+  def _render(self, base_url):
+    return SpecVariant(self.source.replace(HOST_PLACEHOLDER, base_url))
+
+def _gzip(data):
+  #a fixed mtime so that the compressed bytes (and so the etag) are stable
+  buf = io.BytesIO()
+  with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+    f.write(data)
+  return buf.getvalue()
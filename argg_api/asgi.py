@@ -0,0 +1,361 @@
+"""
+Purpose: An ASGI entry point which serves the busiest endpoints of this API,
+GET / and POST /register (and the health and readiness probes), with asyncio.
+A registration spends nearly all of its time waiting for BCDC, and here that
+waiting costs a coroutine rather than a worker thread or greenlet, so one
+process can have many more registrations in progress.  e.g.
+  uvicorn argg_api.asgi:app --workers 4
+
+Registrations are validated, admitted, made idempotent and described to BCDC
+by the same code as in main.py (the WSGI app); only the requests to BCDC (see
+bcdc_async.py) are made differently.  Blocking work which remains (probing the
+API's URLs and sending the notification email) runs in a thread pool.
+
+Other endpoints (including /register/batch, jobs, /status and /metrics) are
+only served by main.py, and 'Prefer: respond-async' is ignored: registrations
+are always completed before responding.
+"""
+import asyncio
+import logging
+import time
+from . import jsoncodec
+from . import main
+from . import settings
+from .bcdc import InlineResourcesRejected, PackageNameTaken
+from .bcdc_async import AsyncBcdcClient
+from .breaker import AsyncBulkhead, BulkheadFull, Unavailable
+from .admission import RateLimited
+from .idempotency import IdempotencyKeyReused, RequestInProgress, body_fingerprint, idempotency_key
+
+logger = logging.getLogger(__name__)
+logger.setLevel(getattr(logging, settings.LOG_LEVEL))
+
+#requests to BCDC share one connection pool
+bcdc_client = AsyncBcdcClient()
+
+#Each worker process handles a limited number of registrations at once, with a
+#short queue for the rest (as main.register_slots)
+register_slots = AsyncBulkhead("/register", settings.REGISTER_MAX_CONCURRENT, max_wait=settings.REGISTER_MAX_WAIT, max_waiting=settings.REGISTER_MAX_WAITING)
+
+#------------------------------------------------------------------------------
+# ASGI application
+#------------------------------------------------------------------------------
+
+async def app(scope, receive, send):
+  """
+  The ASGI (3.0) application
+  """
+  if scope["type"] == "lifespan":
+    await lifespan(receive, send)
+    return
+  if scope["type"] != "http":
+    return
+
+  request = Request(scope, receive)
+  handler = ROUTES.get((request.path, request.method))
+  route = request.path if handler else "unmatched"
+  start = time.monotonic()
+  main.requests_in_progress.inc(route=route)
+  status_code = 500
+  try:
+    if handler and main.lifecycle.config_errors and request.path not in ["/healthz", "/readyz"]:
+      status_code, headers, body = json_response({"msg": "The service is misconfigured.  See /readyz."}, 503)
+    elif handler:
+      status_code, headers, body = await handler(request)
+    elif request.path in ROUTE_PATHS:
+      status_code, headers, body = json_response({"msg": "Method not allowed"}, 405)
+    else:
+      status_code, headers, body = json_response({"msg": "Not found"}, 404)
+    await send_response(send, status_code, headers, body)
+  finally:
+    main.requests_in_progress.dec(route=route)
+    main.request_duration.observe(time.monotonic() - start, route=route, method=request.method)
+    main.requests_total.inc(route=route, method=request.method, status=status_code)
+
+async def lifespan(receive, send):
+  while True:
+    message = await receive()
+    if message["type"] == "lifespan.startup":
+      await send({"type": "lifespan.startup.complete"})
+    elif message["type"] == "lifespan.shutdown":
+      await bcdc_client.aclose()
+      await send({"type": "lifespan.shutdown.complete"})
+      return
+
+class Request(object):
+  """
+  The parts of an ASGI http request used by the handlers
+  """
+
+  def __init__(self, scope, receive):
+    self.scope = scope
+    self.receive = receive
+    self.method = scope["method"]
+    self.path = scope["path"]
+    self.headers = dict((name.decode("latin-1").lower(), value.decode("latin-1")) for name, value in scope["headers"])
+
+  @property
+  def base_url(self):
+    host = self.headers.get("host")
+    if not host and self.scope.get("server"):
+      host = "{}:{}".format(*self.scope["server"])
+    return "{}://{}{}".format(self.scope.get("scheme", "http"), host or "localhost", self.scope.get("root_path", ""))
+
+  @property
+  def client_ip(self):
+    client = self.scope.get("client")
+    return main.forwarded_client_ip(client[0] if client else None, self.headers.get("x-forwarded-for"))
+
+  async def body(self):
+    chunks = []
+    more_body = True
+    while more_body:
+      message = await self.receive()
+      chunks.append(message.get("body", b""))
+      more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+def json_response(body, status_code, headers=None):
+  """
+  :return: a tuple (http status code, headers dictionary, body bytes)
+  """
+  headers = dict(headers or {}, **{"Content-Type": "application/json"})
+  return status_code, headers, jsoncodec.dumps_bytes(body)
+
+async def send_response(send, status_code, headers, body):
+  headers = dict(headers, **{"Content-Length": "{}".format(len(body))})
+  await send({
+    "type": "http.response.start",
+    "status": status_code,
+    "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+  })
+  await send({"type": "http.response.body", "body": body})
+
+#------------------------------------------------------------------------------
+# Endpoints
+#------------------------------------------------------------------------------
+
+async def api(request):
+  """
+  Summary information about this API (its OpenAPI specification), as main.api
+  """
+  variant = main.api_spec.render(request.base_url)
+  use_gzip = accepts_gzip(request.headers.get("accept-encoding", ""))
+  etag = variant.gzip_etag if use_gzip else variant.etag
+  headers = {
+    "ETag": '"{}"'.format(etag),
+    "Cache-Control": "public, max-age={}".format(settings.API_SPEC_MAX_AGE),
+    "Vary": "Accept-Encoding"
+  }
+  if etag_matches(request.headers.get("if-none-match", ""), etag):
+    return 304, headers, b""
+  headers["Content-Type"] = "application/json"
+  if use_gzip:
+    headers["Content-Encoding"] = "gzip"
+  return 200, headers, variant.gzip_body if use_gzip else variant.body
+
+async def register(request):
+  """
+  Post a new API to be registered, as main.register
+  """
+  if request.headers.get("content-type") != "application/json":
+    return json_response({"msg": "Invalid Content-Type.  Expecting application/json"}, 400)
+  try:
+    req_data = jsoncodec.loads(await request.body())
+  except ValueError:
+    return json_response({"msg": "content req_data is not valid json"}, 400)
+
+  #admission control: rate limits by submitter and client (kept in a SQLite
+  #file by default, so checked in a thread), then one of a limited number of
+  #slots
+  try:
+    await run_in_thread(main.rate_limiter.admit, main.rate_limit_keys(req_data, request.client_ip))
+    async with register_slots.slot():
+      body, status_code, headers = await admitted_registration(request, req_data)
+  except (RateLimited, BulkheadFull) as e:
+    body, status_code, headers = main.too_many_requests_response(e)
+  return json_response(body, status_code, headers)
+
+async def admitted_registration(request, req_data):
+  """
+  Handles a request to /register which has passed admission control, as
+  main.admitted_registration
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  if not main.idempotent_requests:
+    return await process_registration(req_data)
+
+  #a retry of an earlier registration gets the earlier registration's response
+  fingerprint = body_fingerprint(req_data)
+  key = idempotency_key(request.headers.get("idempotency-key"), fingerprint)
+  try:
+    body, status_code, headers, replayed = await main.idempotent_requests.run_async(key, fingerprint, lambda: process_registration(req_data))
+  except (IdempotencyKeyReused, RequestInProgress) as e:
+    return main.idempotency_conflict(e)
+  if replayed:
+    headers = dict(headers, **{"Idempotent-Replayed": "true"})
+  return body, status_code, headers
+
+async def healthz(request):
+  """
+  Liveness probe, as main.healthz
+  """
+  return json_response(main.lifecycle.health(), 200)
+
+async def readyz(request):
+  """
+  Readiness probe, as main.readyz
+  """
+  readiness = main.lifecycle.readiness()
+  return json_response(readiness, 200 if readiness["ready"] else 503)
+
+ROUTES = {
+  ("/", "GET"): api,
+  ("/register", "POST"): register,
+  ("/healthz", "GET"): healthz,
+  ("/readyz", "GET"): readyz
+}
+ROUTE_PATHS = set(path for path, method in ROUTES)
+
+#------------------------------------------------------------------------------
+# Registrations
+#------------------------------------------------------------------------------
+
+async def process_registration(req_data):
+  """
+  Validates and completes a registration, as main.process_registration
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  try:
+    req_data = await clean_and_validate_req_data(req_data)
+  except (ValueError, RuntimeError) as e:
+    return main.validation_failed(e)
+
+  resp, status_code = await complete_registration(req_data)
+  return resp, status_code, main.registration_headers(resp, status_code)
+
+async def clean_and_validate_req_data(req_data):
+  """
+  As main.clean_and_validate_req_data, looking organizations up concurrently
+  """
+  with main.validation_duration.time():
+    req_data = main.clean_req_data(req_data)
+    organizations = await bcdc_client.get_organizations(main.referenced_org_ids(req_data))
+    return main.validate_organizations(req_data, organizations)
+
+async def complete_registration(req_data):
+  """
+  Completes a validated registration, as main.complete_registration
+  :return: a tuple (response body dictionary, http status code)
+  """
+  success_resp = {}
+  metadata_web_url = req_data.get("existing_metadata_url")
+
+  #create a draft metadata record (if one doesn't exist yet)
+  if not metadata_web_url:
+    try:
+      package, resources_created = await create_package_with_resources(req_data)
+      if not package:
+        raise ValueError("Unknown reason")
+      success_resp["new_metadata_record"] = main.new_metadata_record(package)
+      metadata_web_url = success_resp["new_metadata_record"]["web_url"]
+    except (ValueError, RuntimeError) as e:
+      return main.metadata_record_failed(e)
+
+    if not resources_created:
+      await create_resources(package["id"], req_data)
+
+  try:
+    await run_in_thread(main.send_notification_email, req_data, metadata_web_url)
+  except Exception as e:
+    logger.error("Unable to send notification email for new API. {}".format(e))
+
+  return success_resp, 200
+
+async def create_package_with_resources(req_data):
+  """
+  As main.create_package_with_resources
+  :return: a tuple (package, resources_created)
+  """
+  #probe the API's urls (in a thread).  the results are cached for the resources.
+  await run_in_thread(main.url_probe.content_types, [
+    req_data["existing_api"].get("base_url"),
+    req_data["existing_api"].get("openapi_spec_url")
+  ])
+
+  if main.inline_resources_supported:
+    try:
+      return await create_package(req_data, resources=main.inline_resource_dicts(req_data)), True
+    except InlineResourcesRejected as e:
+      #fall back to creating the resources separately
+      main.inline_resources_rejected(e)
+
+  return await create_package(req_data), False
+
+async def create_package(req_data, resources=None):
+  """
+  As main.create_package
+  """
+  try:
+    return await bcdc_client.package_create(main.package_dict_for(req_data, resources), api_key=settings.BCDC_API_KEY)
+  except PackageNameTaken:
+    if not settings.BCDC_AUTO_UNIQUE_NAME:
+      raise
+    #the name has now been added to the package name index, so the next is tried
+    return await bcdc_client.package_create(main.package_dict_for(req_data, resources), api_key=settings.BCDC_API_KEY)
+
+async def create_resources(package_id, req_data):
+  """
+  Adds the "API root" and "API specification" resources to a package, as
+  main.create_api_root_resource and main.create_api_spec_resource
+  """
+  for name, resource_dict in [
+      ("API root", main.api_root_resource_dict(req_data, package_id)),
+      ("API spec", main.api_spec_resource_dict(req_data, package_id))]:
+    if not resource_dict:
+      continue
+    try:
+      await bcdc_client.resource_create(resource_dict, api_key=settings.BCDC_API_KEY)
+    except (ValueError, Unavailable) as e:
+      logger.warning("Unable to create {} resource associated with the new metadata record. {}".format(name, e))
+
+#------------------------------------------------------------------------------
+# Helper functions
+#------------------------------------------------------------------------------
+
+def run_in_thread(func, *args):
+  """
+  Runs a blocking function in the event loop's default thread pool
+  """
+  return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+def accepts_gzip(accept_encoding):
+  """
+  Whether an Accept-Encoding header allows gzip (with a non-zero q value)
+  """
+  for coding in accept_encoding.split(","):
+    parts = [part.strip() for part in coding.split(";")]
+    if parts[0].lower() not in ["gzip", "*"]:
+      continue
+    for param in parts[1:]:
+      if param.startswith("q="):
+        try:
+          return float(param[2:]) > 0
+        except ValueError:
+          return False
+    return True
+  return False
+
+def etag_matches(if_none_match, etag):
+  """
+  Whether an If-None-Match header matches an etag (by weak comparison)
+  """
+  for tag in if_none_match.split(","):
+    tag = tag.strip()
+    if tag == "*":
+      return True
+    if tag.startswith("W/"):
+      tag = tag[2:]
+    if tag.strip('"') == etag:
+      return True
+  return False
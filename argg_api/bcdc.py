@@ -1,33 +1,438 @@
-import json
+import logging
+import os
 import requests
 import re
+import threading
+import time
+from contextlib import contextmanager
 from . import settings
+from . import metrics
+from . import tracing
+from . import jsoncodec
+from .breaker import CircuitBreakers, Bulkhead, Unavailable, CircuitOpen
+from .cache import TTLCache
+from .concurrency import WorkerPool
+from .httpclient import HttpClient
+from .nameindex import NameSet
+from .logs import truncate
+
+logger = logging.getLogger(__name__)
+
+class InlineResourcesRejected(ValueError):
+  """
+  Raised when BCDC rejects a package because of the resources included in it
+  """
+  pass
+
+class PackageNameTaken(ValueError):
+  """
+  Raised when a package can't be created because its name is already taken
+  (either according to the package name index, or by BCDC)
+  """
+  pass
+
+#The message with which BCDC rejects a package whose name is taken
+NAME_TAKEN_MSG = "That URL is already in use."
+
+#The maximum length of a package name in BCDC
+MAX_PACKAGE_NAME_LENGTH = 100
+
+request_duration = metrics.histogram("argg_bcdc_request_duration_seconds", "Time taken by requests to BCDC, by action", ["action"])
+requests_total = metrics.counter("argg_bcdc_requests_total", "Requests to BCDC, by action and HTTP status (or 'error' if no response was received, or 'circuit_open' or 'bulkhead_full' if the request wasn't sent)", ["action", "status"])
+requests_in_progress = metrics.gauge("argg_bcdc_requests_in_progress", "Requests to BCDC waiting for a response, by action", ["action"])
+
+#All requests to BCDC share this client, so connections to the catalogue are
+#pooled and kept alive between requests
+client = HttpClient(
+  pool_size=settings.BCDC_POOL_SIZE,
+  connect_timeout=settings.BCDC_CONNECT_TIMEOUT,
+  read_timeout=settings.BCDC_READ_TIMEOUT,
+  retries=settings.BCDC_RETRIES,
+  retry_backoff=settings.BCDC_RETRY_BACKOFF,
+  headers={
+    "Content-Type": "application/json",
+    "Accept": "application/json",
+    "User-Agent": "argg-api"
+  })
+
+#Each action has a circuit breaker, so that when BCDC is failing (or very slow)
+#requests fail fast rather than waiting on it
+breakers = CircuitBreakers(
+  "BCDC",
+  window=settings.BCDC_BREAKER_WINDOW,
+  min_calls=settings.BCDC_BREAKER_MIN_CALLS,
+  failure_rate=settings.BCDC_BREAKER_FAILURE_RATE,
+  slow_call_duration=settings.BCDC_BREAKER_SLOW_CALL_DURATION,
+  slow_call_rate=settings.BCDC_BREAKER_SLOW_CALL_RATE,
+  open_duration=settings.BCDC_BREAKER_OPEN_DURATION)
+
+#Requests to BCDC may only occupy a limited number of this process's workers
+bulkhead = Bulkhead("BCDC", settings.BCDC_MAX_CONCURRENT_REQUESTS, max_wait=settings.BCDC_BULKHEAD_MAX_WAIT)
+
+#Organizations rarely change, so lookups are cached.  Unknown ids are cached too
+#(for a shorter time), and stale organizations continue to be served while they
+#are refreshed so a slow catalogue doesn't hold up validation.
+_organization_cache = TTLCache(
+  ttl=settings.ORG_CACHE_TTL,
+  max_size=settings.ORG_CACHE_MAX_SIZE,
+  negative_ttl=settings.ORG_CACHE_NEGATIVE_TTL,
+  stale_ttl=settings.ORG_CACHE_STALE_TTL,
+  name="organization cache")
+
+class _RefreshedIndex(object):
+  """
+  Base class for in-memory copies of sets of things in BCDC, which are
+  reloaded periodically.  Subclasses implement load().
+  """
+  description = None #what the index holds, for log messages
+
+  def __init__(self):
+    self._count = 0
+    self.loaded_at = None
+    self.last_error = None
+    self._refresh_thread = None
+    self._refresh_pid = None #the process which started the refresh thread
+
+  def load(self):
+    raise NotImplementedError()
+
+  def start_refresh(self, interval):
+    """
+    Loads the index in a background thread, then reloads it every 'interval' 
+    seconds.  If a reload fails the previous index is kept.  Threads don't
+    survive a fork, so a forked process starts its own.
+    """
+    if self._refresh_thread and self._refresh_pid == os.getpid():
+      return
+    self._refresh_pid = os.getpid()
+    self._refresh_thread = threading.Thread(target=self._refresh_forever, args=(interval,), daemon=True)
+    self._refresh_thread.start()
+
+  def _refresh_forever(self, interval):
+    #the index may already have been loaded (e.g. while warming up)
+    if self.loaded_at:
+      time.sleep(max(0, self.loaded_at + interval - time.time()))
+    while True:
+      try:
+        self.load()
+      except Exception as e:
+        self.last_error = "{}".format(e)
+        logger.warning("Unable to load {} from BCDC. {}".format(self.description, e))
+      time.sleep(interval)
+
+  def _loaded(self, count):
+    self._count = count
+    self.loaded_at = time.time()
+    self.last_error = None
+    logger.info("Loaded {} {} from BCDC".format(count, self.description))
+
+  def stats(self):
+    return {
+      "size": self._count,
+      "loaded_at": self.loaded_at,
+      "last_error": self.last_error
+    }
+
+class _OrganizationIndex(_RefreshedIndex):
+  """
+  An in-memory copy of all BCDC organizations, keyed by both id and name.  The
+  index is replaced as a whole each time it is reloaded, so readers never see
+  a partially loaded index.
+  """
+  description = "organizations"
+
+  def __init__(self):
+    _RefreshedIndex.__init__(self)
+    self._orgs = {}
+
+  def get(self, org_id):
+    return self._orgs.get(org_id)
+
+  def load(self):
+    """
+    Replaces the index with the current set of organizations from BCDC
+    """
+    organizations = organization_list()
+    orgs = {}
+    for org in organizations:
+      orgs[org["id"]] = org
+      orgs[org["name"]] = org
+    self._orgs = orgs
+    self._loaded(len(organizations))
+
+class _PackageNameIndex(_RefreshedIndex):
+  """
+  The names of all BCDC packages, so that a name which is already taken can be
+  detected before trying to create a package with it.  Names are added as
+  packages are created (by this process), and the index is rebuilt from BCDC
+  when it is reloaded.
+
+  The index is only a hint: it misses names taken since it was loaded (by
+  other processes) and private packages which BCDC_API_KEY's user can't see.
+  BCDC may still reject a name which isn't in the index, so package creation
+  must handle PackageNameTaken.
+  """
+  description = "package names"
+
+  def __init__(self):
+    _RefreshedIndex.__init__(self)
+    self._names = NameSet()
+    self._added_while_loading = None
+    self._lock = threading.Lock()
+
+  def __contains__(self, name):
+    return name in self._names
+
+  def add(self, name):
+    with self._lock:
+      self._names.add(name)
+      if self._added_while_loading is not None:
+        self._added_while_loading.append(name)
+
+  def load(self):
+    """
+    Replaces the index with the current set of package names from BCDC (and
+    the names added while they were being fetched)
+    """
+    with self._lock:
+      self._added_while_loading = []
+    try:
+      names = NameSet(package_names())
+      with self._lock:
+        for name in self._added_while_loading:
+          names.add(name)
+        self._names = names
+    finally:
+      with self._lock:
+        self._added_while_loading = None
+    self._loaded(len(names))
+
+  def stats(self):
+    stats = _RefreshedIndex.stats(self)
+    stats["bytes"] = self._names.size_in_bytes()
+    return stats
+
+_organization_index = _OrganizationIndex()
+_package_name_index = _PackageNameIndex()
+
+#Organizations which aren't in the index are fetched concurrently through this pool
+_organization_lookup_pool = WorkerPool(settings.ORG_LOOKUP_CONCURRENCY)
 
 def get_organization(org_id):
   """
-  Gets an organization given its id
+  Gets an organization given its id (or name).  Organizations are resolved from 
+  the in-memory organization index if possible.  Otherwise they are fetched 
+  individually and cached.
   :param org_id: the id of the organiztion to fetch
+  :return: the organization, or None if there is no organization with the given id
+  """
+  if not org_id:
+    return None
+
+  organization = _organization_index.get(org_id)
+  if organization:
+    return organization
+
+  return _organization_cache.get(org_id, _fetch_organization)
+
+def get_organizations(org_ids):
+  """
+  Gets several organizations at once.  Organizations which need to be fetched
+  from BCDC are fetched concurrently.
+  :param org_ids: a list of organization ids.  Duplicates and empty ids are ignored.
+  :return: a tuple of two dictionaries: (organizations by id, exceptions by id).
+    Each non-empty id appears in exactly one of the dictionaries.  Unknown ids 
+    map to None in the organizations dictionary.
+  """
+  organizations = {}
+  to_fetch = []
+  for org_id in org_ids:
+    if not org_id or org_id in organizations or org_id in to_fetch:
+      continue
+    organization = _organization_index.get(org_id)
+    if organization:
+      organizations[org_id] = organization
+    else:
+      to_fetch.append(org_id)
+
+  errors = {}
+  outcomes = _organization_lookup_pool.run([_organization_getter(org_id) for org_id in to_fetch])
+  for org_id, (organization, error) in zip(to_fetch, outcomes):
+    if error:
+      errors[org_id] = error
+    else:
+      organizations[org_id] = organization
+
+  return (organizations, errors)
+
+async def get_organization_async(org_id, fetch):
+  """
+  The asynchronous equivalent of get_organization, for clients which fetch
+  organizations themselves (see bcdc_async.py).  Fetched organizations share
+  the cache (and its refreshes and single loads) with get_organization.
+  :param fetch: a coroutine function which fetches an organization by id (and
+    returns None if there is no organization with the id)
   """
   if not org_id:
     return None
 
-  url = "{}{}/action/organization_show?id={}".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH, org_id)
+  organization = _organization_index.get(org_id)
+  if organization:
+    return organization
+
+  return await _organization_cache.get_async(org_id, fetch)
+
+def _organization_getter(org_id):
+  return lambda: _organization_cache.get(org_id, _fetch_organization)
+
+def load_organization_index():
+  """
+  Loads all organizations into the in-memory organization index now (e.g. 
+  while warming up)
+  """
+  _organization_index.load()
+
+def load_package_name_index():
+  """
+  Loads the names of all packages into the package name index now (e.g. while
+  warming up)
+  """
+  _package_name_index.load()
+
+def open_connection():
+  """
+  Opens a connection to BCDC (with a cheap request), so that it is ready in
+  the pool for the first request which needs one
+  """
+  r = _send("GET", action_url("site_read"))
+  if r.status_code >= 400:
+    raise RuntimeError("Unexpected response from BCDC. URL was: {}. HTTP {}".format(r.url, r.status_code))
+
+def start_organization_index_refresh(interval):
+  """
+  Starts loading all organizations into the in-memory organization index, and
+  reloading them periodically
+  :param interval: the number of seconds between reloads
+  """
+  _organization_index.start_refresh(interval)
+
+def start_package_name_index_refresh(interval):
+  """
+  Starts loading the names of all packages into the package name index, and
+  reloading them periodically
+  :param interval: the number of seconds between reloads
+  """
+  _package_name_index.start_refresh(interval)
+
+def organization_cache_stats():
+  """
+  Hit/miss counters and size of the organization cache
+  """
+  return _organization_cache.stats()
+
+def organization_index_stats():
+  """
+  Size and freshness of the organization index
+  """
+  return _organization_index.stats()
+
+def organization_list():
+  """
+  Gets all organizations (including all their fields) from BCDC.  BCDC returns
+  a limited number of organizations per call, so the list is fetched in pages.
+  """
+  url = "{}{}/action/organization_list".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH)
+
+  organizations = []
+  while True:
+    params = {
+      "all_fields": "true",
+      "limit": settings.ORG_INDEX_PAGE_SIZE,
+      "offset": len(organizations)
+    }
+    r = _send("GET", url, params=params)
+
+    if r.status_code >= 400:
+      raise RuntimeError("Unable to fetch organization list from BCDC. URL was: {}".format(r.url))
+
+    response_dict = jsoncodec.loads(r.content)
+    assert response_dict['success'] is True
+    page = response_dict['result']
+    organizations.extend(page)
+    if len(page) < settings.ORG_INDEX_PAGE_SIZE:
+      break
+
+  return organizations
+
+def package_names():
+  """
+  Gets the names of all packages in BCDC, in pages: active and draft, public
+  and private.  (package_list would only include active public packages, but
+  the names of the others are taken too.)  Private packages are only included
+  if they are visible to BCDC_API_KEY's user, so the result may still be
+  incomplete.
+  """
+  url = action_url("package_search")
+
+  names = []
+  while True:
+    params = {
+      "q": "*:*",
+      "fl": "name",
+      "include_private": "true",
+      "include_drafts": "true",
+      "sort": "name asc",
+      "rows": settings.PACKAGE_NAME_INDEX_PAGE_SIZE,
+      "start": len(names)
+    }
+    r = _send("GET", url, params=params, headers={"Authorization": settings.BCDC_API_KEY})
+
+    if r.status_code >= 400:
+      raise RuntimeError("Unable to fetch package names from BCDC. URL was: {}".format(r.url))
+
+    response_dict = jsoncodec.loads(r.content)
+    assert response_dict['success'] is True
+    page = response_dict['result']['results']
+    names.extend(package["name"] for package in page)
+    if not page or len(names) >= response_dict['result']['count']:
+      break
+
+  return names
+
+def _fetch_organization(org_id):
+  """
+  Fetches an organization from BCDC, bypassing the cache
+  :param org_id: the id of the organiztion to fetch
+  """
+  url = organization_show_url(org_id)
    
-  headers = {
-    "Content-Type": "application/json",
-  }
-  r = requests.get(url, 
-      headers=headers
-    )
+  r = _send("GET", url)
   
-  if r.status_code == 404:
+  return organization_show_result(url, r.status_code, r.content)
+
+def action_url(action):
+  """
+  The url of a BCDC action (such as "package_create")
+  """
+  return "{}{}/action/{}".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH, action)
+
+def organization_show_url(org_id):
+  return "{}?id={}".format(action_url("organization_show"), org_id)
+
+def organization_show_result(url, status_code, body):
+  """
+  Interprets a response from organization_show
+  :param body: the body of the response (bytes)
+  :return: the organization, or None if there is no organization with the given id
+  """
+  if status_code == 404:
     return None
-  elif r.status_code >= 400:
+  elif status_code >= 400:
     raise RuntimeError("Unable to fetch organization by id from BCDC. URL was: {}".format(url))
     #raise ValueError("HTTP {} - {}".format(r.status_code, r.text))
   
   #get the response object
-  response_dict = json.loads(r.text)
+  response_dict = jsoncodec.loads(body)
   assert response_dict['success'] is True
   organization = response_dict['result']
 
@@ -43,35 +448,50 @@ def package_create(package_dict, api_key=None):
   url = "{}{}/action/package_create".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH)
    
   headers = {
-    "Content-Type": "application/json",
     "Authorization": api_key
   }
-  r = requests.post(url, 
-    data=json.dumps(package_dict),
+  r = _send("POST", url,
+    data=jsoncodec.dumps_bytes(package_dict),
     headers=headers
     )
   
-  print(r.text)
-  
+  if logger.isEnabledFor(logging.DEBUG):
+    logger.debug("package_create responded with HTTP {}: {}".format(r.status_code, truncate(_text(r.content), settings.LOG_MAX_PAYLOAD)))
+
+  return package_create_result(package_dict, r.status_code, r.content)
+
+def package_create_result(package_dict, status_code, body):
+  """
+  Interprets a response from package_create
+  :param body: the body of the response (bytes)
+  :return: the created package
+  """
   #A list of http codes returned by BCDC's package_create resource which correspond to errors
   #in the input data
   USER_INPUT_ERROR_CODES = [400, 409]
 
-  if r.status_code >= 400 and r.status_code not in USER_INPUT_ERROR_CODES:
+  if status_code >= 400 and status_code not in USER_INPUT_ERROR_CODES:
     raise RuntimeError("Unable to create metadata record")
 
   #get the response object
-  response_dict = json.loads(r.text)
+  response_dict = jsoncodec.loads(body)
   
-  if r.status_code in USER_INPUT_ERROR_CODES:
+  if status_code in USER_INPUT_ERROR_CODES:
+    if "resources" in package_dict and "resources" in response_dict.get("error", {}):
+      raise InlineResourcesRejected("{}".format(response_dict["error"]["resources"]))
     error_msg = response_dict.get("error", {}).get("name")
     if isinstance(error_msg, list):
       error_msg = " ".join(error_msg)
+    if error_msg and "already in use" in error_msg:
+      #remember the name, so it isn't tried again
+      _package_name_index.add(package_dict["name"])
+      raise PackageNameTaken(error_msg)
     raise ValueError("{}".format(error_msg))
 #  r.raise_for_status()
 #  print(r.text)
   
   created_package = response_dict['result']
+  _package_name_index.add(created_package["name"])
   return created_package
 
 
@@ -82,19 +502,18 @@ def package_delete(package, api_key):
   url = "{}{}/action/package_delete".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH)
    
   headers = {
-    "Content-Type": "application/json",
     "Authorization": api_key
   }
   data={
     "id": package["id"]
   }
-  r = requests.post(url, 
-    data=json.dumps(data),
+  r = _send("POST", url,
+    data=jsoncodec.dumps_bytes(data),
     headers=headers
     )
   
   if r.status_code >= 400:
-    raise ValueError("{} {}".format(r.status_code, r.text))
+    raise ValueError("{} {}".format(r.status_code, _text(r.content)))
 
 def resource_create(resource_dict, api_key=None):
   """
@@ -105,26 +524,90 @@ def resource_create(resource_dict, api_key=None):
   url = "{}{}/action/resource_create".format(settings.BCDC_BASE_URL, settings.BCDC_API_PATH)
    
   headers = {
-    "Content-Type": "application/json",
     "Authorization": api_key
   }
-  r = requests.post(url, 
-    data=json.dumps(resource_dict),
+  r = _send("POST", url,
+    data=jsoncodec.dumps_bytes(resource_dict),
     headers=headers
     )
 
-  if r.status_code >= 400:
-    raise ValueError("{} {}".format(r.status_code, r.text))
+  return resource_create_result(r.status_code, r.content)
+
+def resource_create_result(status_code, body):
+  """
+  Interprets a response from resource_create
+  :param body: the body of the response (bytes)
+  :return: the created resource
+  """
+  if status_code >= 400:
+    raise ValueError("{} {}".format(status_code, _text(body)))
 #  r.raise_for_status()
 #  print(r.text)
   
   #get the response object
-  response_dict = json.loads(r.text)
+  response_dict = jsoncodec.loads(body)
   assert response_dict['success'] is True
   created_package = response_dict['result']
 
   return created_package
 
+def _send(method, url, **kwargs):
+  """
+  Sends a request to BCDC through the shared client, guarded by the action's 
+  circuit breaker and the bulkhead.  Failures to communicate with BCDC 
+  (connection errors, timeouts) are raised as RuntimeError.  Requests which 
+  aren't sent because BCDC is unavailable raise breaker.Unavailable (a 
+  RuntimeError).
+  """
+  with guard(url, requests.exceptions.RequestException) as record_status:
+    with bulkhead.slot():
+      r = client.request(method, url, **kwargs)
+    record_status(r.status_code)
+    return r
+
+@contextmanager
+def guard(url, transport_errors):
+  """
+  Guards a request to BCDC (made in the body of the 'with' statement) with the
+  circuit breaker of its action, and records its metrics.  The body must call
+  the yielded function with the HTTP status of the response.  Shared by the
+  synchronous client and the asynchronous one (bcdc_async.py), each of which
+  adds its own bulkhead.
+  :param transport_errors: the exception class(es) raised by the HTTP client 
+    when no response is received.  They are raised as RuntimeError.
+  """
+  action = url.split("?")[0].rsplit("/", 1)[-1]
+  status = {"code": "error"}
+  try:
+    with breakers.get(action).call() as set_failed:
+      with requests_in_progress.track_in_progress(action=action), request_duration.time(action=action), tracing.span("bcdc_" + action):
+        def record_status(status_code):
+          status["code"] = status_code
+          set_failed(status_code >= 500)
+        yield record_status
+  except Unavailable as e:
+    status["code"] = "circuit_open" if isinstance(e, CircuitOpen) else "bulkhead_full"
+    raise
+  except transport_errors as e:
+    raise RuntimeError("Unable to communicate with BCDC. URL was: {}. {}".format(url, e))
+  finally:
+    requests_total.inc(action=action, status=status["code"])
+
+def circuit_breaker_stats():
+  """
+  The state of the circuit breaker of each action, and of the bulkhead
+  """
+  return {
+    "circuit_breakers": breakers.stats(),
+    "bulkhead": bulkhead.stats()
+  }
+
+def _text(body):
+  """
+  The body of a response from BCDC as a str (for error messages and logs)
+  """
+  return body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+
 def package_id_to_web_url(package_id):
   """
   the web url needed to access a given package
@@ -139,5 +622,35 @@ def package_id_to_api_url(package_id):
 
 def prepare_package_name(s):
   s = s.lower()
-  s = re.sub('[\W\s]+', '-', s)
+  s = re.sub(r'[\W\s]+', '-', s)
   return s
+
+def package_name_taken(name):
+  """
+  Whether a package name is taken, according to the package name index.  (A 
+  name taken since the index was last loaded, by another process, or by a
+  private package the index can't see, isn't known to be taken until BCDC
+  rejects it.)
+  """
+  return name in _package_name_index
+
+def unique_package_name(name):
+  """
+  The first of name-2, name-3, ... which isn't taken (according to the package
+  name index).  The same name (and index) always give the same result.  BCDC
+  may still reject it (see package_name_taken), so callers retry on
+  PackageNameTaken.
+  """
+  suffix = 2
+  while True:
+    tail = "-{}".format(suffix)
+    candidate = name[:MAX_PACKAGE_NAME_LENGTH - len(tail)] + tail
+    if not package_name_taken(candidate):
+      return candidate
+    suffix += 1
+
+def package_name_index_stats():
+  """
+  Size (number of names, and bytes) and freshness of the package name index
+  """
+  return _package_name_index.stats()
@@ -0,0 +1,132 @@
+"""
+Purpose: An asyncio client for the parts of BCDC used by registrations
+(organization lookups, package and resource creation), for the ASGI entry
+point (asgi.py).  Requests are sent through one shared httpx.AsyncClient, so
+connections are pooled, and are guarded by the same circuit breakers and
+metrics as the synchronous client in bcdc.py.  Requests and responses are
+built and interpreted by bcdc.py too, so both clients behave the same way.
+
+httpx is optional.  Without it, the synchronous client's functions are run in
+a thread pool instead.
+"""
+import asyncio
+from . import bcdc
+from . import jsoncodec
+from . import settings
+from .breaker import AsyncBulkhead
+
+try:
+  import httpx
+except ImportError:
+  httpx = None
+
+class AsyncBcdcClient(object):
+  """
+  A BCDC client for use by coroutines.  The underlying connection pool is
+  created on first use, so that it belongs to the event loop which uses it.
+  """
+
+  def __init__(self, max_concurrent=None, max_wait=None):
+    """
+    :param max_concurrent: the maximum number of requests in progress at once
+      (and so of connections).  0 means no limit.
+    :param max_wait: the maximum number of seconds a request waits for one of
+      the max_concurrent slots
+    """
+    self.max_concurrent = settings.BCDC_MAX_CONCURRENT_REQUESTS if max_concurrent is None else max_concurrent
+    self.bulkhead = AsyncBulkhead("BCDC", self.max_concurrent,
+      max_wait=settings.BCDC_BULKHEAD_MAX_WAIT if max_wait is None else max_wait)
+    self._client = None
+
+  def _get_client(self):
+    if self._client is None:
+      #requests wait for a slot in the bulkhead rather than in the pool: the
+      #pool does work in proportion to the requests queued in it (and to its
+      #size) whenever a connection is released
+      limits = httpx.Limits(
+        max_connections=self.max_concurrent or None,
+        max_keepalive_connections=settings.BCDC_POOL_SIZE)
+      self._client = httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.BCDC_READ_TIMEOUT, connect=settings.BCDC_CONNECT_TIMEOUT),
+        transport=httpx.AsyncHTTPTransport(limits=limits, retries=settings.BCDC_RETRIES),
+        headers={
+          "Content-Type": "application/json",
+          "Accept": "application/json",
+          "User-Agent": "argg-api"
+        })
+    return self._client
+
+  async def aclose(self):
+    """
+    Closes the connection pool
+    """
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+
+  def stats(self):
+    return {"bulkhead": self.bulkhead.stats()}
+
+  async def _send(self, method, url, **kwargs):
+    """
+    The asynchronous equivalent of bcdc._send
+    """
+    client = self._get_client()
+    with bcdc.guard(url, httpx.TransportError) as record_status:
+      async with self.bulkhead.slot():
+        r = await client.request(method, url, **kwargs)
+      record_status(r.status_code)
+      return r
+
+  async def get_organizations(self, org_ids):
+    """
+    The asynchronous equivalent of bcdc.get_organizations.  Organizations
+    which aren't in the organization index or cache are fetched concurrently
+    (and cached).
+    """
+    if httpx is None:
+      return await _run_sync(bcdc.get_organizations, org_ids)
+
+    to_get = []
+    for org_id in org_ids:
+      if org_id and org_id not in to_get:
+        to_get.append(org_id)
+
+    organizations = {}
+    errors = {}
+    outcomes = await asyncio.gather(*[bcdc.get_organization_async(org_id, self._fetch_organization) for org_id in to_get], return_exceptions=True)
+    for org_id, outcome in zip(to_get, outcomes):
+      if isinstance(outcome, Exception):
+        errors[org_id] = outcome
+      else:
+        organizations[org_id] = outcome
+    return (organizations, errors)
+
+  async def _fetch_organization(self, org_id):
+    url = bcdc.organization_show_url(org_id)
+    r = await self._send("GET", url)
+    return bcdc.organization_show_result(url, r.status_code, r.content)
+
+  async def package_create(self, package_dict, api_key=None):
+    """
+    The asynchronous equivalent of bcdc.package_create
+    """
+    if httpx is None:
+      return await _run_sync(bcdc.package_create, package_dict, api_key)
+    r = await self._send("POST", bcdc.action_url("package_create"), content=jsoncodec.dumps_bytes(package_dict), headers={"Authorization": api_key})
+    return bcdc.package_create_result(package_dict, r.status_code, r.content)
+
+  async def resource_create(self, resource_dict, api_key=None):
+    """
+    The asynchronous equivalent of bcdc.resource_create
+    """
+    if httpx is None:
+      return await _run_sync(bcdc.resource_create, resource_dict, api_key)
+    r = await self._send("POST", bcdc.action_url("resource_create"), content=jsoncodec.dumps_bytes(resource_dict), headers={"Authorization": api_key})
+    return bcdc.resource_create_result(r.status_code, r.content)
+
+def _run_sync(func, *args):
+  """
+  Runs a blocking function in the event loop's default thread pool
+  """
+  return asyncio.get_event_loop().run_in_executor(None, func, *args)
@@ -0,0 +1,323 @@
+"""
+Purpose: Stop a slow or failing dependency (such as BCDC) from taking the whole
+service down with it.
+- A circuit breaker watches the outcomes of recent calls.  When too many of
+  them fail or are slow it "opens", and calls fail immediately (rather than
+  waiting on the dependency) until it has had time to recover.  Then a trial
+  call is let through: if it succeeds the breaker closes again.
+- A bulkhead limits how many calls to the dependency may be in progress at
+  once, so they can't tie up all of a process's workers (threads or greenlets).
+  Calls wait a short time for a free slot, then fail.
+Both raise a subclass of Unavailable, which says when it is worth retrying.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class Unavailable(RuntimeError):
+  """
+  Raised instead of calling a dependency which is unavailable
+  """
+
+  def __init__(self, msg, retry_after):
+    """
+    :param retry_after: the number of seconds after which a retry may succeed
+    """
+    super(Unavailable, self).__init__(msg)
+    self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class CircuitOpen(Unavailable):
+  pass
+
+class BulkheadFull(Unavailable):
+  pass
+
+class CircuitBreaker(object):
+  """
+  A count-based circuit breaker.  The outcomes of the last 'window' calls are
+  kept.  Once there have been at least 'min_calls' of them, the breaker opens
+  if the proportion which failed reaches 'failure_rate', or the proportion
+  which took at least 'slow_call_duration' seconds reaches 'slow_call_rate'.
+  """
+
+  def __init__(self, name, window=20, min_calls=10, failure_rate=0.5, slow_call_duration=10, slow_call_rate=0.8, open_duration=30):
+    """
+    :param name: the name of the breaker (for logs and errors)
+    :param open_duration: the number of seconds the breaker stays open before
+      a trial call is let through
+    """
+    self.name = name
+    self.window = window
+    self.min_calls = min_calls
+    self.failure_rate = failure_rate
+    self.slow_call_duration = slow_call_duration
+    self.slow_call_rate = slow_call_rate
+    self.open_duration = open_duration
+    self.state = CLOSED
+    self.opened_at = None
+    self.times_opened = 0
+    self._outcomes = deque(maxlen=window) #(failed, slow) pairs
+    self._trial_in_progress = False
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def call(self):
+    """
+    Guards a call to the dependency, which is made in the body of the 'with'
+    statement.  The call counts as failed if it raises an exception (other than
+    BulkheadFull, which means it wasn't made at all).  The yielded function can
+    mark a call which didn't raise an exception as failed (e.g. because of the
+    status of its response).
+    :raises CircuitOpen: if the breaker is open
+    """
+    self._before_call()
+    outcome = {"failed": False, "made": True}
+    def set_failed(failed):
+      outcome["failed"] = failed
+    start = time.monotonic()
+    try:
+      yield set_failed
+    except BulkheadFull:
+      outcome["made"] = False
+      raise
+    except BaseException:
+      outcome["failed"] = True
+      raise
+    finally:
+      self._record(outcome["made"], outcome["failed"], time.monotonic() - start)
+
+  def _before_call(self):
+    with self._lock:
+      if self.state == OPEN:
+        remaining = self.opened_at + self.open_duration - time.monotonic()
+        if remaining > 0:
+          raise CircuitOpen("The circuit breaker for {} is open".format(self.name), remaining)
+        self._transition(HALF_OPEN)
+      if self.state == HALF_OPEN:
+        #only one trial call at a time
+        if self._trial_in_progress:
+          raise CircuitOpen("The circuit breaker for {} is half open".format(self.name), 1)
+        self._trial_in_progress = True
+
+  def _record(self, made, failed, duration):
+    slow = duration >= self.slow_call_duration
+    with self._lock:
+      if self.state == HALF_OPEN:
+        self._trial_in_progress = False
+        if not made:
+          return
+        if failed or slow:
+          self._open()
+        else:
+          self._outcomes.clear()
+          self._transition(CLOSED)
+        return
+      #ignore calls which were already in progress when the breaker opened
+      if self.state == OPEN or not made:
+        return
+      self._outcomes.append((failed, slow))
+      calls = len(self._outcomes)
+      if calls == 0 or calls < self.min_calls:
+        return
+      failures = sum(1 for f, s in self._outcomes if f)
+      slow_calls = sum(1 for f, s in self._outcomes if s)
+      if failures >= self.failure_rate * calls or slow_calls >= self.slow_call_rate * calls:
+        logger.warning("{}: {} of the last {} calls failed and {} were slow (>= {}s)".format(
+          self.name, failures, calls, slow_calls, self.slow_call_duration))
+        self._open()
+
+  def _open(self):
+    self.opened_at = time.monotonic()
+    self.times_opened += 1
+    self._outcomes.clear()
+    self._transition(OPEN)
+
+  def _transition(self, state):
+    if state == self.state:
+      return
+    log = logger.warning if state == OPEN else logger.info
+    log("Circuit breaker for {} changed from {} to {}".format(self.name, self.state, state))
+    self.state = state
+
+  def stats(self):
+    with self._lock:
+      calls = len(self._outcomes)
+      stats = {
+        "state": self.state,
+        "calls": calls,
+        "failures": sum(1 for f, s in self._outcomes if f),
+        "slow_calls": sum(1 for f, s in self._outcomes if s),
+        "times_opened": self.times_opened
+      }
+      if self.state == OPEN:
+        stats["retry_after"] = max(0, self.opened_at + self.open_duration - time.monotonic())
+      return stats
+
+class Bulkhead(object):
+  """
+  Limits the number of concurrent calls to a dependency
+  """
+
+  def __init__(self, name, max_concurrent, max_wait=1, max_waiting=None):
+    """
+    :param name: the name of the dependency (for errors)
+    :param max_concurrent: the maximum number of calls in progress at once.  0
+      means no limit.
+    :param max_wait: the maximum number of seconds a call waits for a slot
+    :param max_waiting: the maximum number of calls waiting for a slot.  Calls
+      beyond that fail immediately.  None means no limit.
+    """
+    self.name = name
+    self.max_concurrent = max_concurrent
+    self.max_wait = max_wait
+    self.max_waiting = max_waiting
+    self.in_use = 0
+    self.waiting = 0
+    self.rejected = 0
+    self._semaphore = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+    self._lock = threading.Lock()
+
+  @contextmanager
+  def slot(self):
+    """
+    Holds a slot while the body of the 'with' statement runs
+    :raises BulkheadFull: if no slot became free within max_wait seconds
+    """
+    if not self._semaphore:
+      yield
+      return
+    with self._lock:
+      if self.max_waiting is not None and self.waiting >= self.max_waiting and self.in_use >= self.max_concurrent:
+        self.rejected += 1
+        raise BulkheadFull("Too many requests to {} are waiting".format(self.name), self.max_wait)
+      self.waiting += 1
+    acquired = self._semaphore.acquire(timeout=self.max_wait)
+    with self._lock:
+      self.waiting -= 1
+      if acquired:
+        self.in_use += 1
+      else:
+        self.rejected += 1
+    if not acquired:
+      raise BulkheadFull("Too many requests to {} are in progress".format(self.name), self.max_wait)
+    try:
+      yield
+    finally:
+      with self._lock:
+        self.in_use -= 1
+      self._semaphore.release()
+
+  def stats(self):
+    with self._lock:
+      return {
+        "max_concurrent": self.max_concurrent,
+        "max_waiting": self.max_waiting,
+        "in_use": self.in_use,
+        "waiting": self.waiting,
+        "rejected": self.rejected
+      }
+
+class AsyncBulkhead(Bulkhead):
+  """
+  A bulkhead for coroutines, which wait for a slot without blocking the event
+  loop.  Use 'async with bulkhead.slot():'.  Its counts are only changed from
+  the event loop's thread.
+  """
+
+  def __init__(self, name, max_concurrent, max_wait=1, max_waiting=None):
+    super(AsyncBulkhead, self).__init__(name, 0, max_wait=max_wait, max_waiting=max_waiting)
+    self.max_concurrent = max_concurrent
+    #created on first use, so that it belongs to the event loop which uses it
+    self._semaphore = None
+
+  def slot(self):
+    """
+    Holds a slot while the body of the 'async with' statement runs
+    :raises BulkheadFull: if no slot became free within max_wait seconds
+    """
+    return _AsyncSlot(self)
+
+  async def _acquire(self):
+    """
+    :return: True if a slot was taken (False if there is no limit)
+    """
+    if self.max_concurrent <= 0:
+      return False
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.max_concurrent)
+    if self.max_waiting is not None and self.waiting >= self.max_waiting and self.in_use >= self.max_concurrent:
+      self.rejected += 1
+      raise BulkheadFull("Too many requests to {} are waiting".format(self.name), self.max_wait)
+    self.waiting += 1
+    try:
+      await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+    except asyncio.TimeoutError:
+      self.rejected += 1
+      raise BulkheadFull("Too many requests to {} are in progress".format(self.name), self.max_wait)
+    finally:
+      self.waiting -= 1
+    self.in_use += 1
+    return True
+
+  def _release(self):
+    self.in_use -= 1
+    self._semaphore.release()
+
+class _AsyncSlot(object):
+  def __init__(self, bulkhead):
+    self.bulkhead = bulkhead
+    self.acquired = False
+
+  async def __aenter__(self):
+    self.acquired = await self.bulkhead._acquire()
+
+  async def __aexit__(self, exc_type, exc, tb):
+    if self.acquired:
+      self.bulkhead._release()
+
+class CircuitBreakers(object):
+  """
+  A circuit breaker for each of several actions (created when first used),
+  all with the same thresholds
+  """
+
+  def __init__(self, name, **options):
+    """
+    :param name: the name of the dependency.  Each breaker is named after it
+      and its action.
+    :param options: the thresholds of each breaker (see CircuitBreaker)
+    """
+    self.name = name
+    self.options = options
+    self._breakers = {}
+    self._lock = threading.Lock()
+
+  def get(self, action):
+    breaker = self._breakers.get(action)
+    if breaker is None:
+      with self._lock:
+        breaker = self._breakers.get(action)
+        if breaker is None:
+          breaker = CircuitBreaker("{} {}".format(self.name, action), **self.options)
+          self._breakers[action] = breaker
+    return breaker
+
+  def reset(self):
+    """
+    Forgets all breakers (closing them)
+    """
+    with self._lock:
+      self._breakers = {}
+
+  def stats(self):
+    return dict((action, breaker.stats()) for action, breaker in sorted(self._breakers.items()))
@@ -0,0 +1,266 @@
+"""
+Purpose: A small in-process cache with time-to-live expiry, LRU eviction,
+negative caching and stale-while-revalidate.  Values can be loaded by threads
+(get) or by coroutines (get_async), which share the same entries and loads.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class _Entry(object):
+  """
+  A cached value along with the times at which it becomes stale and expired
+  """
+  __slots__ = ("value", "stale_at", "expires_at")
+
+  def __init__(self, value, stale_at, expires_at):
+    self.value = value
+    self.stale_at = stale_at
+    self.expires_at = expires_at
+
+class _Load(object):
+  """
+  A load of a single key which is in progress.  Other callers asking for the
+  same key wait on this object rather than starting a second load: threads on
+  the 'done' event, and coroutines on futures which are resolved by callbacks.
+  """
+  __slots__ = ("done", "value", "error", "callbacks")
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.value = None
+    self.error = None
+    self.callbacks = [] #called (once) when the load finishes
+
+  def result(self):
+    if self.error:
+      raise self.error
+    return self.value
+
+#the outcomes of looking a key up (see TTLCache._find)
+_HIT = "hit"
+_REFRESH = "refresh"
+_LOAD = "load"
+_WAIT = "wait"
+
+def _resolve(future):
+  if not future.done():
+    future.set_result(None)
+
+class TTLCache(object):
+  """
+  A thread-safe cache of values produced by a loader function.
+  - Values are fresh for 'ttl' seconds.  None values (e.g. "not found") are
+    fresh for 'negative_ttl' seconds.
+  - After a value becomes stale it may still be served for up to 'stale_ttl'
+    seconds while it is reloaded in the background.
+  - When the cache holds more than 'max_size' entries, the least recently used
+    entries are evicted.
+  - Concurrent requests for the same missing key share a single load, whether
+    they are made by threads or coroutines.
+  """
+
+  def __init__(self, ttl, max_size, negative_ttl=None, stale_ttl=0, name="cache"):
+    self.ttl = ttl
+    self.max_size = max_size
+    self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+    self.stale_ttl = stale_ttl
+    self.name = name
+    self._entries = OrderedDict()
+    self._loads = {}
+    self._lock = threading.Lock()
+    self._counters = {
+      "hits": 0,
+      "stale_hits": 0,
+      "misses": 0,
+      "evictions": 0,
+      "load_errors": 0,
+      "refreshes": 0
+    }
+
+  def get(self, key, loader):
+    """
+    Gets the value for the given key, calling loader(key) if it isn't cached.
+    Exceptions raised by the loader are not cached; they are raised to every
+    caller waiting on that load.
+    :param key: the cache key
+    :param loader: a function which accepts the key and returns its value
+    """
+    with self._lock:
+      action, found = self._find(key)
+    if action == _HIT:
+      return found
+    if action == _REFRESH:
+      threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+      return found
+    if action == _LOAD:
+      return self._load(key, loader)
+    found.done.wait()
+    return found.result()
+
+  async def get_async(self, key, loader):
+    """
+    Like get, for coroutines.  A stale value is refreshed by a task on the
+    event loop, and a coroutine waiting for another caller's load doesn't block
+    the event loop.
+    :param loader: a coroutine function which accepts the key and returns its
+      value
+    """
+    with self._lock:
+      action, found = self._find(key)
+      if action == _WAIT:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        found.callbacks.append(lambda: loop.call_soon_threadsafe(_resolve, future))
+    if action == _HIT:
+      return found
+    if action == _REFRESH:
+      asyncio.ensure_future(self._refresh_async(key, loader))
+      return found
+    if action == _LOAD:
+      return await self._load_async(key, loader)
+    await future
+    return found.result()
+
+  def put(self, key, value):
+    """
+    Adds a value to the cache (or replaces the existing value) without calling
+    a loader
+    """
+    with self._lock:
+      self._store(key, value)
+
+  def clear(self):
+    """
+    Removes all entries from the cache.  Counters are not reset.
+    """
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    """
+    Summary information about the cache's size and effectiveness
+    """
+    with self._lock:
+      stats = dict(self._counters)
+      stats["size"] = len(self._entries)
+    stats["max_size"] = self.max_size
+    lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+    stats["hit_ratio"] = round((stats["hits"] + stats["stale_hits"]) / lookups, 4) if lookups else None
+    return stats
+
+  def _find(self, key):
+    """
+    Looks a key up, and registers a load of it if one is needed.  The caller
+    must hold self._lock.
+    :return: a tuple (action, value or load):
+      - (_HIT, value): the value is fresh
+      - (_REFRESH, value): the value is stale.  The caller must reload it in the
+        background (with _refresh).
+      - (_LOAD, load): the key isn't cached.  The caller must load it (with _load).
+      - (_WAIT, load): the key is being loaded by another caller
+    """
+    now = time.monotonic()
+    entry = self._entries.get(key)
+    if entry and now < entry.stale_at:
+      self._entries.move_to_end(key)
+      self._counters["hits"] += 1
+      return _HIT, entry.value
+    if entry and now < entry.expires_at:
+      self._entries.move_to_end(key)
+      self._counters["stale_hits"] += 1
+      if key in self._loads:
+        return _HIT, entry.value
+      self._loads[key] = _Load()
+      self._counters["refreshes"] += 1
+      return _REFRESH, entry.value
+
+    self._counters["misses"] += 1
+    load = self._loads.get(key)
+    if load is None:
+      load = self._loads[key] = _Load()
+      return _LOAD, load
+    return _WAIT, load
+
+  def _load(self, key, loader):
+    """
+    Calls the loader for the given key and stores the result.  Every caller
+    waiting on the load is released when it finishes.
+    """
+    try:
+      value = loader(key)
+    except Exception as e:
+      self._finish(key, error=e)
+      raise
+    self._finish(key, value)
+    return value
+
+  async def _load_async(self, key, loader):
+    """
+    Like _load, with a coroutine function loader
+    """
+    try:
+      value = await loader(key)
+    except BaseException as e:
+      #including cancellation, so that waiting callers aren't left waiting
+      self._finish(key, error=e)
+      raise
+    self._finish(key, value)
+    return value
+
+  def _finish(self, key, value=None, error=None):
+    """
+    Stores the result of a load (unless it failed) and releases every caller
+    waiting on it
+    """
+    with self._lock:
+      load = self._loads.pop(key)
+      load.value = value
+      load.error = error
+      if error:
+        self._counters["load_errors"] += 1
+      else:
+        self._store(key, value)
+      callbacks, load.callbacks = load.callbacks, []
+    load.done.set()
+    for callback in callbacks:
+      callback()
+
+  def _refresh(self, key, loader):
+    """
+    Reloads a stale value in the background.  If the reload fails the stale
+    value continues to be served until it expires.
+    """
+    try:
+      self._load(key, loader)
+    except Exception as e:
+      logger.warning("{}: unable to refresh '{}'. {}".format(self.name, key, e))
+
+  async def _refresh_async(self, key, loader):
+    """
+    Like _refresh, with a coroutine function loader
+    """
+    try:
+      await self._load_async(key, loader)
+    except Exception as e:
+      logger.warning("{}: unable to refresh '{}'. {}".format(self.name, key, e))
+
+  def _store(self, key, value):
+    """
+    Stores a value.  The caller must hold self._lock.
+    """
+    if self.max_size <= 0:
+      return
+    ttl = self.ttl if value is not None else self.negative_ttl
+    if ttl <= 0:
+      return
+    now = time.monotonic()
+    self._entries[key] = _Entry(value, now + ttl, now + ttl + self.stale_ttl)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+      self._counters["evictions"] += 1
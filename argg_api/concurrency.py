@@ -0,0 +1,140 @@
+"""
+Purpose: Run blocking calls (such as requests to BCDC) concurrently with a bounded
+number of workers.  When the application is served by gunicorn's gevent worker
+(see Dockerfile) the calls run in greenlets.  Otherwise they run in threads.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import tracing
+
+try:
+  import gevent.monkey
+  import gevent.pool
+except ImportError:
+  gevent = None
+
+def _gevent_is_active():
+  """
+  True if gevent has monkey-patched the standard library (as gunicorn's gevent
+  worker does before the application is loaded)
+  """
+  return gevent is not None and gevent.monkey.is_module_patched("socket")
+
+def start_native_thread(func):
+  """
+  Starts an operating system thread (which runs func, without arguments) even
+  under gevent, where threading.Thread starts a greenlet.  For work which
+  blocks without yielding to other greenlets, such as writing to a pipe.  The
+  thread mustn't use gevent's patched locks, sleep or sockets (see
+  native_sleep).
+  """
+  if _gevent_is_active():
+    gevent.monkey.get_original("_thread", "start_new_thread")(func, ())
+  else:
+    threading.Thread(target=func, daemon=True).start()
+
+def native_sleep(seconds):
+  """
+  time.sleep for threads started by start_native_thread
+  """
+  if _gevent_is_active():
+    gevent.monkey.get_original("time", "sleep")(seconds)
+  else:
+    time.sleep(seconds)
+
+class WorkerPool(object):
+  """
+  A bounded pool of workers shared by all requests handled by a process.  The
+  underlying pool is created on first use so that it belongs to the process
+  (and event loop) which uses it.
+  """
+
+  def __init__(self, size):
+    self.size = size
+    self._pool = None
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def run(self, funcs):
+    """
+    Calls each of the given functions (which take no arguments) concurrently
+    and waits for all of them to finish.
+    :param funcs: a list of functions
+    :return: a list of (result, exception) pairs, in the same order as funcs.
+      For each function, one of the pair is None.
+    """
+    if len(funcs) <= 1 or self.size <= 1:
+      return [_call(f) for f in funcs]
+
+    #the functions are timed as part of the current request (if any)
+    funcs = [tracing.bind(f) for f in funcs]
+    pool = self._get_pool()
+    if _gevent_is_active():
+      greenlets = [pool.spawn(_call, f) for f in funcs]
+      gevent.joinall(greenlets)
+      return [g.value for g in greenlets]
+
+    futures = [pool.submit(_call, f) for f in funcs]
+    return [f.result() for f in futures]
+
+  def as_completed(self, funcs):
+    """
+    Calls each of the given functions (which take no arguments) concurrently,
+    and yields their results as they finish.
+    :param funcs: a list of functions
+    :return: a generator of (index, result, exception) tuples, where index is
+      the position of the function in funcs
+    """
+    if len(funcs) <= 1 or self.size <= 1:
+      for index, func in enumerate(funcs):
+        yield (index,) + _call(func)
+      return
+
+    funcs = [tracing.bind(f) for f in funcs]
+    pool = self._get_pool()
+    indexed = lambda index, func: (index,) + _call(func)
+    if _gevent_is_active():
+      for item in pool.imap_unordered(lambda args: indexed(*args), list(enumerate(funcs))):
+        yield item
+      return
+
+    futures = [pool.submit(indexed, index, func) for index, func in enumerate(funcs)]
+    for future in as_completed(futures):
+      yield future.result()
+
+  def submit(self, func):
+    """
+    Calls the given function (which takes no arguments) in the background,
+    without waiting for it to finish.  The function's result is discarded, so
+    it should handle its own errors.  (It outlives the current request, so
+    isn't timed as part of it.)
+    """
+    pool = self._get_pool()
+    if _gevent_is_active():
+      #gevent.pool.Pool.spawn blocks the caller while the pool is full, so wait 
+      #for a free slot in a new greenlet instead
+      gevent.spawn(pool.apply, _call, (func,))
+    else:
+      pool.submit(_call, func)
+
+  def _get_pool(self):
+    with self._lock:
+      #a pool's threads don't survive a fork, so a forked process needs its own
+      if self._pool is None or self._pid != os.getpid():
+        self._pid = os.getpid()
+        if _gevent_is_active():
+          self._pool = gevent.pool.Pool(self.size)
+        else:
+          self._pool = ThreadPoolExecutor(max_workers=self.size)
+      return self._pool
+
+def _call(func):
+  """
+  Calls a function, capturing either its result or the exception it raised
+  """
+  try:
+    return (func(), None)
+  except Exception as e:
+    return (None, e)
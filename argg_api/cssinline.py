@@ -0,0 +1,291 @@
+"""
+Purpose: Prepare an html email template for mail clients by pruning its
+stylesheet to the rules which apply to the template's elements and inlining
+those rules as style attributes.  Rules which can't be inlined (such as :hover
+rules and @media blocks) are kept in a much smaller <style> element.
+
+Only the parts of CSS used by simple stylesheets are supported: type, class and
+universal selectors combined with the descendant and child combinators.
+Selectors with pseudo-classes, attributes, ids or sibling combinators are never
+inlined.
+"""
+import re
+from html.parser import HTMLParser
+
+STYLE_ELEMENT_RE = re.compile(r"<style[^>]*>(.*?)</style>\s*", re.DOTALL | re.IGNORECASE)
+STYLE_ATTRIBUTE_RE = re.compile(r"""\sstyle\s*=\s*(["'])(.*?)\1""", re.IGNORECASE | re.DOTALL)
+COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+COMPOUND_RE = re.compile(r"^(\*|[a-zA-Z][a-zA-Z0-9]*)?((?:\.[a-zA-Z_-][\w-]*)*)$")
+PSEUDO_RE = re.compile(r"::?[\w-]+(\([^)]*\))?")
+VENDOR_PREFIX_RE = re.compile(r"^-(webkit|moz|ms|o)-")
+
+#Elements which can't contain other elements (and so are never pushed on the stack)
+VOID_ELEMENTS = set(["area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"])
+
+#Elements which aren't displayed, so are never given style attributes
+UNSTYLED_ELEMENTS = set(["head", "title", "meta", "link", "style", "script", "br"])
+
+#@media queries for non-screen media are dropped
+SKIPPED_MEDIA = ["print", "speech"]
+
+class Rule(object):
+  """
+  A style rule: a list of selectors sharing a list of (property, value, important)
+  declarations
+  """
+  __slots__ = ("selectors", "declarations")
+
+  def __init__(self, selectors, declarations):
+    self.selectors = selectors
+    self.declarations = declarations
+
+  def css(self, selectors=None):
+    return "{} {{{}}}".format(",".join(selectors or self.selectors), ";".join(
+      "{}:{}{}".format(p, v, " !important" if i else "") for p, v, i in self.declarations))
+
+class MediaBlock(object):
+  """
+  An @media block containing rules
+  """
+  __slots__ = ("query", "rules")
+
+  def __init__(self, query, rules):
+    self.query = query
+    self.rules = rules
+
+def parse_css(css):
+  """
+  Parses a stylesheet into a list of Rule and MediaBlock objects.  At-rules other
+  than @media (e.g. @font-face, @keyframes) are discarded.
+  """
+  css = COMMENT_RE.sub("", css)
+  items = []
+  pos = 0
+  while True:
+    brace = css.find("{", pos)
+    if brace < 0:
+      break
+    prelude = css[pos:brace].strip()
+    end = _matching_brace(css, brace)
+    body = css[brace + 1:end]
+    pos = end + 1
+    if prelude.startswith("@"):
+      if prelude.lower().startswith("@media"):
+        query = prelude[len("@media"):].strip()
+        if not any(m in query.lower() for m in SKIPPED_MEDIA):
+          items.append(MediaBlock(query, [r for r in parse_css(body) if isinstance(r, Rule)]))
+      continue
+    selectors = [s.strip() for s in prelude.split(",") if s.strip()]
+    declarations = _parse_declarations(body)
+    if selectors and declarations:
+      items.append(Rule(selectors, declarations))
+  return items
+
+def _matching_brace(css, start):
+  depth = 0
+  for i in range(start, len(css)):
+    if css[i] == "{":
+      depth += 1
+    elif css[i] == "}":
+      depth -= 1
+      if depth == 0:
+        return i
+  return len(css)
+
+def _parse_declarations(body):
+  declarations = []
+  for declaration in body.split(";"):
+    prop, _, value = declaration.partition(":")
+    prop = prop.strip().lower()
+    value = value.strip()
+    #mail clients ignore vendor-specific properties
+    if not prop or not value or VENDOR_PREFIX_RE.match(prop):
+      continue
+    important = value.lower().endswith("!important")
+    if important:
+      value = value[:-len("!important")].strip()
+    declarations.append((prop, value, important))
+  return declarations
+
+class Element(object):
+  """
+  An element of an html document, and where its start tag is in the source
+  """
+  __slots__ = ("tag", "classes", "parent", "start", "end")
+
+  def __init__(self, tag, classes, parent, start=None, end=None):
+    self.tag = tag
+    self.classes = classes
+    self.parent = parent
+    self.start = start
+    self.end = end
+
+class _TreeBuilder(HTMLParser):
+  """
+  Builds a list of elements (with their parents) from html source.  Jinja
+  expressions and statements are treated as text.
+  """
+
+  def __init__(self, source):
+    HTMLParser.__init__(self, convert_charrefs=False)
+    self.source = source
+    self.line_offsets = [0]
+    for line in source.split("\n"):
+      self.line_offsets.append(self.line_offsets[-1] + len(line) + 1)
+    self.elements = []
+    self.stack = []
+
+  def handle_starttag(self, tag, attrs):
+    line, col = self.getpos()
+    start = self.line_offsets[line - 1] + col
+    end = start + len(self.get_starttag_text())
+    parent = self.stack[-1] if self.stack else None
+    #like browsers, put rows which are directly in a table into an implicit tbody
+    if tag == "tr" and parent is not None and parent.tag == "table":
+      parent = Element("tbody", frozenset(), parent)
+    classes = frozenset((dict(attrs).get("class") or "").split())
+    element = Element(tag, classes, parent, start, end)
+    self.elements.append(element)
+    if tag not in VOID_ELEMENTS:
+      self.stack.append(element)
+
+  def handle_startendtag(self, tag, attrs):
+    self.handle_starttag(tag, attrs)
+    if tag not in VOID_ELEMENTS:
+      self.stack.pop()
+
+  def handle_endtag(self, tag):
+    for i in range(len(self.stack) - 1, -1, -1):
+      if self.stack[i].tag == tag:
+        del self.stack[i:]
+        break
+
+def _parse_selector(selector):
+  """
+  Parses a selector into a list of (combinator, tag, classes) parts, from right
+  to left.  The combinator relates each part to the next one.  Returns None for
+  selectors which aren't supported.
+  """
+  tokens = re.sub(r"\s*>\s*", " > ", selector.strip()).split()
+  parts = []
+  combinator = None
+  for token in reversed(tokens):
+    if token == ">":
+      combinator = ">"
+      continue
+    match = COMPOUND_RE.match(token)
+    if not match or not token:
+      return None
+    tag = match.group(1) if match.group(1) != "*" else None
+    classes = frozenset(c for c in match.group(2).split(".") if c)
+    parts.append((combinator, tag and tag.lower(), classes))
+    combinator = " "
+  if not parts or combinator == ">":
+    return None
+  return parts
+
+def _specificity(parts):
+  return (0, sum(len(classes) for _, _, classes in parts), sum(1 for _, tag, _ in parts if tag))
+
+def _compound_matches(element, tag, classes):
+  return (tag is None or element.tag == tag) and classes <= element.classes
+
+def _matches(element, parts):
+  """
+  True if the element matches the parsed selector
+  """
+  _, tag, classes = parts[0]
+  if not _compound_matches(element, tag, classes):
+    return False
+  if len(parts) == 1:
+    return True
+  combinator = parts[1][0]
+  ancestor = element.parent
+  while ancestor is not None:
+    if _matches(ancestor, parts[1:]):
+      return True
+    if combinator == ">":
+      return False
+    ancestor = ancestor.parent
+  return False
+
+def _applies_to_any(selector, elements):
+  """
+  True if the selector, ignoring any pseudo-classes and pseudo-elements, matches
+  at least one of the elements.  Selectors with attributes never match.
+  """
+  parts = _parse_selector(PSEUDO_RE.sub("", selector))
+  return parts is not None and any(_matches(e, parts) for e in elements)
+
+def inline_css(html, css=""):
+  """
+  Moves the styles of an html document into style attributes.
+  :param html: the html document (which may be a template).  Any <style> elements
+    it contains are removed and their rules are processed along with 'css'.
+  :param css: an additional stylesheet, applied before the document's own <style> elements
+  :return: the html document with inline styles, and a <style> element (in the
+    document's <head>) containing only the rules which apply to the document
+    but can't be inlined
+  """
+  css = css + "\n" + "\n".join(STYLE_ELEMENT_RE.findall(html))
+  html = STYLE_ELEMENT_RE.sub("", html)
+
+  builder = _TreeBuilder(html)
+  builder.feed(html)
+  builder.close()
+  elements = builder.elements
+
+  #the declarations which apply to each element, with their precedence
+  styles = dict((id(e), []) for e in elements)
+  remaining = []
+  order = 0
+  for item in parse_css(css):
+    if isinstance(item, MediaBlock):
+      rules = [r.css([s for s in r.selectors if _applies_to_any(s, elements)]) for r in item.rules
+        if any(_applies_to_any(s, elements) for s in r.selectors)]
+      if rules:
+        remaining.append("@media {} {{{}}}".format(item.query, "".join(rules)))
+      continue
+
+    not_inlined = []
+    for selector in item.selectors:
+      parts = _parse_selector(selector)
+      if parts is None:
+        if _applies_to_any(selector, elements):
+          not_inlined.append(selector)
+        continue
+      specificity = _specificity(parts)
+      for element in elements:
+        if _matches(element, parts):
+          for prop, value, important in item.declarations:
+            order += 1
+            styles[id(element)].append(((important, specificity, order), prop, value))
+    if not_inlined:
+      remaining.append(item.css(not_inlined))
+
+  #add style attributes, from the end of the document so earlier offsets stay valid
+  for element in reversed(elements):
+    declarations = sorted(styles[id(element)])
+    if not declarations or element.tag in UNSTYLED_ELEMENTS:
+      continue
+    winners = {}
+    for _, prop, value in declarations:
+      winners.pop(prop, None)
+      winners[prop] = value
+    style = ";".join("{}:{}".format(p, v.replace('"', "'")) for p, v in winners.items())
+    start_tag = html[element.start:element.end]
+    #an existing style attribute takes precedence over the stylesheet
+    existing = STYLE_ATTRIBUTE_RE.search(start_tag)
+    if existing:
+      style = "{};{}".format(style, existing.group(2))
+      start_tag = start_tag[:existing.start()] + start_tag[existing.end():]
+    closing = 2 if start_tag.endswith("/>") else 1
+    start_tag = '{} style="{}"{}'.format(start_tag[:-closing].rstrip(), style, start_tag[-closing:])
+    html = html[:element.start] + start_tag + html[element.end:]
+
+  if remaining:
+    style_element = "<style>\n{}\n</style>\n".format("\n".join(remaining))
+    head = re.search(r"<head[^>]*>\s*", html, re.IGNORECASE)
+    position = head.end() if head else 0
+    html = html[:position] + style_element + html[position:]
+  return html
@@ -0,0 +1,60 @@
+"""
+Purpose: Notification email templates.  The templates (in the "templates" folder
+of this package) and the stylesheet they embed are loaded and compiled once, 
+when this module is imported, rather than for every email.
+
+The stylesheet is pruned to the rules which apply to each html template, and
+those rules are inlined into the template's elements as style attributes.  
+This keeps emails small and makes them display consistently in mail clients.
+"""
+import os
+from jinja2 import Environment, FileSystemLoader
+from . import settings
+from . import metrics
+from .cssinline import inline_css
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(PACKAGE_DIR, "templates")
+CSS_FILENAME = os.path.join(PACKAGE_DIR, "..", "css", "bootstrap.css")
+
+render_duration = metrics.histogram("argg_email_render_duration_seconds", "Time taken to render notification email templates, by template", ["template"])
+
+#The maximum size (in bytes) of a rendered html notification (see
+#tests/test_email_templates.py and benchmarks/bench_email_render.py)
+NOTIFICATION_SIZE_BUDGET = 8 * 1024
+
+#The names of all templates, which are compiled in advance
+TEMPLATE_NAMES = ["notification.html", "notification.txt", "batch_notification.html", "batch_notification.txt"]
+
+def _load_css():
+  with open(CSS_FILENAME, 'r') as css_file:
+    return css_file.read()
+
+def _load_template(name):
+  """
+  Compiles a template.  The stylesheet is embedded where an html template refers
+  to {{ css }}, then (if enabled) pruned and inlined.
+  """
+  source, _, _ = _environment.loader.get_source(_environment, name)
+  if name.endswith(".html"):
+    source = source.replace("{{ css }}", _css)
+    if settings.EMAIL_INLINE_CSS:
+      source = inline_css(source)
+  return _environment.from_string(source)
+
+_environment = Environment(
+  loader=FileSystemLoader(TEMPLATES_DIR),
+  auto_reload=False,
+  cache_size=-1)
+_css = _load_css()
+
+_templates = dict((name, _load_template(name)) for name in TEMPLATE_NAMES)
+
+def render(name, **params):
+  """
+  Renders one of the precompiled templates
+  :param name: the template's file name (e.g. "notification.html")
+  :param params: the template's parameters
+  """
+  with render_duration.time(template=name):
+    return _templates[name].render(**params)
@@ -1,14 +1,40 @@
 import smtplib
+import time
+from contextlib import contextmanager
+from . import metrics
+from . import tracing
+from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 SECURE_PORTS = [465, 587]
 
-def send_email(target_email_addresses_csv, email_subject="", email_body="", smtp_server=None, smtp_port=587, from_email_address=None, from_password=None):
+send_duration = metrics.histogram("argg_email_send_duration_seconds", "Time taken to send emails")
+sends_total = metrics.counter("argg_email_sends_total", "Emails sent, by result ('sent', 'refused' or 'error')", ["result"])
+sends_in_progress = metrics.gauge("argg_email_sends_in_progress", "Emails being sent")
+
+@contextmanager
+def _measure_send():
+  """
+  Records the time taken and result of sending an email
+  """
+  result = "error"
+  try:
+    with sends_in_progress.track_in_progress(), send_duration.time(), tracing.span("email_send"):
+      yield
+    result = "sent"
+  except ValueError:
+    result = "refused"
+    raise
+  finally:
+    sends_total.inc(result=result)
+
+def send_email(target_email_addresses_csv, email_subject="", email_body="", smtp_server=None, smtp_port=587, from_email_address=None, from_password=None, email_text_body=None):
   """
   Sends an email
   :param target_email_addresses_csv: a csv list of email recipients
   :email_subject: the subject line of the email
-  :email_body: the content body of the email
+  :email_body: the content body of the email (html)
+  :email_text_body: an optional plain text alternative to email_body
   :smtp_server: the SMTP server to use
   :from_email_address: the email address to send from
   :from_password: the password of the email account to send from
@@ -21,16 +47,39 @@ def send_email(target_email_addresses_csv, email_subject="", email_body="", smtp
   if not smtp_server:
     raise ValueError("precondition failed.  'smtp_server' must not be None")
   
-  smtp_port = int(smtp_port)
-
   target_email_addresses = target_email_addresses_csv.split(",")
+  msg = prepare_message(target_email_addresses_csv, email_subject, email_body, from_email_address, email_text_body)
+
+  with _measure_send():
+    s = connect(smtp_server, smtp_port, from_email_address, from_password)
+    try:
+      s.sendmail(from_email_address, target_email_addresses, msg.as_string())
+    except smtplib.SMTPRecipientsRefused as e:
+      raise ValueError(e)
+    s.quit()
 
-  msg = MIMEText(email_body, "html")
+def prepare_message(target_email_addresses_csv, email_subject, email_body, from_email_address, email_text_body=None):
+  """
+  Creates an html email message.  If email_text_body is given the message also
+  includes it as a plain text alternative.
+  """
+  if email_text_body:
+    msg = MIMEMultipart("alternative")
+    msg.attach(MIMEText(email_text_body, "plain"))
+    msg.attach(MIMEText(email_body, "html"))
+  else:
+    msg = MIMEText(email_body, "html")
   msg["From"] = from_email_address
   msg["To"] = target_email_addresses_csv
   msg["Subject"] = email_subject
+  return msg
 
-  s = None
+def connect(smtp_server, smtp_port, from_email_address=None, from_password=None):
+  """
+  Opens a connection to an SMTP server, logging in if the port is a secure port
+  :return: an smtplib.SMTP (or SMTP_SSL) object
+  """
+  smtp_port = int(smtp_port)
   if smtp_port in SECURE_PORTS:
     s = smtplib.SMTP_SSL(smtp_server, smtp_port)
     try:
@@ -39,9 +88,67 @@ def send_email(target_email_addresses_csv, email_subject="", email_body="", smtp
       raise ValueError("Unable to login to SMPT server.  Invalid credentials")
   else:
     s = smtplib.SMTP(smtp_server, smtp_port)
+  return s
 
-  try:
-    s.sendmail(from_email_address, target_email_addresses, msg.as_string())
-  except smtplib.SMTPRecipientsRefused as e:
-    raise ValueError(e)
-  s.quit()
\ No newline at end of file
+class SMTPConnection(object):
+  """
+  A connection to an SMTP server which is kept open (and logged in) between
+  messages.  The connection is re-established if the server has closed it.
+  Not thread-safe: use one SMTPConnection per sending thread.
+  """
+
+  def __init__(self, smtp_server, smtp_port, from_email_address, from_password=None, idle_timeout=60):
+    """
+    :param idle_timeout: after this many seconds without sending, the connection
+      is checked (with NOOP) before it is reused
+    """
+    if not from_email_address:
+      raise ValueError("precondition failed.  'from_email_address' must not be None")
+    if not smtp_server:
+      raise ValueError("precondition failed.  'smtp_server' must not be None")
+    self.smtp_server = smtp_server
+    self.smtp_port = smtp_port
+    self.from_email_address = from_email_address
+    self.from_password = from_password
+    self.idle_timeout = idle_timeout
+    self._smtp = None
+    self._last_used = 0
+
+  def send(self, target_email_addresses_csv, email_subject="", email_body="", email_text_body=None):
+    """
+    Sends an email.  Raises ValueError if the recipients are refused, or an
+    smtplib.SMTPException or OSError if the message couldn't be sent.
+    """
+    if not target_email_addresses_csv:
+      raise ValueError("precondition failed.  'target_email_addresses_csv' must not be None")
+    target_email_addresses = target_email_addresses_csv.split(",")
+    msg = prepare_message(target_email_addresses_csv, email_subject, email_body, self.from_email_address, email_text_body)
+
+    with _measure_send():
+      s = self._connection()
+      try:
+        s.sendmail(self.from_email_address, target_email_addresses, msg.as_string())
+      except smtplib.SMTPRecipientsRefused as e:
+        raise ValueError(e)
+      except (smtplib.SMTPServerDisconnected, OSError):
+        self.close()
+        raise
+    self._last_used = time.monotonic()
+
+  def close(self):
+    if self._smtp:
+      try:
+        self._smtp.quit()
+      except (smtplib.SMTPException, OSError):
+        pass
+    self._smtp = None
+
+  def _connection(self):
+    if self._smtp and time.monotonic() - self._last_used > self.idle_timeout:
+      try:
+        self._smtp.noop()
+      except (smtplib.SMTPException, OSError):
+        self._smtp = None
+    if not self._smtp:
+      self._smtp = connect(self.smtp_server, self.smtp_port, self.from_email_address, self.from_password)
+    return self._smtp
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""
+Purpose: A shared HTTP client with connection pooling, keep-alive, timeouts and
+retries.  Connections to each host are kept open and reused between requests
+rather than opening a new TCP (and TLS) connection per request.
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+#Only requests with these methods are retried after a response (or read
+#timeout) has been received.  Connection failures are retried for all methods
+#because the request was never sent.
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+#Responses with these statuses are retried (for idempotent methods)
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+class HttpClient(object):
+  """
+  A pooled HTTP client.  The underlying requests.Session is created on first use
+  in each process, so a client created before gunicorn forks its workers doesn't
+  share sockets between them.
+  """
+
+  def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, retries=2, retry_backoff=0.5, headers=None):
+    """
+    :param pool_size: the maximum number of connections kept open to each host
+    :param connect_timeout: seconds to wait for a connection to be established
+    :param read_timeout: seconds to wait between bytes received from the server
+    :param retries: the number of times to retry a failed idempotent request
+    :param retry_backoff: the backoff factor (in seconds) between retries
+    :param headers: headers to send with every request
+    """
+    self.pool_size = pool_size
+    self.timeout = (connect_timeout, read_timeout)
+    self.retries = retries
+    self.retry_backoff = retry_backoff
+    self.headers = headers or {}
+    self._session = None
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def get(self, url, **kwargs):
+    return self.request("GET", url, **kwargs)
+
+  def head(self, url, **kwargs):
+    return self.request("HEAD", url, **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request("POST", url, **kwargs)
+
+  def request(self, method, url, **kwargs):
+    """
+    Sends a request.  Accepts the same keyword arguments as requests.request.
+    If no timeout is given the client's default (connect, read) timeout is used.
+    """
+    kwargs.setdefault("timeout", self.timeout)
+    return self._get_session().request(method, url, **kwargs)
+
+  def close(self):
+    """
+    Closes all pooled connections
+    """
+    with self._lock:
+      if self._session:
+        self._session.close()
+      self._session = None
+
+  def _get_session(self):
+    with self._lock:
+      if self._session is None or self._pid != os.getpid():
+        self._session = self._create_session()
+        self._pid = os.getpid()
+      return self._session
+
+  def _create_session(self):
+    session = requests.Session()
+    session.headers.update(self.headers)
+    adapter = HTTPAdapter(
+      pool_connections=self.pool_size,
+      pool_maxsize=self.pool_size,
+      max_retries=_retry(self.retries, self.retry_backoff))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _retry(retries, backoff):
+  """
+  The retry policy for a client
+  """
+  options = {
+    "total": retries,
+    "backoff_factor": backoff,
+    "status_forcelist": RETRY_STATUSES,
+    "raise_on_status": False
+  }
+  try:
+    return Retry(allowed_methods=IDEMPOTENT_METHODS, **options)
+  except TypeError:
+    #urllib3 < 1.26
+    return Retry(method_whitelist=IDEMPOTENT_METHODS, **options)
@@ -0,0 +1,304 @@
+"""
+Purpose: Make retried requests safe.  Each request is identified by an
+idempotency key: the client's Idempotency-Key header or, if there isn't one, a
+hash of the (normalized) request body.  The first request with a key is
+processed and its response stored for a while.  Requests with the same key
+which arrive while it is being processed wait for it to finish, and those which
+arrive later get the stored response, so the work is only done once.
+
+Keys are kept in a pluggable store: in memory (per worker process) or in a
+SQLite file (shared by all worker processes on a host).
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from .sqlitedb import connect, enable_wal, process_owner, owner_is_alive
+
+#record statuses
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+class IdempotencyKeyReused(Exception):
+  """
+  Raised when a key is reused with a different request body
+  """
+  pass
+
+class RequestInProgress(Exception):
+  """
+  Raised when a request with the same key is still being processed after the
+  wait timeout
+  """
+  pass
+
+def body_fingerprint(body):
+  """
+  A hash of a JSON request body which doesn't depend on the order of its keys
+  or its whitespace
+  """
+  normalized = json.dumps(body, sort_keys=True, separators=(",", ":"))
+  return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def idempotency_key(header, fingerprint):
+  """
+  :param header: the value of the request's Idempotency-Key header (or None)
+  :param fingerprint: the fingerprint of the request's body
+  """
+  if header:
+    return "key:{}".format(header.strip())
+  return "body:{}".format(fingerprint)
+
+class IdempotencyStore(object):
+  """
+  Base class for stores of idempotency records.  A record is a dictionary with
+  the key, the fingerprint of the request body, a status, the owner (process)
+  processing it, when it expires and (once completed) the response.
+  """
+
+  def claim(self, key, fingerprint, expires):
+    """
+    Atomically creates an in progress record for the key, unless there is
+    already a record which hasn't expired (and whose owner is still alive)
+    :return: None if the key was claimed, otherwise the existing record
+    """
+    raise NotImplementedError()
+
+  def complete(self, key, response, expires):
+    raise NotImplementedError()
+
+  def release(self, key):
+    """
+    Removes the record for a key (so the request can be processed again)
+    """
+    raise NotImplementedError()
+
+  def wait(self, key, timeout):
+    """
+    Waits (for up to timeout seconds) for the record for a key to change
+    """
+    raise NotImplementedError()
+
+class MemoryIdempotencyStore(IdempotencyStore):
+  """
+  Keeps records in a dictionary.  Only requests handled by the same process are
+  recognized as duplicates.
+  """
+
+  def __init__(self):
+    self._records = {}
+    self._changed = threading.Condition()
+
+  def claim(self, key, fingerprint, expires):
+    now = time.time()
+    with self._changed:
+      self._purge(now)
+      record = self._records.get(key)
+      if record and not _abandoned(record, now):
+        return dict(record)
+      self._records[key] = _new_record(key, fingerprint, expires)
+      return None
+
+  def complete(self, key, response, expires):
+    with self._changed:
+      if key in self._records:
+        self._records[key].update(status=COMPLETED, response=response, expires=expires)
+      self._changed.notify_all()
+
+  def release(self, key):
+    with self._changed:
+      self._records.pop(key, None)
+      self._changed.notify_all()
+
+  def wait(self, key, timeout):
+    with self._changed:
+      self._changed.wait(timeout)
+
+  def _purge(self, now):
+    for key in [key for key, record in self._records.items() if record["expires"] < now]:
+      del self._records[key]
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+  """
+  Keeps records in a SQLite database file, so duplicate requests are
+  recognized whichever worker process handles them
+  """
+
+  def __init__(self, path, poll_interval=0.1):
+    self.path = path
+    self.poll_interval = poll_interval
+    enable_wal(path)
+    with connect(self.path) as conn:
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency (
+          key TEXT PRIMARY KEY,
+          fingerprint TEXT NOT NULL,
+          status TEXT NOT NULL,
+          owner TEXT,
+          expires REAL NOT NULL,
+          response TEXT
+        )""")
+      conn.execute("CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires)")
+
+  def claim(self, key, fingerprint, expires):
+    now = time.time()
+    with connect(self.path) as conn:
+      #take the write lock first, so the check and the insert are atomic
+      conn.execute("BEGIN IMMEDIATE")
+      conn.execute("DELETE FROM idempotency WHERE expires < ?", (now,))
+      conn.row_factory = sqlite3.Row
+      row = conn.execute("SELECT * FROM idempotency WHERE key = ?", (key,)).fetchone()
+      if row:
+        record = dict(row)
+        record["response"] = json.loads(record["response"]) if record["response"] else None
+        if not _abandoned(record, now):
+          return record
+      record = _new_record(key, fingerprint, expires)
+      conn.execute("INSERT OR REPLACE INTO idempotency (key, fingerprint, status, owner, expires) VALUES (?, ?, ?, ?, ?)",
+        (key, fingerprint, record["status"], record["owner"], expires))
+      return None
+
+  def complete(self, key, response, expires):
+    with connect(self.path) as conn:
+      conn.execute("UPDATE idempotency SET status = ?, response = ?, expires = ? WHERE key = ?",
+        (COMPLETED, json.dumps(response), expires, key))
+
+  def release(self, key):
+    with connect(self.path) as conn:
+      conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+
+  def wait(self, key, timeout):
+    time.sleep(min(timeout, self.poll_interval))
+
+def _new_record(key, fingerprint, expires):
+  return {
+    "key": key,
+    "fingerprint": fingerprint,
+    "status": IN_PROGRESS,
+    "owner": process_owner(),
+    "expires": expires,
+    "response": None
+  }
+
+def _abandoned(record, now):
+  """
+  True if a record has expired, or its request was being processed by a
+  process which has exited
+  """
+  return record["expires"] < now or (record["status"] == IN_PROGRESS and not owner_is_alive(record["owner"]))
+
+def create_idempotency_store(kind, path=None):
+  """
+  Creates an idempotency store
+  :param kind: one of "memory" or "sqlite"
+  :param path: the database file for a sqlite store
+  """
+  if kind == "memory":
+    return MemoryIdempotencyStore()
+  if kind == "sqlite":
+    return SQLiteIdempotencyStore(path)
+  raise ValueError("Unknown idempotency store '{}'.  Expecting 'memory' or 'sqlite'.".format(kind))
+
+class IdempotentRequests(object):
+  """
+  Processes each request with a given idempotency key at most once (within the TTL)
+  """
+
+  def __init__(self, store, ttl=86400, wait_timeout=60):
+    """
+    :param store: the IdempotencyStore in which keys are recorded
+    :param ttl: the number of seconds for which responses are stored
+    :param wait_timeout: the maximum number of seconds a duplicate request
+      waits for the original request to finish
+    """
+    self.store = store
+    self.ttl = ttl
+    self.wait_timeout = wait_timeout
+
+  def run(self, key, fingerprint, func):
+    """
+    Processes a request, or replays the response of an earlier request with
+    the same key.  Responses with status 500 or above aren't stored (so the
+    request can be retried).
+    :param func: a function which processes the request and returns a tuple
+      (response body, status code, headers dictionary)
+    :return: a tuple (response body, status code, headers dictionary, replayed)
+    :raises IdempotencyKeyReused: if the key was used for a different body
+    :raises RequestInProgress: if the original request is still being processed
+    """
+    deadline = time.monotonic() + self.wait_timeout
+    while True:
+      record = self.store.claim(key, fingerprint, time.time() + self.ttl)
+      if record is None:
+        break
+      replay = self._replay(record, fingerprint, deadline)
+      if replay:
+        return replay
+      self.store.wait(key, deadline - time.monotonic())
+
+    finished = False
+    try:
+      body, status_code, headers = func()
+      finished = True
+    finally:
+      if not finished:
+        self.store.release(key)
+    return self._finish(key, body, status_code, headers)
+
+  async def run_async(self, key, fingerprint, func, poll_interval=0.1):
+    """
+    Like run, for asyncio.  Waits for the original request by polling.  The
+    store is called in the event loop's default thread pool, since a SQLite
+    store may block (waiting for another process's write lock).
+    :param func: a coroutine function which processes the request and returns
+      a tuple (response body, status code, headers dictionary)
+    """
+    deadline = time.monotonic() + self.wait_timeout
+    while True:
+      record = await _run_in_thread(self.store.claim, key, fingerprint, time.time() + self.ttl)
+      if record is None:
+        break
+      replay = self._replay(record, fingerprint, deadline)
+      if replay:
+        return replay
+      await asyncio.sleep(min(poll_interval, deadline - time.monotonic()))
+
+    finished = False
+    try:
+      body, status_code, headers = await func()
+      finished = True
+    finally:
+      if not finished:
+        await _run_in_thread(self.store.release, key)
+    return await _run_in_thread(self._finish, key, body, status_code, headers)
+
+  def _replay(self, record, fingerprint, deadline):
+    """
+    Checks the existing record for a key
+    :return: the stored response (as returned by run) if the request has
+      completed, otherwise None (if it's worth waiting for)
+    """
+    if record["fingerprint"] != fingerprint:
+      raise IdempotencyKeyReused()
+    if record["status"] == COMPLETED:
+      response = record["response"]
+      return response["body"], response["status_code"], response["headers"], True
+    if deadline - time.monotonic() <= 0:
+      raise RequestInProgress()
+    return None
+
+  def _finish(self, key, body, status_code, headers):
+    if status_code >= 500:
+      self.store.release(key)
+    else:
+      response = {"body": body, "status_code": status_code, "headers": headers}
+      self.store.complete(key, response, time.time() + self.ttl)
+    return body, status_code, headers, False
+
+def _run_in_thread(func, *args):
+  """
+  Runs a blocking function in the event loop's default thread pool
+  """
+  return asyncio.get_event_loop().run_in_executor(None, func, *args)
@@ -0,0 +1,266 @@
+"""
+Purpose: Run registrations in the background.  A job records the (validated)
+registration request, its progress and its final result.  Jobs are kept in a
+pluggable job store: in memory (per worker process) or in a SQLite file (shared
+by all worker processes on a host, and preserved across restarts).
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from .sqlitedb import connect, enable_wal, process_owner, owner_is_alive
+
+logger = logging.getLogger(__name__)
+
+#job statuses
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+FINISHED_STATUSES = [SUCCEEDED, FAILED]
+
+def new_job(request):
+  """
+  Creates a new (queued) job as a dictionary
+  :param request: the request which the job will process.  Must be serializable as JSON.
+  """
+  now = time.time()
+  return {
+    "id": uuid.uuid4().hex,
+    "status": QUEUED,
+    "stage": QUEUED,
+    "created": now,
+    "updated": now,
+    "owner": None,
+    "request": request,
+    "result": None,
+    "status_code": None
+  }
+
+class JobStore(object):
+  """
+  Base class for job stores
+  """
+
+  def add(self, job):
+    raise NotImplementedError()
+
+  def get(self, job_id):
+    """
+    :return: the job with the given id, or None if there is no such job
+    """
+    raise NotImplementedError()
+
+  def update(self, job_id, **fields):
+    raise NotImplementedError()
+
+  def claim(self, job_id):
+    """
+    Atomically changes a queued job to running on behalf of this process.
+    :return: True if the job was claimed, False if it was not queued
+    """
+    raise NotImplementedError()
+
+  def unfinished(self):
+    """
+    :return: all jobs which are queued or running
+    """
+    raise NotImplementedError()
+
+  def purge(self, older_than):
+    """
+    Removes finished jobs last updated before the given time
+    """
+    raise NotImplementedError()
+
+class MemoryJobStore(JobStore):
+  """
+  Keeps jobs in a dictionary.  Jobs are only visible to the process which
+  created them and are lost when it exits.
+  """
+
+  def __init__(self):
+    self._jobs = {}
+    self._lock = threading.Lock()
+
+  def add(self, job):
+    with self._lock:
+      self._jobs[job["id"]] = dict(job)
+
+  def get(self, job_id):
+    with self._lock:
+      job = self._jobs.get(job_id)
+      return dict(job) if job else None
+
+  def update(self, job_id, **fields):
+    with self._lock:
+      if job_id in self._jobs:
+        self._jobs[job_id].update(fields, updated=time.time())
+
+  def claim(self, job_id):
+    with self._lock:
+      job = self._jobs.get(job_id)
+      if not job or job["status"] != QUEUED:
+        return False
+      job.update(status=RUNNING, owner=process_owner(), updated=time.time())
+      return True
+
+  def unfinished(self):
+    with self._lock:
+      return [dict(job) for job in self._jobs.values() if job["status"] not in FINISHED_STATUSES]
+
+  def purge(self, older_than):
+    with self._lock:
+      for job_id in [job_id for job_id, job in self._jobs.items() if job["status"] in FINISHED_STATUSES and job["updated"] < older_than]:
+        del self._jobs[job_id]
+
+class SQLiteJobStore(JobStore):
+  """
+  Keeps jobs in a SQLite database file.  All worker processes using the same
+  file see the same jobs, and jobs survive restarts.
+  """
+
+  JSON_FIELDS = ["request", "result"]
+
+  def __init__(self, path):
+    self.path = path
+    enable_wal(path)
+    with self._connect() as conn:
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS job (
+          id TEXT PRIMARY KEY,
+          status TEXT NOT NULL,
+          stage TEXT,
+          created REAL NOT NULL,
+          updated REAL NOT NULL,
+          owner TEXT,
+          request TEXT,
+          result TEXT,
+          status_code INTEGER
+        )""")
+      conn.execute("CREATE INDEX IF NOT EXISTS job_status ON job (status, updated)")
+
+  def _connect(self):
+    #a connection per operation, so the store can be shared between threads
+    return connect(self.path)
+
+  def add(self, job):
+    row = self._to_row(job)
+    with self._connect() as conn:
+      conn.execute("INSERT INTO job ({}) VALUES ({})".format(", ".join(row.keys()), ", ".join("?" * len(row))), list(row.values()))
+
+  def get(self, job_id):
+    with self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      row = conn.execute("SELECT * FROM job WHERE id = ?", (job_id,)).fetchone()
+    return self._from_row(row) if row else None
+
+  def update(self, job_id, **fields):
+    fields["updated"] = time.time()
+    row = self._to_row(fields)
+    with self._connect() as conn:
+      conn.execute("UPDATE job SET {} WHERE id = ?".format(", ".join("{} = ?".format(k) for k in row.keys())), list(row.values()) + [job_id])
+
+  def claim(self, job_id):
+    with self._connect() as conn:
+      cursor = conn.execute("UPDATE job SET status = ?, owner = ?, updated = ? WHERE id = ? AND status = ?", (RUNNING, process_owner(), time.time(), job_id, QUEUED))
+      return cursor.rowcount == 1
+
+  def unfinished(self):
+    with self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      rows = conn.execute("SELECT * FROM job WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+    return [self._from_row(row) for row in rows]
+
+  def purge(self, older_than):
+    with self._connect() as conn:
+      conn.execute("DELETE FROM job WHERE status IN (?, ?) AND updated < ?", (SUCCEEDED, FAILED, older_than))
+
+  def _to_row(self, job):
+    row = dict(job)
+    for field in self.JSON_FIELDS:
+      if field in row:
+        row[field] = json.dumps(row[field])
+    return row
+
+  def _from_row(self, row):
+    job = dict(row)
+    for field in self.JSON_FIELDS:
+      job[field] = json.loads(job[field]) if job[field] is not None else None
+    return job
+
+def create_job_store(kind, path=None):
+  """
+  Creates a job store
+  :param kind: one of "memory" or "sqlite"
+  :param path: the database file for a sqlite job store
+  """
+  if kind == "memory":
+    return MemoryJobStore()
+  if kind == "sqlite":
+    return SQLiteJobStore(path)
+  raise ValueError("Unknown job store '{}'.  Expecting 'memory' or 'sqlite'.".format(kind))
+
+class JobQueue(object):
+  """
+  Runs jobs in the background through a worker pool
+  """
+
+  def __init__(self, store, pool, handler, retention=86400):
+    """
+    :param store: the JobStore in which jobs are kept
+    :param pool: a concurrency.WorkerPool in which jobs are run
+    :param handler: a function handler(request, progress) which performs a job.
+      progress is a function which the handler may call with the name of each
+      stage it begins.  The handler returns a tuple (result, status_code).  Jobs
+      with a status_code of 400 or above are considered failed.
+    :param retention: the number of seconds that finished jobs are kept
+    """
+    self.store = store
+    self.pool = pool
+    self.handler = handler
+    self.retention = retention
+
+  def submit(self, request):
+    """
+    Queues a new job
+    :return: the new job
+    """
+    self.store.purge(time.time() - self.retention)
+    job = new_job(request)
+    self.store.add(job)
+    self.pool.submit(lambda: self._run(job["id"]))
+    return job
+
+  def get(self, job_id):
+    return self.store.get(job_id)
+
+  def resume(self):
+    """
+    Restarts queued jobs left by processes which have exited.  Jobs which were
+    running when their process exited are marked as failed, since they may
+    have partially completed.
+    """
+    for job in self.store.unfinished():
+      if job["status"] == QUEUED:
+        self.pool.submit(lambda job_id=job["id"]: self._run(job_id))
+      elif not owner_is_alive(job["owner"]):
+        logger.warning("Job {} was interrupted".format(job["id"]))
+        self.store.update(job["id"], status=FAILED, stage=FAILED, status_code=500,
+          result={"msg": "The registration was interrupted and may not have completed."})
+
+  def _run(self, job_id):
+    if not self.store.claim(job_id):
+      return
+    job = self.store.get(job_id)
+    progress = lambda stage: self.store.update(job_id, stage=stage)
+    try:
+      result, status_code = self.handler(job["request"], progress)
+    except Exception as e:
+      logger.error("Job {} failed. {}".format(job_id, e))
+      result, status_code = {"msg": "An unexpected error occurred while processing the registration."}, 500
+    status = SUCCEEDED if status_code < 400 else FAILED
+    self.store.update(job_id, status=status, stage=status, result=result, status_code=status_code)
@@ -0,0 +1,85 @@
+"""
+Purpose: Encode and decode the JSON of requests, responses and the payloads
+exchanged with BCDC.  Uses orjson when it is installed (see JSON_BACKEND in
+settings.py), and the standard library's json otherwise.
+
+Both backends decode bytes directly, so responses from BCDC are decoded from
+their bodies rather than first being converted to a str (requests' Response.text
+guesses the encoding of bodies without a charset, which takes longer than
+decoding them).  orjson only decodes UTF-8, so other encodings (which json
+accepts) are converted to a str first.
+
+Both backends encode compactly (without spaces after separators).  json
+escapes non-ASCII characters, and orjson writes them as UTF-8.
+"""
+import json
+import logging
+from . import settings
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _backend(name):
+  """
+  :param name: "auto", "orjson" or "json"
+  :return: the backend to use: "orjson" or "json"
+  """
+  if name == "json":
+    return "json"
+  if orjson is None:
+    if name == "orjson":
+      logger.warning("JSON_BACKEND is 'orjson' but orjson isn't installed.  Using json instead.")
+    return "json"
+  return "orjson"
+
+#The backend in use: "orjson" or "json"
+BACKEND = _backend(settings.JSON_BACKEND)
+
+def loads(data):
+  """
+  Decodes JSON
+  :param data: bytes (UTF-8, UTF-16 or UTF-32) or a str
+  :raises ValueError: if data isn't valid JSON
+  """
+  if BACKEND == "orjson":
+    try:
+      return orjson.loads(data)
+    except ValueError:
+      #orjson only accepts UTF-8 (without a byte order mark)
+      encoding = json.detect_encoding(data) if isinstance(data, (bytes, bytearray)) else "utf-8"
+      if encoding == "utf-8":
+        raise
+      return orjson.loads(data.decode(encoding))
+  return json.loads(data)
+
+def dumps_bytes(obj, sort_keys=False):
+  """
+  Encodes an object as JSON
+  :param sort_keys: True to write the keys of objects in sorted order
+  :return: UTF-8 bytes
+  """
+  if BACKEND == "orjson":
+    try:
+      return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    except TypeError:
+      #objects orjson doesn't support (such as integers over 64 bits or
+      #non-string keys)
+      pass
+  return _json_dumps(obj, sort_keys).encode("utf-8")
+
+def dumps(obj, sort_keys=False):
+  """
+  Encodes an object as JSON
+  :param sort_keys: True to write the keys of objects in sorted order
+  :return: a str
+  """
+  if BACKEND == "orjson":
+    return dumps_bytes(obj, sort_keys).decode("utf-8")
+  return _json_dumps(obj, sort_keys)
+
+def _json_dumps(obj, sort_keys):
+  return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"))
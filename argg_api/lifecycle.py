@@ -0,0 +1,161 @@
+"""
+Purpose: The startup lifecycle of the application, so that a worker process is
+warmed up (connection pools open, organizations loaded) before it serves its
+first request, and reports why if it can't be.
+
+Work is registered in two kinds:
+- warm-up tasks, which run once when the application starts.  Those marked
+  per_process run again in each forked worker, for state which doesn't survive
+  a fork (such as open connections).
+- background tasks, which start threads (and claim jobs, send email...).
+  Threads don't survive a fork either, so these are started in each process
+  which serves requests, and only in those.
+
+With gunicorn's --preload the application (and so its warm-up) is loaded once
+in the master process, and the forked workers share that memory.  The master
+serves no requests, so it must call defer_background() before loading the
+application (see gunicorn.conf.py), and its background tasks are started in
+the workers instead.  after_fork must then be called in each worker: it is
+registered with os.register_at_fork where available, and called by gunicorn's
+post_fork hook otherwise.
+
+The state of the lifecycle is reported for liveness and readiness probes.  A
+failed warm-up task is reported but doesn't make the process unready, since
+each dependency recovers (or fails fast) on its own.  Configuration errors do.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+WARMING_UP = "warming_up"
+READY = "ready"
+MISCONFIGURED = "misconfigured"
+
+#The process (if any) which loads the application only to fork the processes
+#which serve requests (see defer_background)
+_master_pid = None
+
+def defer_background():
+  """
+  Marks this process as one which loads the application but doesn't serve
+  requests (such as gunicorn's master with preload_app).  Background tasks
+  aren't started in it, only in the processes forked from it.
+  """
+  global _master_pid
+  _master_pid = os.getpid()
+
+class Lifecycle(object):
+  """
+  The startup lifecycle of a process
+  """
+
+  def __init__(self, config_errors=None):
+    """
+    :param config_errors: a list of problems with the configuration (see
+      settings.CONFIG_ERRORS).  Nothing is started if there are any.
+    """
+    self.config_errors = list(config_errors or [])
+    self.state = STARTING
+    self.started_at = time.time()
+    self.ready_at = None
+    self.warm_up_results = {}
+    self._tasks = [] #(name, func, per_process)
+    self._background = [] #(name, func)
+    self._pid = None
+    self._lock = threading.Lock()
+
+  def add_warm_up(self, name, func, per_process=False):
+    """
+    :param func: a function (without arguments) which warms something up
+    :param per_process: True to run the function again in each forked process
+    """
+    self._tasks.append((name, func, per_process))
+
+  def add_background(self, name, func):
+    """
+    :param func: a function (without arguments) which starts a background
+      thread in the current process
+    """
+    self._background.append((name, func))
+
+  def start(self):
+    """
+    Warms up this process and starts its background tasks (unless the
+    configuration has errors, or this process doesn't serve requests)
+    """
+    with self._lock:
+      if self._pid == os.getpid():
+        return
+      self._pid = os.getpid()
+      first = self.ready_at is None
+    if self.config_errors:
+      for error in self.config_errors:
+        logger.error("Configuration error: {}".format(error))
+      self.state = MISCONFIGURED
+      return
+
+    self.state = WARMING_UP
+    for name, func, per_process in self._tasks:
+      if first or per_process:
+        self._warm_up(name, func)
+    if os.getpid() != _master_pid:
+      for name, func in self._background:
+        func()
+    self.state = READY
+    self.ready_at = time.time()
+    logger.info("Ready after {:.2f}s".format(self.ready_at - self.started_at))
+
+  def after_fork(self):
+    """
+    Restarts what didn't survive a fork, in the child process.  Does nothing if
+    this process has already been started.
+    """
+    if self._pid is None or self._pid == os.getpid():
+      return
+    self.started_at = time.time()
+    self.start()
+
+  def _warm_up(self, name, func):
+    start = time.monotonic()
+    try:
+      func()
+      result = {"ok": True}
+    except Exception as e:
+      logger.warning("Warm-up of {} failed. {}".format(name, e))
+      result = {"ok": False, "error": "{}".format(e)}
+    result["seconds"] = round(time.monotonic() - start, 3)
+    self.warm_up_results[name] = result
+
+  @property
+  def ready(self):
+    return self.state == READY
+
+  def health(self):
+    """
+    The liveness of this process: it is alive if it can respond at all, even
+    if it is misconfigured (restarting it wouldn't help)
+    """
+    return {
+      "status": "alive",
+      "state": self.state,
+      "pid": os.getpid(),
+      "uptime": round(time.time() - self.started_at, 3)
+    }
+
+  def readiness(self):
+    """
+    :return: a dictionary describing whether this process is ready to serve
+      requests, and if not, why
+    """
+    readiness = {
+      "ready": self.ready,
+      "state": self.state,
+      "warm_up": self.warm_up_results
+    }
+    if self.config_errors:
+      readiness["config_errors"] = self.config_errors
+    return readiness
@@ -0,0 +1,187 @@
+"""
+Purpose: Write the application's logs without making requests wait for them.
+
+Writing to stdout or stderr blocks when the container's log pipe is full, and
+under gevent it blocks every greenlet in the process.  So records logged by
+argg_api (and its modules) are only queued by the thread or greenlet which
+logs them.  One writer thread per process (an operating system thread, even
+under gevent) formats the queued records and writes them to stderr.
+
+The queue is bounded.  Records logged while it is full are dropped, counted
+(argg_log_records_dropped_total) and reported by the writer, so logging never
+holds up a request.  Records still queued are written when the process exits.
+"""
+import collections
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+from . import metrics
+from . import tracing
+from .concurrency import start_native_thread, native_sleep
+
+#Seconds the writer waits between writing batches of queued records
+WRITE_INTERVAL = 0.05
+
+records_dropped = metrics.counter("argg_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+class JsonFormatter(logging.Formatter):
+  """
+  Formats a record as one JSON object: its time, level, logger, message, the
+  id of the request it was logged for (if any) and any structured fields given
+  with extra={"fields": {...}}
+  """
+
+  def format(self, record):
+    line = {
+      "time": datetime.datetime.utcfromtimestamp(record.created).isoformat() + "Z",
+      "level": record.levelname,
+      "logger": record.name,
+      "msg": record.getMessage()
+    }
+    if getattr(record, "request_id", None):
+      line["request_id"] = record.request_id
+    line.update(getattr(record, "fields", None) or {})
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatException(record.exc_info)
+    if record.exc_text:
+      line["exc"] = record.exc_text
+    return json.dumps(line, default=str)
+
+class TextFormatter(logging.Formatter):
+  """
+  Formats a record as a line of text, followed by its request id and
+  structured fields (as JSON)
+  """
+
+  def __init__(self):
+    logging.Formatter.__init__(self, "[%(asctime)s] %(levelname)s in %(name)s: %(message)s")
+
+  def format(self, record):
+    text = logging.Formatter.format(self, record)
+    fields = dict(getattr(record, "fields", None) or {})
+    if getattr(record, "request_id", None):
+      fields["request_id"] = record.request_id
+    if fields:
+      text = "{} {}".format(text, json.dumps(fields, default=str))
+    return text
+
+class QueueingHandler(logging.Handler):
+  """
+  Queues records for a writer thread, which formats and writes them.  Never
+  blocks the caller: records which don't fit in the queue are dropped.
+  """
+
+  def __init__(self, formatter, max_size=10000, stream=None, interval=WRITE_INTERVAL):
+    """
+    :param formatter: formats records (in the writer thread)
+    :param max_size: the maximum number of queued records
+    :param stream: the stream records are written to.  Default: sys.stderr (as
+      it is when each record is written)
+    :param interval: seconds the writer waits between batches of records
+    """
+    logging.Handler.__init__(self)
+    self.setFormatter(formatter)
+    self.max_size = max_size
+    self.stream = stream
+    self.interval = interval
+    self.dropped = 0
+    self._reported_dropped = 0
+    #deque appends and pops are atomic, so the writer takes no locks which
+    #gevent has patched
+    self._records = collections.deque()
+    self._pid = None
+    self._start_lock = threading.Lock()
+
+  def emit(self, record):
+    try:
+      if self._pid != os.getpid():
+        self._start_writer()
+      if len(self._records) >= self.max_size:
+        self.dropped += 1
+        records_dropped.inc()
+        return
+      self._records.append(self.prepare(record))
+    except Exception:
+      self.handleError(record)
+
+  def prepare(self, record):
+    """
+    Captures what a record refers to while the caller is still running: its
+    message (whose arguments may change later), its exception and the current
+    request's id
+    """
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+      record.exc_text = self.formatter.formatException(record.exc_info)
+      record.exc_info = None
+    trace = tracing.current()
+    if trace:
+      record.request_id = trace.request_id
+    return record
+
+  def flush(self):
+    """
+    Writes all queued records (also called by logging.shutdown when the
+    process exits)
+    """
+    stream = self.stream or sys.stderr
+    lines = []
+    while self._records:
+      record = self._records.popleft()
+      try:
+        lines.append(self.format(record))
+      except Exception:
+        self.handleError(record)
+    dropped = self.dropped - self._reported_dropped
+    if dropped > 0:
+      self._reported_dropped += dropped
+      lines.append(self.format(logging.LogRecord(__name__, logging.WARNING, __file__, 0, "{} log records were dropped because the log queue was full".format(dropped), None, None)))
+    if lines:
+      try:
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+      except (OSError, ValueError):
+        pass #the stream is closed or broken
+
+  def _start_writer(self):
+    with self._start_lock:
+      if self._pid == os.getpid():
+        return
+      #a forked process has a copy of its parent's queue, which its parent writes
+      if self._pid is not None:
+        self._records.clear()
+      self._pid = os.getpid()
+      start_native_thread(self._write_forever)
+
+  def _write_forever(self):
+    while True:
+      native_sleep(self.interval)
+      self.flush()
+
+def setup(level, format="json", max_size=10000):
+  """
+  Sends the logs of argg_api (and its modules) through a QueueingHandler
+  :param level: the level of the argg_api logger (e.g. "WARN")
+  :param format: "json" or "text"
+  :param max_size: the maximum number of queued records
+  """
+  logger = logging.getLogger("argg_api")
+  for handler in list(logger.handlers):
+    if isinstance(handler, QueueingHandler):
+      logger.removeHandler(handler)
+  logger.addHandler(QueueingHandler(JsonFormatter() if format == "json" else TextFormatter(), max_size=max_size))
+  logger.setLevel(getattr(logging, level))
+  logger.propagate = False
+  return logger
+
+def truncate(text, max_chars):
+  """
+  Shortens a (possibly large) payload for a log line
+  """
+  if text is None or len(text) <= max_chars:
+    return text
+  return "{}... ({} more characters)".format(text[:max_chars], len(text) - max_chars)
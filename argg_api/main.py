@@ -1,14 +1,42 @@
 from flask import Flask, Response, jsonify, request, redirect, url_for, g
-from jinja2 import Template
 from . import settings
-from .bcdc import package_id_to_web_url, package_id_to_api_url, prepare_package_name, package_create, resource_create, get_organization
-from .emailer import send_email
+from . import email_templates
+from . import metrics
+from . import tracing
+from . import logs
+from . import jsoncodec
+from .bcdc import package_id_to_web_url, package_id_to_api_url, prepare_package_name, package_create, resource_create, get_organizations, organization_cache_stats, \
+  organization_index_stats, start_organization_index_refresh, load_organization_index, open_connection, circuit_breaker_stats, InlineResourcesRejected, \
+  PackageNameTaken, NAME_TAKEN_MSG, package_name_taken, unique_package_name, load_package_name_index, start_package_name_index_refresh, package_name_index_stats
+from .breaker import Unavailable, Bulkhead, BulkheadFull
+from .admission import RateLimiter, RateLimited, TokenBucket, create_rate_limit_store
+from .emailer import send_email, SMTPConnection
+from .outbox import Outbox, OutboxSender
+from .apispec import ApiSpec
+from .httpclient import HttpClient
+from .probe import UrlProbe
+from .schema import CompiledSchema, SchemaValidationError
+from .concurrency import WorkerPool
+from .jobs import JobQueue, create_job_store, FINISHED_STATUSES
+from .lifecycle import Lifecycle
+from .idempotency import IdempotentRequests, IdempotencyKeyReused, RequestInProgress, create_idempotency_store, body_fingerprint, idempotency_key
 import os
-import json
-import requests
+import ipaddress
 import logging
+import time
+from contextlib import ExitStack
 from flask_cors import CORS
 
+try:
+  from flask.json.provider import DefaultJSONProvider
+except ImportError: #flask < 2.2
+  DefaultJSONProvider = None
+
+#logs are queued and written by a background thread (so that writing them 
+#doesn't block requests).  Set up before the app so flask doesn't add its own 
+#handler.
+logs.setup(settings.LOG_LEVEL, settings.LOG_FORMAT, settings.LOG_QUEUE_SIZE)
+
 app = Flask(__name__)
 
 #In debug mode add CORS headers to responses. (When not in debug mode, it is 
@@ -17,12 +45,50 @@ app = Flask(__name__)
 if "FLASK_DEBUG" in os.environ and os.environ["FLASK_DEBUG"]:
   CORS(app)
 
-#setup logging
+#jsonify and request.get_json use jsoncodec (with flask 2.2+).  Keys are sorted
+#as flask sorts them (unless app.json.sort_keys is False).
+if DefaultJSONProvider:
+  class JSONProvider(DefaultJSONProvider):
+
+    def dumps(self, obj, **kwargs):
+      if "indent" in kwargs: #pretty printed, in debug mode
+        return DefaultJSONProvider.dumps(self, obj, **kwargs)
+      return jsoncodec.dumps(obj, sort_keys=kwargs.get("sort_keys", self.sort_keys))
+
+    def loads(self, s, **kwargs):
+      return jsoncodec.loads(s)
+
+  app.json = JSONProvider(app)
+
+#setup logging (see logs.setup above)
 app.logger.setLevel(getattr(logging, settings.LOG_LEVEL)) #main logger's level
 
 #inject some initial log messages
 app.logger.info("Initializing {}".format(__name__))
 app.logger.info("Log level is '{}'".format(settings.LOG_LEVEL))
+
+#one structured line per request (see log_request)
+request_log = logging.getLogger("argg_api.requests")
+request_log.setLevel(logging.INFO if settings.REQUEST_LOG else logging.WARNING)
+
+#warms up each worker process before it serves requests (see Startup, below)
+lifecycle = Lifecycle(settings.CONFIG_ERRORS)
+
+#share metrics between worker processes, so that /metrics reports all of them
+if settings.METRICS_DIR:
+  lifecycle.add_background("metrics", lambda: metrics.registry.share(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL))
+
+#load all organizations into memory so that requests can be validated without
+#calls to BCDC
+if settings.ORG_INDEX_REFRESH_INTERVAL > 0:
+  lifecycle.add_warm_up("organization_index", load_organization_index)
+  lifecycle.add_background("organization_index", lambda: start_organization_index_refresh(settings.ORG_INDEX_REFRESH_INTERVAL))
+
+#load the names of all packages into memory so that a registration whose name
+#is taken is caught before it is sent to BCDC
+if settings.PACKAGE_NAME_INDEX_REFRESH_INTERVAL > 0:
+  lifecycle.add_warm_up("package_name_index", load_package_name_index)
+  lifecycle.add_background("package_name_index", lambda: start_package_name_index_refresh(settings.PACKAGE_NAME_INDEX_REFRESH_INTERVAL))
  
 
 #------------------------------------------------------------------------------
@@ -31,6 +97,172 @@ app.logger.info("Log level is '{}'".format(settings.LOG_LEVEL))
 
 API_SPEC_FILENAME = os.path.join(app.root_path, "../docs/argg-api.openapi3.json")
 
+api_spec = ApiSpec(API_SPEC_FILENAME, max_variants=settings.API_SPEC_MAX_VARIANTS)
+
+#requests to /register are validated against the schema in the specification
+registration_schema = CompiledSchema(api_spec.document, "#/components/schemas/api_registration_options")
+
+#Whether packages are created with their resources in a single request to BCDC.
+#Set to False if BCDC rejects inline resources.
+inline_resources_supported = settings.BCDC_INLINE_RESOURCES
+
+#Finds the content types of the URLs in registrations (for the formats of the 
+#metadata record's resources)
+url_probe = UrlProbe(
+  HttpClient(
+    pool_size=settings.PROBE_CONCURRENCY,
+    connect_timeout=settings.PROBE_CONNECT_TIMEOUT,
+    read_timeout=settings.PROBE_READ_TIMEOUT,
+    retries=0,
+    headers={"User-Agent": "argg-api"}),
+  max_bytes=settings.PROBE_MAX_BYTES,
+  ttl=settings.PROBE_CACHE_TTL,
+  failure_ttl=settings.PROBE_FAILURE_TTL,
+  concurrency=settings.PROBE_CONCURRENCY)
+
+#------------------------------------------------------------------------------
+# Background registration jobs
+#------------------------------------------------------------------------------
+
+job_queue = JobQueue(
+  create_job_store(settings.JOB_STORE, settings.JOB_STORE_PATH),
+  WorkerPool(settings.JOB_WORKERS),
+  lambda req_data, progress: complete_registration(req_data, progress),
+  retention=settings.JOB_RETENTION)
+lifecycle.add_background("job_queue", job_queue.resume)
+
+#------------------------------------------------------------------------------
+# Admission control
+#------------------------------------------------------------------------------
+
+#Registrations are rate limited by submitter and by client IP address
+rate_limiter = RateLimiter(
+  create_rate_limit_store(settings.RATE_LIMIT_STORE, settings.RATE_LIMIT_STORE_PATH),
+  {
+    "submitter": TokenBucket(settings.RATE_LIMIT_SUBMITTER_RATE, settings.RATE_LIMIT_SUBMITTER_BURST) if settings.RATE_LIMIT_SUBMITTER_RATE > 0 else None,
+    "ip": TokenBucket(settings.RATE_LIMIT_IP_RATE, settings.RATE_LIMIT_IP_BURST) if settings.RATE_LIMIT_IP_RATE > 0 else None
+  })
+
+#Each worker process handles a limited number of registrations at once, with a
+#short queue for the rest
+register_slots = Bulkhead("/register", settings.REGISTER_MAX_CONCURRENT, max_wait=settings.REGISTER_MAX_WAIT, max_waiting=settings.REGISTER_MAX_WAITING)
+
+#------------------------------------------------------------------------------
+# Idempotent registrations
+#------------------------------------------------------------------------------
+
+#Retried (duplicate) registrations are recognized by their Idempotency-Key 
+#header or a hash of their body, and the original response is replayed
+idempotent_requests = None
+if settings.IDEMPOTENCY_TTL > 0:
+  idempotent_requests = IdempotentRequests(
+    create_idempotency_store(settings.IDEMPOTENCY_STORE, settings.IDEMPOTENCY_STORE_PATH),
+    ttl=settings.IDEMPOTENCY_TTL,
+    wait_timeout=settings.IDEMPOTENCY_WAIT_TIMEOUT)
+
+#------------------------------------------------------------------------------
+# Batch registrations
+#------------------------------------------------------------------------------
+
+#The registrations in batches are completed concurrently in this pool
+batch_pool = WorkerPool(settings.BATCH_CONCURRENCY)
+
+#------------------------------------------------------------------------------
+# Notification email outbox
+#------------------------------------------------------------------------------
+
+email_outbox = None
+if settings.EMAIL_OUTBOX_PATH:
+  email_outbox = Outbox(settings.EMAIL_OUTBOX_PATH)
+  lifecycle.add_background("email_outbox", lambda: OutboxSender(
+    email_outbox,
+    SMTPConnection(settings.SMTP_SERVER, settings.SMTP_PORT, settings.FROM_EMAIL_ADDRESS, settings.FROM_EMAIL_PASSWORD),
+    poll_interval=settings.EMAIL_OUTBOX_POLL_INTERVAL,
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    backoff=settings.EMAIL_RETRY_BACKOFF).start())
+
+#------------------------------------------------------------------------------
+# Startup
+#------------------------------------------------------------------------------
+
+#The API specification, its schema and the email templates are loaded when the
+#modules are imported.  Connections can't be shared with forked processes, so
+#each process opens its own.
+if settings.WARM_UP:
+  lifecycle.add_warm_up("bcdc_connection", open_connection, per_process=True)
+lifecycle.start()
+
+#with gunicorn --preload, the application is loaded (and warmed up) in the
+#master process.  Its forked workers restart what didn't survive the fork.
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=lifecycle.after_fork)
+
+#------------------------------------------------------------------------------
+# Request metrics
+#------------------------------------------------------------------------------
+
+request_duration = metrics.histogram("argg_http_request_duration_seconds", "Time taken to respond to requests, by route and method", ["route", "method"])
+requests_total = metrics.counter("argg_http_requests_total", "Requests, by route, method and HTTP status", ["route", "method", "status"])
+requests_in_progress = metrics.gauge("argg_http_requests_in_progress", "Requests being handled, by route", ["route"])
+validation_duration = metrics.histogram("argg_registration_validation_duration_seconds", "Time taken to validate registrations (including organization lookups)")
+
+def request_route():
+  return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+  g.request_start = time.monotonic()
+  tracing.start(request.headers.get("X-Request-ID"))
+  requests_in_progress.inc(route=request_route())
+
+@app.before_request
+def reject_if_misconfigured():
+  """
+  A misconfigured process only answers its health and readiness probes
+  """
+  if lifecycle.config_errors and request_route() not in ["/healthz", "/readyz"]:
+    return jsonify({"msg": "The service is misconfigured.  See /readyz."}), 503
+
+@app.after_request
+def record_response_status(response):
+  g.response_status = response.status_code
+  trace = tracing.current()
+  if trace:
+    response.headers["X-Request-ID"] = trace.request_id
+    if settings.SERVER_TIMING:
+      response.headers["Server-Timing"] = tracing.server_timing(trace)
+  return response
+
+@app.teardown_request
+def finish_request_metrics(exception=None):
+  if "request_start" not in g:
+    return
+  route = request_route()
+  requests_in_progress.dec(route=route)
+  request_duration.observe(time.monotonic() - g.request_start, route=route, method=request.method)
+  requests_total.inc(route=route, method=request.method, status=g.get("response_status", 500))
+  trace = tracing.finish()
+  if trace:
+    log_request(trace, route, g.get("response_status", 500))
+
+def log_request(trace, route, status_code):
+  """
+  Logs one structured line describing a request and the time taken by each of
+  its phases.  (The phases of a streamed response, such as that of
+  /register/batch, end when the response starts.)
+  """
+  if not request_log.isEnabledFor(logging.INFO):
+    return
+  request_log.info("{} {} {}".format(request.method, request.path, status_code), extra={"fields": {
+    "request_id": trace.request_id,
+    "method": request.method,
+    "path": request.path,
+    "route": route,
+    "status": status_code,
+    "ms": round(trace.elapsed() * 1000, 1),
+    "phases": tracing.summary(trace)
+  }})
+
 #------------------------------------------------------------------------------
 # API Endpoints
 #------------------------------------------------------------------------------
@@ -38,20 +270,74 @@ API_SPEC_FILENAME = os.path.join(app.root_path, "../docs/argg-api.openapi3.json"
 @app.route('/')
 def api():
   """
-  Summary information about this API
+  Summary information about this API (its OpenAPI specification).  Supports 
+  conditional requests (If-None-Match) and gzip encoding.
   """
   apiBaseUrl = request.url_root.rstrip("/")
+  variant = api_spec.render(apiBaseUrl)
+
+  use_gzip = request.accept_encodings["gzip"] > 0
+  etag = variant.gzip_etag if use_gzip else variant.etag
+
+  if request.if_none_match.contains_weak(etag):
+    r = Response(status=304)
+  else:
+    r = Response(response=variant.gzip_body if use_gzip else variant.body, mimetype='application/json', status=200)
+    if use_gzip:
+      r.headers["Content-Encoding"] = "gzip"
+  r.set_etag(etag)
+  r.headers["Cache-Control"] = "public, max-age={}".format(settings.API_SPEC_MAX_AGE)
+  r.headers["Vary"] = "Accept-Encoding"
+  return r
+
+@app.route('/healthz')
+def healthz():
+  """
+  Liveness probe: whether this worker process is alive
+  """
+  return jsonify(lifecycle.health()), 200
+
+@app.route('/readyz')
+def readyz():
+  """
+  Readiness probe: whether this worker process has warmed up and is correctly
+  configured.  HTTP 503 (with the reason) if not.
+  """
+  readiness = lifecycle.readiness()
+  return jsonify(readiness), 200 if readiness["ready"] else 503
+
+@app.route('/status')
+def status():
+  """
+  Runtime statistics for this worker process
+  """
+  stats = {
+    "organization_index": organization_index_stats(),
+    "organization_cache": organization_cache_stats(),
+    "package_name_index": package_name_index_stats(),
+    "url_probe_cache": url_probe.stats(),
+    "bcdc": circuit_breaker_stats(),
+    "rate_limits": rate_limiter.stats(),
+    "register_slots": register_slots.stats()
+  }
+  if email_outbox:
+    stats["email_outbox"] = email_outbox.stats()
+  return jsonify(stats), 200
 
-  with open(API_SPEC_FILENAME) as f:
-    s = f.read()
-    s = s.replace("${HOST}", apiBaseUrl)
-    r = Response(response=s, mimetype='application/json', status=200)
-    return r
+@app.route('/metrics')
+def metrics_endpoint():
+  """
+  Metrics for all worker processes, in the Prometheus text format
+  """
+  return Response(response=metrics.registry.render(), mimetype=None, content_type=metrics.CONTENT_TYPE, status=200)
 
 @app.route('/register', methods=["POST"])
 def register():
   """
-  Post a new API to be registered
+  Post a new API to be registered.  If asynchronous registration is enabled (or
+  requested with a 'Prefer: respond-async' header), the request is validated 
+  and a job is queued to complete the registration.  The response is then HTTP 
+  202 with the location of the job.
   """
 
   #headers
@@ -61,172 +347,561 @@ def register():
   if not contentType or contentType != "application/json":
     return jsonify({"msg": "Invalid Content-Type.  Expecting application/json"}), 400
 
-  #get request req_data
+  #get request req_data (decoded from the body's bytes)
   try:
-    req_data = request.get_json()
-  except Error as e:
+    req_data = jsoncodec.loads(request.get_data())
+  except ValueError as e:
     return jsonify({"msg": "content req_data is not valid json"}), 400
 
+  #admission control: rate limits by submitter and client, then one of a limited
+  #number of slots
   try:
-    req_data = clean_and_validate_req_data(req_data)
+    rate_limiter.admit(rate_limit_keys(req_data, client_ip()))
+  except RateLimited as e:
+    return too_many_requests(e)
+  try:
+    with register_slots.slot():
+      return admitted_registration(req_data)
+  except BulkheadFull as e:
+    return too_many_requests(e)
+
+def admitted_registration(req_data):
+  """
+  Handles a request to /register which has passed admission control
+  """
+  prefer_async = settings.REGISTER_ASYNC or "respond-async" in request.headers.get("Prefer", "")
+  if not idempotent_requests:
+    body, status_code, headers = process_registration(req_data, prefer_async)
+    return jsonify(body), status_code, headers
+
+  #a retry of an earlier registration gets the earlier registration's response
+  fingerprint = body_fingerprint(req_data)
+  key = idempotency_key(request.headers.get("Idempotency-Key"), fingerprint)
+  try:
+    body, status_code, headers, replayed = idempotent_requests.run(key, fingerprint, lambda: process_registration(req_data, prefer_async))
+  except (IdempotencyKeyReused, RequestInProgress) as e:
+    body, status_code, headers = idempotency_conflict(e)
+    return jsonify(body), status_code, headers
+  if replayed:
+    headers = dict(headers, **{"Idempotent-Replayed": "true"})
+  return jsonify(body), status_code, headers
+
+@app.route('/register/batch', methods=["POST"])
+def register_batch():
+  """
+  Post many new APIs to be registered.  The request body is either a JSON array
+  of registrations or NDJSON (one registration per line).  All registrations are
+  validated before any are completed.  The result of each registration is 
+  streamed back (as NDJSON) as soon as it is complete, followed by a summary.
+  One notification email is sent for the whole batch.
+  """
+
+  #get request req_data
+  try:
+    batch = parse_batch(request)
   except ValueError as e:
     return jsonify({"msg": "{}".format(e)}), 400
-  except RuntimeError as e:
-    app.logger.error("{}".format(e));
-    return jsonify({"msg": "An unexpected error occurred while validating the API registration request."}), 500
+
+  if len(batch) > settings.BATCH_MAX_SIZE:
+    return jsonify({"msg": "Too many registrations in batch.  Expecting at most {}".format(settings.BATCH_MAX_SIZE)}), 400
+
+  #admission control, as for /register: the batch counts as one registration
+  #against the rate limits of the client and of each of its submitters, and
+  #holds one of the limited slots until all its results have been sent
+  ip = client_ip()
+  try:
+    rate_limiter.admit_all([rate_limit_keys(req_data, ip) for req_data in batch])
+  except RateLimited as e:
+    return too_many_requests(e)
+  slot = ExitStack()
+  try:
+    slot.enter_context(register_slots.slot())
+  except BulkheadFull as e:
+    return too_many_requests(e)
+
+  try:
+    with validation_duration.time():
+      validated, invalid = clean_and_validate_batch(batch)
+    key = request.headers.get("Idempotency-Key")
+    response = Response(batch_results(batch, validated, invalid, key), mimetype="application/x-ndjson", status=200)
+  except BaseException:
+    slot.close()
+    raise
+  response.call_on_close(slot.close)
+  return response
+
+@app.route('/register/jobs/<job_id>')
+def register_job(job_id):
+  """
+  The progress of an asynchronous registration and, once it has finished, its result
+  """
+  job = job_queue.get(job_id)
+  if not job:
+    return jsonify({"msg": "Unknown job '{}'".format(job_id)}), 404
+  return jsonify({"job": job_summary(job, request.base_url)}), 200
+
+# -----------------------------------------------------------------------------
+# Helper functions
+# -----------------------------------------------------------------------------
+
+def batch_results(batch, validated, invalid, key=None):
+  """
+  Completes the valid registrations of a batch concurrently
+  :param batch: the registrations as they were received
+  :param validated: a dictionary of cleaned req_data by position in the batch
+  :param invalid: a dictionary of (response body dictionary, http status code)
+    by position in the batch
+  :param key: the batch's Idempotency-Key header (or None)
+  :return: a generator of the lines of NDJSON of the response to /register/batch
+  """
+  succeeded = 0
+  for index, (resp, status_code) in invalid.items():
+    yield batch_result_line({"index": index, "status_code": status_code, "result": resp})
+
+  registered = []
+  indexes = list(validated.keys())
+  funcs = [lambda index=index: batch_registration(batch[index], validated[index], "{}:{}".format(key, index) if key else None) for index in indexes]
+  try:
+    for i, result, e in batch_pool.as_completed(funcs):
+      if e:
+        app.logger.error("Unable to complete registration {} of batch. {}".format(indexes[i], e))
+        result = ({"msg": "An unexpected error occurred while processing the registration."}, 500, False)
+      resp, status_code, replayed = result
+      line = {"index": indexes[i], "status_code": status_code, "result": resp}
+      if status_code < 400:
+        succeeded += 1
+        req_data = validated[indexes[i]]
+        #a replayed registration was notified about when it was completed
+        if replayed:
+          line["replayed"] = True
+        else:
+          registered.append((req_data, resp.get("new_metadata_record", {}).get("web_url") or req_data.get("existing_metadata_url")))
+      yield batch_result_line(line)
+  finally:
+    #notify about the completed registrations, even if the client stops reading
+    if registered:
+      try:
+        send_batch_notification_email(registered)
+      except Exception as e: 
+        app.logger.error("Unable to send notification email for batch of new APIs. {}".format(e))
+
+  yield batch_result_line({"summary": {"total": len(batch), "succeeded": succeeded, "failed": len(batch) - succeeded}})
+
+def batch_registration(item, req_data, key=None):
+  """
+  Completes one registration of a batch (without a notification email) or, as
+  for /register, replays the result of an earlier registration with the same
+  idempotency key
+  :param item: the registration as it was received (for its fingerprint)
+  :param req_data: the validated registration
+  :param key: the registration's Idempotency-Key (or None to identify it by its
+    body)
+  :return: a tuple (response body dictionary, http status code, replayed)
+  """
+  if not idempotent_requests:
+    resp, status_code = complete_registration(req_data, notify=False)
+    return resp, status_code, False
+
+  fingerprint = body_fingerprint(item)
+  try:
+    resp, status_code, headers, replayed = idempotent_requests.run(idempotency_key(key, fingerprint), fingerprint,
+      lambda: complete_registration(req_data, notify=False) + ({},))
+  except (IdempotencyKeyReused, RequestInProgress) as e:
+    resp, status_code, headers = idempotency_conflict(e)
+    replayed = False
+  return resp, status_code, replayed
+
+def process_registration(req_data, prefer_async=False):
+  """
+  Validates a registration and then either completes it or (if prefer_async)
+  queues a job to complete it
+  :param req_data: the body of the request to /register as a dictionary
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  try:
+    req_data = clean_and_validate_req_data(req_data)
+  except (ValueError, RuntimeError) as e:
+    return validation_failed(e)
+
+  if prefer_async:
+    job = job_queue.submit(req_data)
+    job_url = url_for("register_job", job_id=job["id"], _external=True)
+    return {"job": job_summary(job, job_url)}, 202, {"Location": job_url}
+
+  resp, status_code = complete_registration(req_data)
+  return resp, status_code, registration_headers(resp, status_code)
+
+def validation_failed(e):
+  """
+  The response to a registration which couldn't be validated
+  :param e: the ValueError (invalid registration) or RuntimeError (unexpected
+    error) raised by validation
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  if isinstance(e, ValueError):
+    return validation_error_body(e), 400, {}
+  if isinstance(e, Unavailable):
+    return catalogue_unavailable_body(e), 503, {"Retry-After": "{}".format(e.retry_after)}
+  app.logger.error("{}".format(e));
+  return {"msg": "An unexpected error occurred while validating the API registration request."}, 500, {}
+
+def registration_headers(resp, status_code):
+  """
+  The headers of the response to a completed registration
+  """
+  if status_code == 503:
+    return {"Retry-After": "{}".format(resp["retry_after"])}
+  return {}
+
+def complete_registration(req_data, progress=None, notify=True):
+  """
+  Completes a registration which has been validated: creates a draft metadata
+  record (unless the request refers to an existing one) and sends a 
+  notification email.
+  :param req_data: the validated body of the request to /register as a dictionary
+  :param progress: an optional function which is called with the name of each 
+    stage as it begins
+  :param notify: False to skip the notification email (e.g. because it is sent
+    for a whole batch of registrations)
+  :return: a tuple (response body dictionary, http status code)
+  """
+  if not progress:
+    progress = lambda stage: None
 
   success_resp = {}
   metadata_web_url = None
 
   #create a draft metadata record (if one doesn't exist yet)
   if not req_data.get("existing_metadata_url"):
+    progress("creating_metadata_record")
     package = None
+    resources_created = False
     try:
-      package = create_package(req_data)
+      package, resources_created = create_package_with_resources(req_data)
       if not package:
         raise ValueError("Unknown reason")
       #add info about the new metadata record to the response
-      metadata_web_url = package_id_to_web_url(package["id"])
-      metadata_api_url = package_id_to_api_url(package["id"])
-      success_resp["new_metadata_record"] = {
-        "id": package["id"],
-        "web_url": metadata_web_url,
-        "api_url": metadata_api_url
-      }
-    except ValueError as e: #user input errors cause HTTP 400
-      return jsonify({"msg": "Unable to create metadata record in the BC Data Catalog. {}".format(e)}), 400
-    except RuntimeError as e: #unexpected system errors cause HTTP 500
-      app.logger.error("Unable to create metadata record in the BC Data Catalog. {}".format(e))
-      return jsonify({"msg": "Unable to create metadata record in the BC Data Catalog."}), 500
+      success_resp["new_metadata_record"] = new_metadata_record(package)
+      metadata_web_url = success_resp["new_metadata_record"]["web_url"]
+    except (ValueError, RuntimeError) as e:
+      return metadata_record_failed(e)
 
-    try:
-      create_api_root_resource(package["id"], req_data)
-    except ValueError as e: #perhaps other errors are possible too??  if so, catch those too
-      app.logger.warn("Unable to create API root resource associated with the new metadata record. {}".format(e))
-  
-    try:
-      create_api_spec_resource(package["id"], req_data)
-    except ValueError as e: #perhaps other errors are possible too??  if so, catch those too
-      app.logger.warn("Unable to create API spec resource associated with the new metadata record. {}".format(e))
+    if not resources_created:
+      progress("creating_resources")
+      try:
+        create_api_root_resource(package["id"], req_data)
+      except (ValueError, Unavailable) as e: #perhaps other errors are possible too??  if so, catch those too
+        app.logger.warn("Unable to create API root resource associated with the new metadata record. {}".format(e))
+    
+      try:
+        create_api_spec_resource(package["id"], req_data)
+      except (ValueError, Unavailable) as e: #perhaps other errors are possible too??  if so, catch those too
+        app.logger.warn("Unable to create API spec resource associated with the new metadata record. {}".format(e))
 
   #there is an existing metadata record
   else:
     metadata_web_url = req_data.get("existing_metadata_url")
 
+  if notify:
+    progress("sending_notification")
+    try:
+      send_notification_email(req_data, metadata_web_url)
+    except Exception as e: 
+      app.logger.error("Unable to send notification email for new API. {}".format(e))
+
+  return success_resp, 200
+
+def new_metadata_record(package):
+  """
+  The description of a newly created package in the response to a registration
+  """
+  return {
+    "id": package["id"],
+    "web_url": package_id_to_web_url(package["id"]),
+    "api_url": package_id_to_api_url(package["id"])
+  }
+
+def metadata_record_failed(e):
+  """
+  The response to a registration whose metadata record couldn't be created
+  :return: a tuple (response body dictionary, http status code)
+  """
+  if isinstance(e, ValueError): #user input errors cause HTTP 400
+    return {"msg": "Unable to create metadata record in the BC Data Catalog. {}".format(e)}, 400
+  if isinstance(e, Unavailable): #an overloaded or failing catalogue causes HTTP 503
+    app.logger.warning("Unable to create metadata record in the BC Data Catalog. {}".format(e))
+    return catalogue_unavailable_body(e), 503
+  #unexpected system errors cause HTTP 500
+  app.logger.error("Unable to create metadata record in the BC Data Catalog. {}".format(e))
+  return {"msg": "Unable to create metadata record in the BC Data Catalog."}, 500
+
+def parse_batch(request):
+  """
+  Parses the body of a request to /register/batch
+  :return: a list of registrations (which haven't been validated)
+  :raises ValueError: if the body isn't a JSON array or NDJSON
+  """
+  if request.mimetype == "application/json":
+    try:
+      batch = jsoncodec.loads(request.get_data())
+    except ValueError:
+      batch = None
+    if not isinstance(batch, list):
+      raise ValueError("Invalid request body.  Expecting a JSON array of registrations")
+    return batch
+
+  if request.mimetype in ["application/x-ndjson", "application/jsonl"]:
+    batch = []
+    for line_number, line in enumerate(request.get_data().splitlines(), start=1):
+      if not line.strip():
+        continue
+      try:
+        batch.append(jsoncodec.loads(line))
+      except ValueError:
+        raise ValueError("Line {} of request body is not valid json".format(line_number))
+    return batch
+
+  raise ValueError("Invalid Content-Type.  Expecting application/json or application/x-ndjson")
+
+def clean_and_validate_batch(batch):
+  """
+  Validates all the registrations in a batch.  The organizations referred to by
+  the batch are looked up together, so each distinct organization is only 
+  looked up once.
+  :param batch: a list of registrations
+  :return: a tuple (validated, invalid).  validated is a dictionary of cleaned
+    req_data by position in the batch.  invalid is a dictionary of 
+    (response body dictionary, http status code) by position in the batch.
+  """
+  cleaned = {}
+  invalid = {}
+  for index, req_data in enumerate(batch):
+    if not isinstance(req_data, dict):
+      invalid[index] = ({"msg": "Invalid registration.  Expecting a JSON object"}, 400)
+      continue
+    try:
+      cleaned[index] = clean_req_data(req_data)
+    except ValueError as e:
+      invalid[index] = (validation_error_body(e), 400)
+
+  org_ids = []
+  for req_data in cleaned.values():
+    org_ids.extend(referenced_org_ids(req_data))
+  organizations = get_organizations(org_ids)
+
+  validated = {}
+  for index, req_data in cleaned.items():
+    try:
+      validated[index] = validate_organizations(req_data, organizations)
+    except ValueError as e:
+      invalid[index] = ({"msg": "{}".format(e)}, 400)
+    except Unavailable as e:
+      invalid[index] = (catalogue_unavailable_body(e), 503)
+    except RuntimeError as e:
+      app.logger.error("{}".format(e));
+      invalid[index] = ({"msg": "An unexpected error occurred while validating the API registration request."}, 500)
+
+  return validated, invalid
+
+def validation_error_body(e):
+  """
+  The response body for an invalid registration.  Schema validation errors 
+  also list each problem with its JSON path.
+  """
+  body = {"msg": "{}".format(e)}
+  if isinstance(e, SchemaValidationError):
+    body["errors"] = e.errors
+  return body
+
+def client_ip():
+  """
+  The IP address of the client of the current request
+  """
+  return forwarded_client_ip(request.remote_addr, request.headers.get("X-Forwarded-For"))
+
+def forwarded_client_ip(remote_addr, forwarded_for):
+  """
+  The IP address of a request's client.  A request from a proxy (a loopback
+  peer, such as the Caddy sidecar in k8s, or any peer if 
+  RATE_LIMIT_TRUST_FORWARDED_FOR is set) is from the address the proxy added to
+  the end of its X-Forwarded-For header.  The earlier addresses in the header
+  come from the client, and can't be trusted.
+  :param remote_addr: the address of the peer which sent the request
+  :param forwarded_for: the request's X-Forwarded-For header (or None)
+  """
+  if forwarded_for and (settings.RATE_LIMIT_TRUST_FORWARDED_FOR or is_loopback(remote_addr)):
+    forwarded = forwarded_for.split(",")[-1].strip()
+    if forwarded:
+      return forwarded
+  return remote_addr
+
+def is_loopback(addr):
   try:
-    send_notification_email(req_data, metadata_web_url)
-  except Exception as e: 
-    app.logger.error("Unable to send notification email for new API. {}".format(e))
+    return ipaddress.ip_address(addr).is_loopback
+  except ValueError:
+    return False
 
-  return jsonify(success_resp), 200
+def rate_limit_keys(req_data, ip):
+  """
+  The keys of a request to /register for each rate limit: the submitter's 
+  business email and the client's IP address
+  """
+  submitter = req_data.get("submitted_by_person") if isinstance(req_data, dict) else None
+  email = submitter.get("business_email") if isinstance(submitter, dict) else None
+  return {
+    "submitter": email.strip().lower() if isinstance(email, str) else None,
+    "ip": ip
+  }
 
-# -----------------------------------------------------------------------------
-# Helper functions
-# -----------------------------------------------------------------------------
+def too_many_requests(e):
+  """
+  The response to a request rejected by admission control
+  :param e: the admission.RateLimited or breaker.BulkheadFull exception
+  """
+  body, status_code, headers = too_many_requests_response(e)
+  return jsonify(body), status_code, headers
+
+def too_many_requests_response(e):
+  """
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  return {"msg": "Too many registrations.  Retry after {} seconds.".format(e.retry_after)}, 429, {"Retry-After": "{}".format(e.retry_after)}
+
+def idempotency_conflict(e):
+  """
+  The response to a registration which conflicts with an earlier one with the
+  same Idempotency-Key (or body)
+  :param e: the idempotency.IdempotencyKeyReused or RequestInProgress exception
+  :return: a tuple (response body dictionary, http status code, headers dictionary)
+  """
+  if isinstance(e, IdempotencyKeyReused):
+    return {"msg": "The Idempotency-Key has already been used for a different registration."}, 422, {}
+  return {"msg": "A registration with the same Idempotency-Key (or body) is still in progress."}, 409, \
+    {"Retry-After": "{}".format(settings.IDEMPOTENCY_WAIT_TIMEOUT)}
+
+def catalogue_unavailable_body(e):
+  """
+  The response body when a registration can't be completed because requests to
+  the BC Data Catalog are failing fast (see breaker.py)
+  :param e: the breaker.Unavailable exception
+  """
+  return {
+    "msg": "The BC Data Catalog is unavailable.  Retry after {} seconds.".format(e.retry_after),
+    "retry_after": e.retry_after
+  }
+
+def batch_result_line(result):
+  """
+  Formats one result of a batch registration as a line of NDJSON
+  """
+  return jsoncodec.dumps(result) + "\n"
+
+def job_summary(job, job_url):
+  """
+  The representation of a registration job in responses
+  :param job: a job from the job queue
+  :param job_url: the url of the job's status resource
+  """
+  summary = {
+    "id": job["id"],
+    "url": job_url,
+    "status": job["status"],
+    "stage": job["stage"],
+    "created": job["created"],
+    "updated": job["updated"]
+  }
+  if job["status"] in FINISHED_STATUSES:
+    summary["status_code"] = job["status_code"]
+    summary["result"] = job["result"]
+  return summary
 
 def clean_and_validate_req_data(req_data):
+  """
+  Checks that a request to /register is complete and refers to known 
+  organizations, and fills in defaults
+  :return: the cleaned req_data
+  """
+  with validation_duration.time(), tracing.span("validate"):
+    req_data = clean_req_data(req_data)
+    organizations = get_organizations(referenced_org_ids(req_data))
+    return validate_organizations(req_data, organizations)
 
-  #ensure req_data folder hierarchy exists
-  #---------------------------------------
-  if not req_data:
-    req_data = {}
-  if not req_data.get("submitted_by_person"):
-    req_data["submitted_by_person"] = {}
-  if not req_data.get("metadata_details"):
-    req_data["metadata_details"] = {}
-  if not req_data["metadata_details"].get("owner"):
-    req_data["metadata_details"]["owner"] = {}
-  if not req_data["metadata_details"]["owner"].get("contact_person"):
-    req_data["metadata_details"]["owner"]["contact_person"] = {}
-  if not req_data["metadata_details"].get("security"):
-    req_data["metadata_details"]["security"] = {}
-  if not req_data["metadata_details"].get("license"):
-    req_data["metadata_details"]["license"] = {}
-  if not req_data.get("existing_api"):
-    req_data["existing_api"] = {}
-  if not req_data.get("gateway"):
-    req_data["gateway"] = {}
-
-  #check that required fields are present
-  #--------------------------------------
-  if not req_data["metadata_details"].get("title"):
-    raise ValueError("Missing '$.metadata_details.title'")
-  if not req_data["metadata_details"].get("description"):
-    raise ValueError("Missing '$.metadata_details.description'")
-
-  if not req_data["metadata_details"]["owner"].get("org_id"):
-    raise ValueError("Missing '$.metadata_details.owner.org_id'")
-  
-  if not req_data["metadata_details"]["owner"]["contact_person"].get("name"):
-    raise ValueError("Missing '$.metadata_details.owner.contact_person.name'")
-  if not req_data["metadata_details"]["owner"]["contact_person"].get("business_email"):
-    raise ValueError("Missing '$.metadata_details.owner.contact_person.business_email'") 
-
-  if not req_data["metadata_details"]["security"].get("download_audience"):
-    raise ValueError("Missing '$.metadata_details.security.download_audience'")
-  if not req_data["metadata_details"]["security"].get("view_audience"):
-    raise ValueError("Missing '$.metadata_details.security.view_audience'")
-  if not req_data["metadata_details"]["security"].get("metadata_visibility"):
-    raise ValueError("Missing '$.metadata_details.security.metadata_visibility'")
-  if not req_data["metadata_details"]["security"].get("security_class"):
-    raise ValueError("Missing '$.metadata_details.security.security_class'")
-
-  if not req_data["metadata_details"]["license"].get("license_id"):
-    raise ValueError("Missing '$.metadata_details.license.license_id'")
-
-  if not req_data["submitted_by_person"].get("name"):
-    raise ValueError("Missing '$.submitted_by_person.name'")
-  if not req_data["submitted_by_person"].get("org_id") and not req_data["submitted_by_person"].get("org_name"):
-    raise ValueError("Missing one of '$.submitted_by_person.org_id' or '$submitted_by_person.org_name'")
-  if not req_data["submitted_by_person"].get("business_email"):
-    raise ValueError("Missing '$.submitted_by_person.business_email'")
-
-  if not req_data["existing_api"].get("base_url"):
-    raise ValueError("Missing '$.existing_api.base_url'")
-
-#  if not req_data["gateway"].get("use_gateway"):
-#    raise ValueError("Missing '$.gateway.use_gateway'")
-
-  #clean fields
-  #------------
-  #change Title to title-case.  This can be problematic for abbreviations, such as "BC" (which becomes "Bc")
-  #req_data["metadata_details"]["title"] = req_data["metadata_details"]["title"].title()
-
-  #defaults
-  #--------
-  if not req_data["metadata_details"]["owner"]["contact_person"].get("org_id"):
-    req_data["metadata_details"]["owner"]["contact_person"]["org_id"] = req_data["metadata_details"]["owner"].get("org_id")
-  if not req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id"):
-    req_data["metadata_details"]["owner"]["contact_person"]["sub_org_id"] = req_data["metadata_details"]["owner"].get("sub_org_id")
+def clean_req_data(req_data):
+  """
+  Checks a request to /register against the registration schema (reporting all
+  the problems with it), and fills in defaults.  (Does not look up the 
+  organizations it refers to.)
+  :raises SchemaValidationError: if the request doesn't match the schema
+  """
+  req_data = registration_schema.validate(req_data)
+
+  #defaults which depend on other fields
+  #-------------------------------------
+  owner = req_data["metadata_details"]["owner"]
+  if not owner["contact_person"].get("org_id"):
+    owner["contact_person"]["org_id"] = owner.get("org_id")
+  if not owner["contact_person"].get("sub_org_id"):
+    owner["contact_person"]["sub_org_id"] = owner.get("sub_org_id")
+
+  return req_data
+
+def referenced_org_ids(req_data):
+  """
+  The ids of all organizations referred to by a (cleaned) request to /register
+  """
+  return [
+    req_data["metadata_details"]["owner"].get("org_id"),
+    req_data["metadata_details"]["owner"].get("sub_org_id"),
+    req_data["metadata_details"]["owner"]["contact_person"].get("org_id"),
+    req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id"),
+    req_data["submitted_by_person"].get("org_id"),
+    req_data["submitted_by_person"].get("sub_org_id")
+  ]
+
+def validate_organizations(req_data, organizations):
+  """
+  Checks the organizations referred to by a (cleaned) request to /register, and
+  adds their names to $.validated
+  :param organizations: the result of bcdc.get_organizations for (at least) the
+    ids returned by referenced_org_ids.  Lookup errors are raised in the same 
+    order as the checks below.
+  """
+  orgs, org_errors = organizations
 
   #validate field values
   #---------------------
   req_data["validated"] = {}
-  owner_org = get_organization(req_data["metadata_details"]["owner"].get("org_id"))
+
+  def lookup_organization(org_id):
+    if org_id in org_errors:
+      raise org_errors[org_id]
+    return orgs.get(org_id)
+
+  owner_org = lookup_organization(req_data["metadata_details"]["owner"].get("org_id"))
   if owner_org:
     req_data["validated"]["owner_org_name"] = owner_org["title"]
   else:
     raise ValueError("Unknown organization specified in '$.metadata_details.owner.org_id'")    
   
-  owner_sub_org = get_organization(req_data["metadata_details"]["owner"].get("sub_org_id"))
+  owner_sub_org = lookup_organization(req_data["metadata_details"]["owner"].get("sub_org_id"))
   if owner_sub_org:
     req_data["validated"]["owner_sub_org_name"] = owner_sub_org["title"]    
   
-  owner_contact_org = get_organization(req_data["metadata_details"]["owner"]["contact_person"].get("org_id"))
+  owner_contact_org = lookup_organization(req_data["metadata_details"]["owner"]["contact_person"].get("org_id"))
   if owner_contact_org:
     req_data["validated"]["owner_contact_org_name"] = owner_contact_org["title"]
   else:
     raise ValueError("Unknown organization specified in '$.metadata_details.owner.contact_person.org_id'")
 
-  owner_contact_sub_org = get_organization(req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id"))
+  owner_contact_sub_org = lookup_organization(req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id"))
   if owner_contact_sub_org:
     req_data["validated"]["owner_contact_sub_org_name"] = owner_contact_sub_org["title"]
 
-  submitted_by_person_org = get_organization(req_data["submitted_by_person"].get("org_id"))
+  submitted_by_person_org = lookup_organization(req_data["submitted_by_person"].get("org_id"))
   if submitted_by_person_org:
     req_data["validated"]["submitted_by_person_org_name"] = submitted_by_person_org["title"]
 
-  submitted_by_person_sub_org = get_organization(req_data["submitted_by_person"].get("sub_org_id"))
+  submitted_by_person_sub_org = lookup_organization(req_data["submitted_by_person"].get("sub_org_id"))
   if submitted_by_person_sub_org:
     req_data["validated"]["submitted_by_person_sub_org_name"] = submitted_by_person_sub_org["title"]
 
@@ -236,19 +911,86 @@ def clean_and_validate_req_data(req_data):
 
   return req_data
 
-def create_package(req_data):
+def create_package_with_resources(req_data):
+  """
+  Registers a new package with BCDC.  If BCDC accepts packages with inline 
+  resources, the package and its resources (see create_api_root_resource and
+  create_api_spec_resource) are created in a single request.  Otherwise only
+  the package is created, and the caller must create the resources separately.
+  :param req_data: the req_data of the http request to the /register resource
+  :return: a tuple (package, resources_created)
+  """
+  #probe the API's urls concurrently.  the results are cached for the resources.
+  with tracing.span("probe_urls"):
+    url_probe.content_types([
+      req_data["existing_api"].get("base_url"),
+      req_data["existing_api"].get("openapi_spec_url")
+    ])
+
+  if inline_resources_supported:
+    try:
+      return create_package(req_data, resources=inline_resource_dicts(req_data)), True
+    except InlineResourcesRejected as e:
+      #fall back to creating the resources separately
+      inline_resources_rejected(e)
+
+  return create_package(req_data), False
+
+def inline_resource_dicts(req_data):
+  """
+  The resources to create inline with a registration's package
+  """
+  resources = [api_root_resource_dict(req_data)]
+  api_spec_resource = api_spec_resource_dict(req_data)
+  if api_spec_resource:
+    resources.append(api_spec_resource)
+  return resources
+
+def inline_resources_rejected(e):
+  """
+  Remembers (for subsequent registrations) that BCDC rejected a package with 
+  inline resources
+  """
+  global inline_resources_supported
+  app.logger.warning("BCDC rejected a package with inline resources.  Resources will be created separately. {}".format(e))
+  inline_resources_supported = False
+
+def create_package(req_data, resources=None):
   """
   Registers a new package with BCDC
   :param req_data: the req_data of the http request to the /register resource
+  :param resources: an optional list of resource dictionaries to create along
+    with the package (in the same request)
   
     "org": req_data["metadata_details"]["owner"]["contact_person"].get("org_id", settings.BCDC_PACKAGE_OWNER_ORG_ID),
     "sub_org": req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id", settings.BCDC_PACKAGE_OWNER_SUB_ORG_ID),
     "owner_org": req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id", settings.BCDC_PACKAGE_OWNER_SUB_ORG_ID),
   
   """
+  try:
+    with tracing.span("create_package"):
+      try:
+        package = package_create(package_dict_for(req_data, resources), api_key=settings.BCDC_API_KEY)
+      except PackageNameTaken:
+        if not settings.BCDC_AUTO_UNIQUE_NAME:
+          raise
+        #the name was taken after the package name index was loaded.  it has
+        #now been added to the index, so the next name is tried.
+        package = package_create(package_dict_for(req_data, resources), api_key=settings.BCDC_API_KEY)
+    app.logger.debug("Created metadata record: {}".format(package_id_to_web_url(package["id"])))
+    return package
+  except (ValueError, RuntimeError) as e: 
+    raise e
+
+def package_dict_for(req_data, resources=None):
+  """
+  The package (for BCDC's package_create) which describes a registration
+  :param resources: an optional list of resource dictionaries to create along
+    with the package (in the same request)
+  """
   package_dict = {
     "title": req_data["metadata_details"].get("title"),
-    "name": prepare_package_name(req_data["metadata_details"].get("title")),
+    "name": package_name_for(req_data["metadata_details"].get("title")),
     "org": settings.BCDC_PACKAGE_OWNER_ORG_ID,
     "sub_org": settings.BCDC_PACKAGE_OWNER_SUB_ORG_ID,
     "owner_org": settings.BCDC_PACKAGE_OWNER_SUB_ORG_ID,
@@ -280,12 +1022,25 @@ def create_package(req_data):
     ]
   }
 
-  try:
-    package = package_create(package_dict, api_key=settings.BCDC_API_KEY)
-    app.logger.debug("Created metadata record: {}".format(package_id_to_web_url(package["id"])))
-    return package
-  except (ValueError, RuntimeError) as e: 
-    raise e
+  if resources:
+    package_dict["resources"] = resources
+
+  return package_dict
+
+def package_name_for(title):
+  """
+  The name (the last part of the URL) of the package for a registration with
+  the given title.  Names which are taken (according to the package name index)
+  are rejected before anything is sent to BCDC, or if BCDC_AUTO_UNIQUE_NAME is
+  enabled, replaced with a unique name.
+  :raises PackageNameTaken: if the name is taken
+  """
+  name = prepare_package_name(title)
+  if not package_name_taken(name):
+    return name
+  if settings.BCDC_AUTO_UNIQUE_NAME:
+    return unique_package_name(name)
+  raise PackageNameTaken(NAME_TAKEN_MSG)
 
 def create_api_root_resource(package_id, req_data):
   """
@@ -294,28 +1049,36 @@ def create_api_root_resource(package_id, req_data):
   :param req_data: the req_data of the request to /register as a dictionary
   :return: the new resource
   """
+  with tracing.span("api_root_resource"):
+    resource_dict = api_root_resource_dict(req_data, package_id)
+    resource = resource_create(resource_dict, api_key=settings.BCDC_API_KEY)
+  return resource
+
+def api_root_resource_dict(req_data, package_id=None):
+  """
+  The "API root" resource, which represents the base URL of the API
+  :param req_data: the req_data of the request to /register as a dictionary
+  :param package_id: the id of the package the resource belongs to.  Omitted 
+    when the resource is created inline with its package.
+  """
   
-  #download api base url and check its content type (so we can create a 'resource' 
+  #check the content type of the api base url (so we can create a 'resource' 
   #with the appropriate content type)
   format = "text"
-  try:
-    r = requests.get(req_data["existing_api"]["base_url"])
-    if r.status_code < 400:
-      resource_content_type = r.headers['content-type']
-      format = content_type_to_format(resource_content_type, "text")
-  except requests.exceptions.ConnectionError as e:
+  resource_content_type = url_probe.content_type(req_data["existing_api"]["base_url"])
+  if resource_content_type:
+    format = content_type_to_format(resource_content_type, "text")
+  else:
     app.logger.warning("Unable to access API '{}' to determine content type.".format(req_data["existing_api"]["base_url"]))
-    pass
 
-  #add the "API root" resource to the package
   resource_dict = {
-    "package_id": package_id, 
     "url": req_data["existing_api"]["base_url"],
     "format": format, 
     "name": "API root"
   }
-  resource = resource_create(resource_dict, api_key=settings.BCDC_API_KEY)
-  return resource
+  if package_id:
+    resource_dict["package_id"] = package_id
+  return resource_dict
 
 def create_api_spec_resource(package_id, req_data):
   """
@@ -327,27 +1090,78 @@ def create_api_spec_resource(package_id, req_data):
   :return: the new resource
   """
 
-  if req_data["existing_api"].get("openapi_spec_url"):
-    resource_dict = {
-      "package_id": package_id, 
-      "url": req_data["existing_api"]["openapi_spec_url"],
-      "format": "openapi-json",
-      "name": "API specification"
-    }
-    resource = resource_create(resource_dict, api_key=settings.BCDC_API_KEY)
-    return resource
+  with tracing.span("api_spec_resource"):
+    resource_dict = api_spec_resource_dict(req_data, package_id)
+    if resource_dict:
+      resource = resource_create(resource_dict, api_key=settings.BCDC_API_KEY)
+      return resource
 
   return None
 
+def api_spec_resource_dict(req_data, package_id=None):
+  """
+  The "API specification" resource, or None if $.existing_api.openapi_spec_url 
+  is not present in req_data
+  :param req_data: the body of the request to /register as a dictionary
+  :param package_id: the id of the package the resource belongs to.  Omitted 
+    when the resource is created inline with its package.
+  """
+  if not req_data["existing_api"].get("openapi_spec_url"):
+    return None
+
+  format = "openapi-json"
+  spec_content_type = url_probe.content_type(req_data["existing_api"]["openapi_spec_url"])
+  if spec_content_type and content_type_to_format(spec_content_type) == "yaml":
+    format = "openapi-yaml"
+
+  resource_dict = {
+    "url": req_data["existing_api"]["openapi_spec_url"],
+    "format": format,
+    "name": "API specification"
+  }
+  if package_id:
+    resource_dict["package_id"] = package_id
+  return resource_dict
+
 def send_notification_email(req_data, package_id):
   """
-  Sends a notification email
+  Sends a notification email about a new API
+  """
+  email_subject = "New API Registered - {}".format(req_data["metadata_details"]["title"])
+  with tracing.span("email_render"):
+    email_body = prepare_email_body(req_data, package_id)
+    email_text_body = prepare_email_text(req_data, package_id)
+  deliver_email(email_subject, email_body, email_text_body)
+
+def send_batch_notification_email(registrations):
+  """
+  Sends one notification email about a batch of new APIs
+  :param registrations: a list of (req_data, metadata_web_url) tuples
+  """
+  params = {
+    "registrations": [notification_params(req_data, metadata_web_url) for req_data, metadata_web_url in registrations]
+  }
+  email_subject = "{} New APIs Registered".format(len(registrations))
+  email_body = email_templates.render("batch_notification.html", **params)
+  email_text_body = email_templates.render("batch_notification.txt", **params)
+  deliver_email(email_subject, email_body, email_text_body)
+
+def deliver_email(email_subject, email_body, email_text_body):
+  """
+  Sends an email to the notification recipients.  If the email outbox is 
+  enabled the email is added to the outbox and sent later by the outbox sender.
   """
+  if email_outbox:
+    with tracing.span("email_queue"):
+      message_id = email_outbox.add(settings.TARGET_EMAIL_ADDRESSES, email_subject, email_body, email_text_body)
+    app.logger.debug("Added notification email {} to the outbox".format(message_id))
+    return
 
   send_email(
     settings.TARGET_EMAIL_ADDRESSES, \
-    email_subject="New API Registered - {}".format(req_data["metadata_details"]["title"]), \
-    email_body=prepare_email_body(req_data, package_id), \
+    email_subject=email_subject, \
+    email_body=email_body, \
+    email_text_body=email_text_body, \
     smtp_server=settings.SMTP_SERVER, \
     smtp_port=settings.SMTP_PORT, \
     from_email_address=settings.FROM_EMAIL_ADDRESS, \
@@ -357,127 +1171,30 @@ def send_notification_email(req_data, package_id):
 
 def prepare_email_body(req_data, metadata_web_url):
   """
-  Creates the body of the notification email
+  Creates the (html) body of the notification email
   :param req_data: the body of the request to /register as a dictionary
   :param metadata_web_url: a BCDC metadata record url
   """
+  return email_templates.render("notification.html", **notification_params(req_data, metadata_web_url))
 
-  css_filename = "css/bootstrap.css"
-
-  owner_org = get_organization(req_data["metadata_details"]["owner"]["org_id"])
-
-  with open(css_filename, 'r') as css_file:
-    css=css_file.read() #.replace('\n', '')  
-
-  template = Template("""
-  <html>
-  <head>
-  <style>
-  """
-  +css+
-  """
-  .table-condensed {font-size: 12px;}
-  </style>
-  </head>
-  <title>A new API has been registered</title>
-  <body>
-  <div class="container">
-  <h2>A new API has been registered</h2>
-
-  <table class="table table-condensed">
-    <tr>
-      <th>Title</th>
-      <td>{{req_data["metadata_details"]["title"]}}</td>
-    </tr>
-    <tr>
-      <th>Description</th>
-      <td>{{req_data["metadata_details"]["description"]}}</td>
-    </tr>
-    <tr>
-      <th>Metadata record</th>
-      <td><a href="{{metadata["web_url"]}}">{{metadata["web_url"]}}</a></td>
-    </tr>
-    <tr>
-      <th>API Owner</th>
-      <td>
-        Organization: 
-          {% if req_data["validated"]["owner_sub_org_name"] %} {{req_data["validated"].get("owner_sub_org_name")}}, {% endif %}
-          {{req_data["validated"]["owner_org_name"]}}
-      </td>
-    </tr>
-    <tr>
-      <th>API Primary Contact Person</th>
-      <td>
-        {{req_data["metadata_details"]["owner"]["contact_person"]["name"]}}<br/>
-        Organization:
-          {% if req_data["validated"]["owner_contact_sub_org_name"] %} {{req_data["validated"].get("owner_contact_sub_org_name")}}, {% endif %}
-          {{req_data["validated"]["owner_contact_org_name"]}}<br/>
-        {{req_data["metadata_details"]["owner"]["contact_person"]["business_email"]}}<br/>
-        {{req_data["metadata_details"]["owner"]["contact_person"]["business_phone"]}}<br/>
-        Role: {{req_data["metadata_details"]["owner"]["contact_person"]["role"]}}
-      </td>
-    </tr>
-    <tr>
-      <th>Submitted by</th>
-      <td>
-        {{req_data["submitted_by_person"]["name"]}}<br/>
-        Organization:
-          {% if req_data["validated"]["submitted_by_person_sub_org_name"] %} {{req_data["validated"].get("submitted_by_person_sub_org_name")}}, {% endif %}
-          {{req_data["validated"]["submitted_by_person_org_name"]}}<br/>
-        {{req_data["submitted_by_person"]["business_email"]}}<br/>
-        {{req_data["submitted_by_person"]["business_phone"]}}<br/>
-        Role: {{req_data["submitted_by_person"]["role"]}}
-      </td>
-    </tr>
-    <tr>
-      <th>API</th>
-      <td>
-        <a href="{{req_data["existing_api"]["base_url"]}}">{{req_data["existing_api"]["base_url"]}}</a><br/>
-        Supports
-          CORS: {% if req_data["existing_api"]["supports"].get("cors") %} {{req_data["existing_api"]["supports"].get("cors")}} {% else %} unknown {% endif %}, 
-          HTTPS: {% if req_data["existing_api"]["supports"].get("https") %} {{req_data["existing_api"]["supports"].get("https")}} {% else %} unknown {% endif %} 
-      </td>
-    </tr>
-    <tr>
-      <th>OpenAPI specification</th>
-      <td>
-        {% if req_data["existing_api"].get("openapi_spec_url") %}
-          <a href='{{req_data["existing_api"].get("openapi_spec_url")}}'>{{req_data["existing_api"].get("openapi_spec_url")}}</a>
-        {% else %}
-          None
-        {% endif %}
-      </td>
-    </tr>
-    <tr>
-      <th>API gateway?</th>
-      <td>
-        Use Gateway?:{% if req_data["gateway"].get("use_gateway") %} 
-          Yes<br/>
-          {% if req_data["gateway"].get("use_throttling") != None %} Enable throttling?: {{req_data["gateway"].get("use_throttling")}} {% endif %}<br/>
-          {% if req_data["gateway"].get("restrict_access") != None %} Use API keys?: {{req_data["gateway"].get("restrict_access")}} {% endif %}<br/>
-          Suggested API short name?: {{req_data["gateway"].get("api_shortname", "not specified")}}
-        {% else %} 
-          No 
-        {% endif %}
-
-      </td>
-    </tr>
-  </table>
-
-  </div>
-  </body>
-  </html>
-  """
-  )
+def prepare_email_text(req_data, metadata_web_url):
+  """
+  Creates the plain text alternative to the body of the notification email
+  :param req_data: the body of the request to /register as a dictionary
+  :param metadata_web_url: a BCDC metadata record url
+  """
+  return email_templates.render("notification.txt", **notification_params(req_data, metadata_web_url))
 
-  params = {
+def notification_params(req_data, metadata_web_url):
+  """
+  The parameters of the notification email templates
+  """
+  return {
     "req_data": req_data,
     "metadata": {
       "web_url": metadata_web_url
     }
   }
-  html = template.render(params)
-  return html
 
 def content_type_to_format(content_type, default=None):
   """
@@ -490,4 +1207,6 @@ def content_type_to_format(content_type, default=None):
     return "json"
   if "xml" in content_type:
     return "xml"
+  if "yaml" in content_type:
+    return "yaml"
   return default
@@ -0,0 +1,350 @@
+"""
+Purpose: Collect metrics (counters, gauges and latency histograms) and expose
+them in the Prometheus text format.
+
+gunicorn runs several worker processes, each with its own metrics.  So that a
+scrape handled by any worker reports the totals of all of them, each process
+periodically writes its metrics to a file in a shared directory, and a scrape
+adds up the files of all processes.  Counters and histograms of processes which
+have exited are kept (so totals never go backwards), but their gauges are not.
+"""
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from .sqlitedb import process_owner, owner_is_alive
+
+logger = logging.getLogger(__name__)
+
+#Upper bounds (in seconds) of the buckets of latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+#The file in a shared metrics directory which holds the totals of processes that have exited
+ARCHIVE_FILENAME = "archive.json"
+LOCK_FILENAME = ".lock"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Metric(object):
+  """
+  Base class for metrics.  A metric has a value for each combination of label
+  values it has been given.
+  """
+  type = None
+
+  def __init__(self, name, help, labelnames=()):
+    self.name = name
+    self.help = help
+    self.labelnames = tuple(labelnames)
+    self._values = {}
+    self._lock = threading.Lock()
+
+  def samples(self):
+    """
+    :return: a list of [label values, value] pairs
+    """
+    with self._lock:
+      return [[list(key), self._copy(value)] for key, value in self._values.items()]
+
+  def reset(self):
+    with self._lock:
+      self._values = {}
+
+  def _key(self, labels):
+    return tuple("{}".format(labels.get(name, "")) for name in self.labelnames)
+
+  def _copy(self, value):
+    return value
+
+class Counter(Metric):
+  type = "counter"
+
+  def inc(self, amount=1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+  type = "gauge"
+
+  def inc(self, amount=1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount=1, **labels):
+    self.inc(-amount, **labels)
+
+  def set(self, value, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+  @contextmanager
+  def track_in_progress(self, **labels):
+    """
+    Increments the gauge while the body of the 'with' statement runs
+    """
+    self.inc(**labels)
+    try:
+      yield
+    finally:
+      self.dec(**labels)
+
+class Histogram(Metric):
+  type = "histogram"
+
+  def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    Metric.__init__(self, name, help, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    key = self._key(labels)
+    with self._lock:
+      state = self._values.get(key)
+      if state is None:
+        #the number of observations in each bucket (not cumulative), the sum and the count
+        state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          state[0][i] += 1
+          break
+      state[1] += value
+      state[2] += 1
+
+  @contextmanager
+  def time(self, **labels):
+    """
+    Observes the time taken by the body of the 'with' statement (even if it raises)
+    """
+    start = time.monotonic()
+    try:
+      yield
+    finally:
+      self.observe(time.monotonic() - start, **labels)
+
+  def _copy(self, value):
+    return [list(value[0]), value[1], value[2]]
+
+class Registry(object):
+  """
+  The metrics of a process, and (optionally) the directory in which the
+  metrics of all processes on a host are shared
+  """
+
+  def __init__(self):
+    self._metrics = []
+    self._lock = threading.Lock()
+    self.directory = None
+    self._filename = None
+    self._filename_pid = None
+
+  def register(self, metric):
+    """
+    Adds a metric.  If a metric with the same name is already registered, that
+    metric is returned instead.
+    """
+    with self._lock:
+      for existing in self._metrics:
+        if existing.name == metric.name:
+          return existing
+      self._metrics.append(metric)
+      return metric
+
+  def snapshot(self):
+    """
+    The current metrics of this process, in a form which can be saved as JSON
+    """
+    snapshot = {}
+    for metric in self._metrics:
+      snapshot[metric.name] = {
+        "type": metric.type,
+        "help": metric.help,
+        "labelnames": list(metric.labelnames),
+        "buckets": list(getattr(metric, "buckets", [])),
+        "samples": metric.samples()
+      }
+    return snapshot
+
+  def reset(self):
+    """
+    Clears all metrics.  Used in a forked child, which mustn't report the
+    metrics of its parent as its own.
+    """
+    for metric in self._metrics:
+      metric.reset()
+
+  def share(self, directory, interval):
+    """
+    Starts writing this process's metrics to the given directory every
+    'interval' seconds (and when the process exits)
+    """
+    os.makedirs(directory, exist_ok=True)
+    self.directory = directory
+    atexit.register(self.flush)
+    thread = threading.Thread(target=self._flush_forever, args=(interval,), daemon=True)
+    thread.start()
+
+  def flush(self):
+    """
+    Writes this process's metrics to the shared directory
+    """
+    if not self.directory:
+      return
+    path = os.path.join(self.directory, self._process_filename())
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+      json.dump(self.snapshot(), f)
+    os.replace(temp_path, path)
+
+  def collect(self):
+    """
+    The metrics of all processes sharing the directory (or just this process
+    if the directory isn't shared), combined
+    """
+    if not self.directory:
+      return self.snapshot()
+
+    self.flush()
+    with open(os.path.join(self.directory, LOCK_FILENAME), "a") as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        return self._collect_files()
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def render(self):
+    """
+    The combined metrics in the Prometheus text format
+    """
+    return exposition(self.collect())
+
+  def _collect_files(self):
+    archive_path = os.path.join(self.directory, ARCHIVE_FILENAME)
+    archive = _load(archive_path) or {}
+    archive_changed = False
+
+    combined = {}
+    for filename in sorted(os.listdir(self.directory)):
+      if not filename.endswith(".json") or filename == ARCHIVE_FILENAME:
+        continue
+      path = os.path.join(self.directory, filename)
+      snapshot = _load(path)
+      if snapshot is None:
+        continue
+      owner = filename[:-len(".json")].rpartition("@")[0]
+      if owner_is_alive(owner):
+        _merge(combined, snapshot, include_gauges=True)
+      else:
+        #fold the totals of an exited process into the archive
+        _merge(archive, snapshot, include_gauges=False)
+        archive_changed = True
+        os.remove(path)
+
+    if archive_changed:
+      temp_path = archive_path + ".tmp"
+      with open(temp_path, "w") as f:
+        json.dump(archive, f)
+      os.replace(temp_path, archive_path)
+
+    _merge(combined, archive, include_gauges=False)
+    return combined
+
+  def _process_filename(self):
+    #the file name includes the process's start time, so a new process which
+    #reuses the pid of an exited one doesn't overwrite its metrics
+    if self._filename_pid != os.getpid():
+      self._filename = "{}@{}.json".format(process_owner(), int(time.time() * 1000))
+      self._filename_pid = os.getpid()
+    return self._filename
+
+  def _flush_forever(self, interval):
+    while True:
+      time.sleep(interval)
+      try:
+        self.flush()
+      except (OSError, ValueError) as e:
+        logger.warning("Unable to write metrics. {}".format(e))
+
+def _load(path):
+  try:
+    with open(path, "r") as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+def _merge(combined, snapshot, include_gauges):
+  """
+  Adds the metrics in a snapshot to the combined metrics
+  """
+  for name, metric in snapshot.items():
+    if metric["type"] == "gauge" and not include_gauges:
+      continue
+    target = combined.get(name)
+    if target is None:
+      target = combined[name] = dict(metric, samples=[])
+    values = dict((tuple(labels), value) for labels, value in target["samples"])
+    for labels, value in metric["samples"]:
+      labels = tuple(labels)
+      existing = values.get(labels)
+      if existing is None:
+        values[labels] = value
+      elif metric["type"] == "histogram":
+        if len(existing[0]) == len(value[0]):
+          values[labels] = [[a + b for a, b in zip(existing[0], value[0])], existing[1] + value[1], existing[2] + value[2]]
+      else:
+        values[labels] = existing + value
+    target["samples"] = [[list(labels), value] for labels, value in values.items()]
+
+def exposition(metrics):
+  """
+  Formats metrics (as returned by Registry.collect) in the Prometheus text format
+  """
+  lines = []
+  for name in sorted(metrics.keys()):
+    metric = metrics[name]
+    lines.append("# HELP {} {}".format(name, metric["help"].replace("\\", "\\\\").replace("\n", "\\n")))
+    lines.append("# TYPE {} {}".format(name, metric["type"]))
+    for labels, value in sorted(metric["samples"]):
+      pairs = list(zip(metric["labelnames"], labels))
+      if metric["type"] != "histogram":
+        lines.append("{}{} {}".format(name, _labels(pairs), _number(value)))
+        continue
+      bucket_counts, total, count = value
+      cumulative = 0
+      for bound, bucket_count in zip(metric["buckets"], bucket_counts):
+        cumulative += bucket_count
+        lines.append("{}_bucket{} {}".format(name, _labels(pairs + [("le", _number(bound))]), cumulative))
+      lines.append("{}_bucket{} {}".format(name, _labels(pairs + [("le", "+Inf")]), count))
+      lines.append("{}_sum{} {}".format(name, _labels(pairs), _number(total)))
+      lines.append("{}_count{} {}".format(name, _labels(pairs), count))
+  return "\n".join(lines) + "\n"
+
+def _labels(pairs):
+  if not pairs:
+    return ""
+  return "{{{}}}".format(",".join('{}="{}"'.format(name, "{}".format(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs))
+
+def _number(value):
+  if isinstance(value, float) and value.is_integer():
+    return "{:.1f}".format(value)
+  return "{}".format(value)
+
+#The metrics of this process
+registry = Registry()
+
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=registry.reset)
+
+def counter(name, help, labelnames=()):
+  return registry.register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+  return registry.register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+  return registry.register(Histogram(name, help, labelnames, buckets))
@@ -0,0 +1,48 @@
+"""
+Purpose: A compact set of names, for checking whether a name is taken without
+asking BCDC (see the package name index in bcdc.py).
+
+Each name is stored as an 8 byte hash (blake2b) in a sorted array, which takes
+8 bytes per name rather than the ~100 of a str in a Python set, and is searched
+by bisection.  Two names may (very rarely) have the same hash, so a name may
+appear to be taken when it isn't, but never the reverse.
+"""
+import hashlib
+import threading
+from array import array
+from bisect import bisect_left
+
+def name_hash(name):
+  """
+  :return: the 64 bit hash of a name, as an int
+  """
+  return int.from_bytes(hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest(), "big")
+
+class NameSet(object):
+  """
+  A set of names which can be added to but not removed from.  (A name which
+  is no longer taken is forgotten when the set is rebuilt.)
+  """
+
+  def __init__(self, names=()):
+    self._hashes = array("Q", sorted(set(name_hash(name) for name in names)))
+    self._lock = threading.Lock()
+
+  def __contains__(self, name):
+    hashes = self._hashes
+    h = name_hash(name)
+    i = bisect_left(hashes, h)
+    return i < len(hashes) and hashes[i] == h
+
+  def __len__(self):
+    return len(self._hashes)
+
+  def add(self, name):
+    h = name_hash(name)
+    with self._lock:
+      i = bisect_left(self._hashes, h)
+      if i == len(self._hashes) or self._hashes[i] != h:
+        self._hashes.insert(i, h)
+
+  def size_in_bytes(self):
+    return self._hashes.buffer_info()[1] * self._hashes.itemsize
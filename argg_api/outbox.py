@@ -0,0 +1,186 @@
+"""
+Purpose: A durable outbox for notification emails.  Messages are written to a
+SQLite file and sent by a background sender over a reused SMTP connection, so
+sending email doesn't add to the time taken to respond to a request.  Messages
+which can't be sent are retried with exponential backoff, and after too many
+attempts are moved to the dead letter state (where they are kept for inspection).
+"""
+import logging
+import smtplib
+import sqlite3
+import threading
+import time
+from .sqlitedb import connect, enable_wal, process_owner, owner_is_alive
+
+logger = logging.getLogger(__name__)
+
+#message statuses
+PENDING = "pending"
+SENDING = "sending"
+DEAD = "dead"
+
+class Outbox(object):
+  """
+  Email messages waiting to be sent, kept in a SQLite file which may be shared
+  by several worker processes
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._wake = threading.Event()
+    enable_wal(path)
+    with connect(path) as conn:
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS message (
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          created REAL NOT NULL,
+          recipients TEXT NOT NULL,
+          subject TEXT,
+          body TEXT,
+          text_body TEXT,
+          status TEXT NOT NULL,
+          attempts INTEGER NOT NULL DEFAULT 0,
+          next_attempt REAL NOT NULL,
+          last_error TEXT,
+          owner TEXT
+        )""")
+      conn.execute("CREATE INDEX IF NOT EXISTS message_due ON message (status, next_attempt)")
+      #outboxes created before plain text alternatives were supported
+      columns = [row[1] for row in conn.execute("PRAGMA table_info(message)")]
+      if "text_body" not in columns:
+        conn.execute("ALTER TABLE message ADD COLUMN text_body TEXT")
+
+  def add(self, recipients_csv, subject, body, text_body=None):
+    """
+    Adds a message to the outbox
+    :param body: the html body of the message
+    :param text_body: an optional plain text alternative to the body
+    :return: the id of the new message
+    """
+    now = time.time()
+    with connect(self.path) as conn:
+      cursor = conn.execute("INSERT INTO message (created, recipients, subject, body, text_body, status, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (now, recipients_csv, subject, body, text_body, PENDING, now))
+    self._wake.set()
+    return cursor.lastrowid
+
+  def claim_due(self, limit):
+    """
+    Claims pending messages which are due to be sent, so that no other process
+    sends them
+    :return: a list of messages (as dictionaries)
+    """
+    owner = process_owner()
+    with connect(self.path) as conn:
+      conn.execute("""
+        UPDATE message SET status = ?, owner = ?
+        WHERE id IN (SELECT id FROM message WHERE status = ? AND next_attempt <= ? ORDER BY id LIMIT ?)""",
+        (SENDING, owner, PENDING, time.time(), limit))
+      conn.row_factory = sqlite3.Row
+      rows = conn.execute("SELECT * FROM message WHERE status = ? AND owner = ? ORDER BY id", (SENDING, owner)).fetchall()
+    return [dict(row) for row in rows]
+
+  def sent(self, message_id):
+    with connect(self.path) as conn:
+      conn.execute("DELETE FROM message WHERE id = ?", (message_id,))
+
+  def failed(self, message, error, max_attempts, backoff):
+    """
+    Records a failed attempt to send a message.  The message is retried after
+    backoff * 2^(attempts-1) seconds, or marked dead after max_attempts.
+    """
+    attempts = message["attempts"] + 1
+    status = DEAD if attempts >= max_attempts else PENDING
+    next_attempt = time.time() + backoff * 2 ** (attempts - 1)
+    with connect(self.path) as conn:
+      conn.execute("UPDATE message SET status = ?, attempts = ?, next_attempt = ?, last_error = ?, owner = NULL WHERE id = ?",
+        (status, attempts, next_attempt, "{}".format(error), message["id"]))
+    return status
+
+  def release_abandoned(self):
+    """
+    Returns messages claimed by processes which no longer exist to the pending state
+    """
+    with connect(self.path) as conn:
+      rows = conn.execute("SELECT id, owner FROM message WHERE status = ?", (SENDING,)).fetchall()
+      for message_id, owner in rows:
+        if not owner_is_alive(owner):
+          conn.execute("UPDATE message SET status = ?, owner = NULL WHERE id = ? AND owner = ?", (PENDING, message_id, owner))
+
+  def wait(self, timeout):
+    """
+    Waits until a message is added by this process, or the timeout elapses
+    """
+    self._wake.wait(timeout)
+    self._wake.clear()
+
+  def stats(self):
+    """
+    The number of messages in each status
+    """
+    with connect(self.path) as conn:
+      rows = conn.execute("SELECT status, COUNT(*) FROM message GROUP BY status").fetchall()
+    stats = {PENDING: 0, SENDING: 0, DEAD: 0}
+    stats.update(dict(rows))
+    return stats
+
+class OutboxSender(object):
+  """
+  Sends the messages in an outbox from a background thread
+  """
+
+  def __init__(self, outbox, connection, poll_interval=5, batch_size=20, max_attempts=8, backoff=30):
+    """
+    :param outbox: the Outbox to send messages from
+    :param connection: the emailer.SMTPConnection to send messages through
+    :param poll_interval: the maximum number of seconds between checks for due messages
+    :param batch_size: the maximum number of messages claimed at a time
+    :param max_attempts: the number of failed attempts after which a message is dead
+    :param backoff: the number of seconds to wait after the first failed attempt.
+      The wait doubles after each subsequent failure.
+    """
+    self.outbox = outbox
+    self.connection = connection
+    self.poll_interval = poll_interval
+    self.batch_size = batch_size
+    self.max_attempts = max_attempts
+    self.backoff = backoff
+    self._thread = None
+
+  def start(self):
+    if self._thread:
+      return
+    self._thread = threading.Thread(target=self._run_forever, daemon=True)
+    self._thread.start()
+
+  def send_due(self):
+    """
+    Sends all messages which are due.
+    :return: the number of messages sent
+    """
+    count = 0
+    while True:
+      messages = self.outbox.claim_due(self.batch_size)
+      if not messages:
+        return count
+      for message in messages:
+        try:
+          self.connection.send(message["recipients"], email_subject=message["subject"], email_body=message["body"], email_text_body=message["text_body"])
+          self.outbox.sent(message["id"])
+          count += 1
+        except (ValueError, smtplib.SMTPException, OSError) as e:
+          status = self.outbox.failed(message, e, self.max_attempts, self.backoff)
+          if status == DEAD:
+            logger.error("Unable to send notification email {}.  Giving up after {} attempts. {}".format(message["id"], self.max_attempts, e))
+          else:
+            logger.warning("Unable to send notification email {}.  Will retry. {}".format(message["id"], e))
+
+  def _run_forever(self):
+    self.outbox.release_abandoned()
+    while True:
+      try:
+        if self.send_due():
+          logger.debug("Sent notification emails from outbox")
+      except Exception as e:
+        logger.error("Unable to process email outbox. {}".format(e))
+      self.outbox.wait(self.poll_interval)
@@ -0,0 +1,115 @@
+"""
+Purpose: Find the content type of the URLs given in registrations (such as an
+API's base URL and the URL of its OpenAPI specification).  These URLs belong to
+third parties, so each is probed with at most one bounded request: a HEAD
+request, or if the server doesn't support HEAD, a streamed GET of which only
+the first few bytes are read.  Results (including failures) are cached per URL.
+"""
+import logging
+import requests
+from . import metrics
+from .cache import TTLCache
+from .concurrency import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+#Statuses with which servers reject HEAD requests (but may accept GET)
+HEAD_UNSUPPORTED_STATUSES = [405, 501]
+
+#Content types which say nothing about the content, so the content is sniffed instead
+GENERIC_CONTENT_TYPES = ["application/octet-stream", "binary/octet-stream"]
+
+probe_duration = metrics.histogram("argg_url_probe_duration_seconds", "Time taken to probe the content type of URLs")
+probes_total = metrics.counter("argg_url_probes_total", "URLs probed, by result ('ok' or 'failed')", ["result"])
+
+class UrlProbe(object):
+  """
+  Probes URLs for their content type
+  """
+
+  def __init__(self, client, max_bytes=1024, ttl=3600, failure_ttl=300, max_size=1000, concurrency=4):
+    """
+    :param client: the httpclient.HttpClient used to send probes.  Its timeouts
+      bound the time taken by each probe.
+    :param max_bytes: the maximum number of bytes of content read when sniffing
+      the content type of a GET response
+    :param ttl: the number of seconds for which a URL's content type is cached
+    :param failure_ttl: the number of seconds for which a failed probe is cached
+    :param max_size: the maximum number of cached URLs
+    :param concurrency: the maximum number of URLs probed at the same time
+    """
+    self.client = client
+    self.max_bytes = max_bytes
+    self._cache = TTLCache(ttl=ttl, max_size=max_size, negative_ttl=failure_ttl, name="url probe cache")
+    self._pool = WorkerPool(concurrency)
+
+  def content_type(self, url):
+    """
+    :return: the content type of the given URL, or None if it couldn't be found
+    """
+    if not url:
+      return None
+    return self._cache.get(url, self._probe)
+
+  def content_types(self, urls):
+    """
+    Finds the content type of several URLs concurrently
+    :return: a dictionary of content type (or None) by URL
+    """
+    urls = list(dict.fromkeys(url for url in urls if url))
+    results = self._pool.run([lambda url=url: self.content_type(url) for url in urls])
+    return dict((url, content_type) for url, (content_type, _) in zip(urls, results))
+
+  def stats(self):
+    return self._cache.stats()
+
+  def _probe(self, url):
+    with probe_duration.time():
+      content_type = self._probe_once(url)
+    probes_total.inc(result="ok" if content_type else "failed")
+    return content_type
+
+  def _probe_once(self, url):
+    try:
+      r = self.client.head(url, allow_redirects=True)
+      r.close()
+      content_type = r.headers.get("content-type")
+      if r.status_code >= 400 and r.status_code not in HEAD_UNSUPPORTED_STATUSES:
+        logger.info("Unable to probe '{}'.  HTTP {}".format(url, r.status_code))
+        return None
+      if r.status_code < 400 and content_type and not _is_generic(content_type):
+        return content_type
+
+      #some servers don't support HEAD, or don't give a content type for it
+      r = self.client.get(url, allow_redirects=True, stream=True)
+      try:
+        if r.status_code >= 400:
+          logger.info("Unable to probe '{}'.  HTTP {}".format(url, r.status_code))
+          return None
+        content_type = r.headers.get("content-type")
+        if content_type and not _is_generic(content_type):
+          return content_type
+        return _sniff(r.raw.read(self.max_bytes, decode_content=True)) or content_type
+      finally:
+        r.close()
+    except (requests.exceptions.RequestException, OSError, ValueError) as e:
+      logger.info("Unable to probe '{}'. {}".format(url, e))
+      return None
+
+def _is_generic(content_type):
+  return content_type.split(";")[0].strip().lower() in GENERIC_CONTENT_TYPES
+
+def _sniff(content):
+  """
+  Guesses the content type from the first bytes of some content
+  """
+  start = content.lstrip()[:64].lower()
+  if start.startswith(b"{") or start.startswith(b"["):
+    return "application/json"
+  if start.startswith(b"<?xml"):
+    return "application/xml"
+  if start.startswith(b"<!doctype html") or start.startswith(b"<html"):
+    return "text/html"
+  if start.startswith(b"openapi:") or start.startswith(b"swagger:"):
+    return "application/yaml"
+  return None
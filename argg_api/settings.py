@@ -13,6 +13,26 @@ BCDC_PACKAGE_OWNER_SUB_ORG_ID = "c1222ef5-5013-4d9a-a9a0-373c54241e77" #DataBC
 # Load application settings from environment variables
 # -----------------------------------------------------------------------------
 
+#Problems with the settings (such as missing required ones).  They are reported
+#by the readiness endpoint (/readyz) rather than stopping the application from
+#starting, so a misconfigured deployment says what is wrong.
+CONFIG_ERRORS = []
+
+def number_setting(name, parse, default):
+  """
+  The value of a numeric setting.  A value which isn't a number is reported in
+  CONFIG_ERRORS, and the default used instead.
+  :param parse: int or float
+  :param default: the value if the environment variable isn't set
+  """
+  if not name in os.environ:
+    return default
+  try:
+    return parse(os.environ[name])
+  except ValueError:
+    CONFIG_ERRORS.append("Invalid '{}' environment variable '{}'.  Expecting {}.".format(name, os.environ[name], "an integer" if parse is int else "a number"))
+    return default
+
 #
 # Logging
 #
@@ -21,6 +41,77 @@ if not "LOG_LEVEL" in os.environ:
   LOG_LEVEL = "WARN"
 else:
   LOG_LEVEL = os.environ['LOG_LEVEL']
+if LOG_LEVEL not in ["ERROR", "WARN", "INFO", "DEBUG"]:
+  CONFIG_ERRORS.append("Invalid 'LOG_LEVEL' environment variable '{}'.  Expecting one of ERROR, WARN, INFO, DEBUG.".format(LOG_LEVEL))
+  LOG_LEVEL = "WARN"
+
+#How log lines are written: "json" (one JSON object per line) or "text"
+if not "LOG_FORMAT" in os.environ:
+  LOG_FORMAT = "json"
+else:
+  LOG_FORMAT = os.environ['LOG_FORMAT']
+if LOG_FORMAT not in ["json", "text"]:
+  CONFIG_ERRORS.append("Invalid 'LOG_FORMAT' environment variable '{}'.  Expecting json or text.".format(LOG_FORMAT))
+  LOG_FORMAT = "json"
+
+#The maximum number of log records waiting to be written.  Records logged while
+#the queue is full are dropped (and counted) rather than slowing requests down.
+LOG_QUEUE_SIZE = number_setting("LOG_QUEUE_SIZE", int, 10000)
+
+#The maximum number of characters of a response from BCDC included in a debug
+#log line
+LOG_MAX_PAYLOAD = number_setting("LOG_MAX_PAYLOAD", int, 1000)
+
+#If "true", one structured (JSON) line is logged for each request, with its id,
+#status, duration and the duration of each of its phases (regardless of
+#LOG_LEVEL)
+if not "REQUEST_LOG" in os.environ:
+  REQUEST_LOG = True
+else:
+  REQUEST_LOG = os.environ['REQUEST_LOG'].lower() in ["true", "1", "yes"]
+
+#If "true", responses have a Server-Timing header with the duration of each
+#phase of the request
+if not "SERVER_TIMING" in os.environ:
+  SERVER_TIMING = True
+else:
+  SERVER_TIMING = os.environ['SERVER_TIMING'].lower() in ["true", "1", "yes"]
+
+#
+# Startup
+#
+
+#If "true", each worker process opens a connection to BCDC before it serves
+#requests (in addition to loading the organization index, if enabled)
+if not "WARM_UP" in os.environ:
+  WARM_UP = True
+else:
+  WARM_UP = os.environ['WARM_UP'].lower() in ["true", "1", "yes"]
+
+#
+# JSON
+#
+
+#The library used to encode and decode JSON: "orjson" (faster, if installed),
+#"json" (the standard library) or "auto" (orjson if it is installed)
+if not "JSON_BACKEND" in os.environ:
+  JSON_BACKEND = "auto"
+else:
+  JSON_BACKEND = os.environ['JSON_BACKEND']
+if JSON_BACKEND not in ["auto", "orjson", "json"]:
+  CONFIG_ERRORS.append("Invalid 'JSON_BACKEND' environment variable '{}'.  Expecting one of auto, orjson, json.".format(JSON_BACKEND))
+  JSON_BACKEND = "auto"
+
+#
+# API specification
+#
+
+#How long (in seconds) clients may cache the API specification served at GET /
+API_SPEC_MAX_AGE = number_setting("API_SPEC_MAX_AGE", int, 300)
+
+#The maximum number of distinct base URLs (hosts) for which a rendered copy of 
+#the API specification is kept
+API_SPEC_MAX_VARIANTS = number_setting("API_SPEC_MAX_VARIANTS", int, 16)
 
 #
 # BC Data Catalog
@@ -28,71 +119,362 @@ else:
 
 #The base URL for BCDC (e.g. https://catalogue.data.gov.bc.ca)
 if not "BCDC_BASE_URL" in os.environ:
-  raise ValueError("Missing 'BCDC_BASE_URL' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_BASE_URL' environment variable.")
+  BCDC_BASE_URL = None
 else:
   BCDC_BASE_URL = os.environ['BCDC_BASE_URL']
 
 #The path after the base URL on which the BCDC REST API is accessible
 if not "BCDC_API_PATH" in os.environ:
-  raise ValueError("Missing 'BCDC_API_PATH' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_API_PATH' environment variable.")
+  BCDC_API_PATH = None
 else:
   BCDC_API_PATH = os.environ['BCDC_API_PATH']
 
 #The key use for all access to the BCDC REST API
 if not "BCDC_API_KEY" in os.environ:
-  raise ValueError("Missing 'BCDC_API_KEY' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_API_KEY' environment variable.")
+  BCDC_API_KEY = None
 else:
   BCDC_API_KEY = os.environ['BCDC_API_KEY']
 
 #The group that all new metadata records will be added to
 if not "BCDC_GROUP_ID" in os.environ:
-  raise ValueError("Missing 'BCDC_GROUP_ID' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_GROUP_ID' environment variable.")
+  BCDC_GROUP_ID = None
 else:
   BCDC_GROUP_ID = os.environ['BCDC_GROUP_ID']
 
 #Default organization to list as the owner for new metadata records 
 if not "BCDC_PACKAGE_OWNER_ORG_ID" in os.environ: 
-  raise ValueError("Missing 'BCDC_PACKAGE_OWNER_ORG_ID' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_PACKAGE_OWNER_ORG_ID' environment variable.")
+  BCDC_PACKAGE_OWNER_ORG_ID = None
 else:
   BCDC_PACKAGE_OWNER_ORG_ID = os.environ['BCDC_PACKAGE_OWNER_ORG_ID']
 
 #Default sub-organization to list as the owner for new metadata records 
 if not "BCDC_PACKAGE_OWNER_SUB_ORG_ID" in os.environ:
-  raise ValueError("Missing 'BCDC_PACKAGE_OWNER_SUB_ORG_ID' environment variable.")
+  CONFIG_ERRORS.append("Missing 'BCDC_PACKAGE_OWNER_SUB_ORG_ID' environment variable.")
+  BCDC_PACKAGE_OWNER_SUB_ORG_ID = None
 else:
   BCDC_PACKAGE_OWNER_SUB_ORG_ID = os.environ['BCDC_PACKAGE_OWNER_SUB_ORG_ID']
 
+#If "true", new packages are created along with their resources in a single
+#request to BCDC.  If BCDC rejects inline resources the resources are created
+#with separate requests instead.
+if not "BCDC_INLINE_RESOURCES" in os.environ:
+  BCDC_INLINE_RESOURCES = True
+else:
+  BCDC_INLINE_RESOURCES = os.environ['BCDC_INLINE_RESOURCES'].lower() in ["true", "1", "yes"]
+
+#If "true", a registration whose title gives a package name which is already 
+#taken gets a unique name (with a suffix: name-2, name-3, ...) rather than being
+#rejected
+if not "BCDC_AUTO_UNIQUE_NAME" in os.environ:
+  BCDC_AUTO_UNIQUE_NAME = False
+else:
+  BCDC_AUTO_UNIQUE_NAME = os.environ['BCDC_AUTO_UNIQUE_NAME'].lower() in ["true", "1", "yes"]
+
+#The maximum number of connections to BCDC kept open by each worker process
+BCDC_POOL_SIZE = number_setting("BCDC_POOL_SIZE", int, 10)
+
+#How long (in seconds) to wait for a connection to BCDC to be established
+BCDC_CONNECT_TIMEOUT = number_setting("BCDC_CONNECT_TIMEOUT", float, 5.0)
+
+#How long (in seconds) to wait for BCDC to send data before giving up on a request
+BCDC_READ_TIMEOUT = number_setting("BCDC_READ_TIMEOUT", float, 30.0)
+
+#How many times a failed read-only request to BCDC is retried
+BCDC_RETRIES = number_setting("BCDC_RETRIES", int, 2)
+
+#The backoff factor (in seconds) between retries of requests to BCDC.  The nth
+#retry waits BCDC_RETRY_BACKOFF * 2^(n-1) seconds.
+BCDC_RETRY_BACKOFF = number_setting("BCDC_RETRY_BACKOFF", float, 0.5)
+
+#
+# BC Data Catalog circuit breakers and bulkhead
+#
+
+#Number of recent requests (per BCDC action) whose outcomes each circuit
+#breaker considers.  0 disables the circuit breakers.
+BCDC_BREAKER_WINDOW = number_setting("BCDC_BREAKER_WINDOW", int, 20)
+
+#Minimum number of recent requests before a circuit breaker may open
+BCDC_BREAKER_MIN_CALLS = number_setting("BCDC_BREAKER_MIN_CALLS", int, 10)
+
+#A circuit breaker opens when this proportion of recent requests failed (no 
+#response, or HTTP 5xx)
+BCDC_BREAKER_FAILURE_RATE = number_setting("BCDC_BREAKER_FAILURE_RATE", float, 0.5)
+
+#Requests which take at least this many seconds are slow
+BCDC_BREAKER_SLOW_CALL_DURATION = number_setting("BCDC_BREAKER_SLOW_CALL_DURATION", float, 10.0)
+
+#A circuit breaker opens when this proportion of recent requests were slow
+BCDC_BREAKER_SLOW_CALL_RATE = number_setting("BCDC_BREAKER_SLOW_CALL_RATE", float, 0.8)
+
+#Seconds an open circuit breaker waits before letting a trial request through
+BCDC_BREAKER_OPEN_DURATION = number_setting("BCDC_BREAKER_OPEN_DURATION", int, 30)
+
+#Maximum number of requests to BCDC each worker process has in progress at 
+#once (0 means no limit)
+BCDC_MAX_CONCURRENT_REQUESTS = number_setting("BCDC_MAX_CONCURRENT_REQUESTS", int, 20)
+
+#Seconds a request to BCDC waits for one of the BCDC_MAX_CONCURRENT_REQUESTS
+#slots before failing
+BCDC_BULKHEAD_MAX_WAIT = number_setting("BCDC_BULKHEAD_MAX_WAIT", float, 2.0)
+
+#
+# URL probes
+#
+
+#Seconds to wait for a connection to an API (or its OpenAPI specification) 
+#when probing its content type
+PROBE_CONNECT_TIMEOUT = number_setting("PROBE_CONNECT_TIMEOUT", float, 3.0)
+
+#Seconds to wait for a response from an API when probing its content type
+PROBE_READ_TIMEOUT = number_setting("PROBE_READ_TIMEOUT", float, 5.0)
+
+#The maximum number of bytes of a response read when probing a URL's content type
+PROBE_MAX_BYTES = number_setting("PROBE_MAX_BYTES", int, 1024)
+
+#How long (in seconds) the content type of a URL is cached
+PROBE_CACHE_TTL = number_setting("PROBE_CACHE_TTL", int, 3600)
+
+#How long (in seconds) a failure to probe a URL is cached
+PROBE_FAILURE_TTL = number_setting("PROBE_FAILURE_TTL", int, 300)
+
+#The maximum number of URLs each worker process probes at the same time
+PROBE_CONCURRENCY = number_setting("PROBE_CONCURRENCY", int, 8)
+
+#How long (in seconds) an organization fetched from BCDC is cached before it is
+#considered stale
+ORG_CACHE_TTL = number_setting("ORG_CACHE_TTL", int, 3600)
+
+#How long (in seconds) an unknown organization id (HTTP 404 from BCDC) is cached
+ORG_CACHE_NEGATIVE_TTL = number_setting("ORG_CACHE_NEGATIVE_TTL", int, 60)
+
+#How long (in seconds) after becoming stale a cached organization may still be
+#used while it is refreshed in the background
+ORG_CACHE_STALE_TTL = number_setting("ORG_CACHE_STALE_TTL", int, 86400)
+
+#The maximum number of organizations to cache.  Set to 0 to disable caching.
+ORG_CACHE_MAX_SIZE = number_setting("ORG_CACHE_MAX_SIZE", int, 1000)
+
+#How often (in seconds) the in-memory index of all BCDC organizations is 
+#reloaded.  Set to 0 to disable the index (organizations will then be fetched
+#one at a time as needed).
+ORG_INDEX_REFRESH_INTERVAL = number_setting("ORG_INDEX_REFRESH_INTERVAL", int, 900)
+
+#The number of organizations to request per call when loading the organization 
+#index
+ORG_INDEX_PAGE_SIZE = number_setting("ORG_INDEX_PAGE_SIZE", int, 25)
+
+#The maximum number of organizations to fetch from BCDC concurrently 
+ORG_LOOKUP_CONCURRENCY = number_setting("ORG_LOOKUP_CONCURRENCY", int, 6)
+
+#How often (in seconds) the in-memory index of the names of all BCDC packages 
+#is reloaded.  Set to 0 to only index the names of packages created by each 
+#worker process.
+PACKAGE_NAME_INDEX_REFRESH_INTERVAL = number_setting("PACKAGE_NAME_INDEX_REFRESH_INTERVAL", int, 900)
+
+#The number of package names to request per call when loading the index
+PACKAGE_NAME_INDEX_PAGE_SIZE = number_setting("PACKAGE_NAME_INDEX_PAGE_SIZE", int, 1000)
+
+#
+# Registration jobs
+#
+
+#If "true", POST /register responds as soon as the request is validated, and the
+#registration is completed in the background.  Clients may also request this per
+#request with a "Prefer: respond-async" header.
+if not "REGISTER_ASYNC" in os.environ:
+  REGISTER_ASYNC = False
+else:
+  REGISTER_ASYNC = os.environ['REGISTER_ASYNC'].lower() in ["true", "1", "yes"]
+
+#Where background registration jobs are kept: "memory" (visible only to the 
+#worker process that created them) or "sqlite" (shared by all worker processes
+#and preserved across restarts)
+if not "JOB_STORE" in os.environ:
+  JOB_STORE = "memory"
+else:
+  JOB_STORE = os.environ['JOB_STORE']
+
+#The database file used when JOB_STORE is "sqlite"
+if not "JOB_STORE_PATH" in os.environ:
+  JOB_STORE_PATH = "/tmp/argg-jobs.sqlite3"
+else:
+  JOB_STORE_PATH = os.environ['JOB_STORE_PATH']
+
+#The number of registration jobs each worker process runs at the same time
+JOB_WORKERS = number_setting("JOB_WORKERS", int, 4)
+
+#How long (in seconds) finished jobs are kept
+JOB_RETENTION = number_setting("JOB_RETENTION", int, 86400)
+
+#
+# Metrics
+#
+
+#A directory in which each worker process writes its metrics, so that /metrics
+#can report the totals of all worker processes.  The directory should be local
+#to the host (or pod).  An empty value reports only the metrics of the worker 
+#process which handles the request to /metrics.
+if not "METRICS_DIR" in os.environ:
+  METRICS_DIR = "/tmp/argg-metrics"
+else:
+  METRICS_DIR = os.environ['METRICS_DIR']
+
+#How often (in seconds) each worker process writes its metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = number_setting("METRICS_FLUSH_INTERVAL", float, 5)
+
+#
+# Admission control
+#
+
+#Number of registrations per minute each submitter (by business email) may 
+#make, once they have used up RATE_LIMIT_SUBMITTER_BURST.  0 disables the limit.
+RATE_LIMIT_SUBMITTER_RATE = number_setting("RATE_LIMIT_SUBMITTER_RATE", float, 6)
+
+#Number of registrations each submitter may make at once
+RATE_LIMIT_SUBMITTER_BURST = number_setting("RATE_LIMIT_SUBMITTER_BURST", int, 5)
+
+#Number of registrations per minute each client IP address may make, once it 
+#has used up RATE_LIMIT_IP_BURST.  0 disables the limit.
+RATE_LIMIT_IP_RATE = number_setting("RATE_LIMIT_IP_RATE", float, 30)
+
+#Number of registrations each client IP address may make at once
+RATE_LIMIT_IP_BURST = number_setting("RATE_LIMIT_IP_BURST", int, 20)
+
+#If "true", the client IP address is taken from the X-Forwarded-For header (set
+#by the router in front of the application) rather than the connection
+if not "RATE_LIMIT_TRUST_FORWARDED_FOR" in os.environ:
+  RATE_LIMIT_TRUST_FORWARDED_FOR = False
+else:
+  RATE_LIMIT_TRUST_FORWARDED_FOR = os.environ['RATE_LIMIT_TRUST_FORWARDED_FOR'].lower() in ["true", "1", "yes"]
+
+#Where rate limits are kept: "memory" (per worker process) or "sqlite" (shared
+#by all worker processes)
+if not "RATE_LIMIT_STORE" in os.environ:
+  RATE_LIMIT_STORE = "sqlite"
+else:
+  RATE_LIMIT_STORE = os.environ['RATE_LIMIT_STORE']
+
+#The database file used when RATE_LIMIT_STORE is "sqlite"
+if not "RATE_LIMIT_STORE_PATH" in os.environ:
+  RATE_LIMIT_STORE_PATH = "/tmp/argg-rate-limits.sqlite3"
+else:
+  RATE_LIMIT_STORE_PATH = os.environ['RATE_LIMIT_STORE_PATH']
+
+#Maximum number of registrations each worker process handles at once (0 means
+#no limit)
+REGISTER_MAX_CONCURRENT = number_setting("REGISTER_MAX_CONCURRENT", int, 10)
+
+#Maximum number of registrations each worker process keeps waiting for one of
+#the REGISTER_MAX_CONCURRENT slots.  More are rejected immediately.
+REGISTER_MAX_WAITING = number_setting("REGISTER_MAX_WAITING", int, 20)
+
+#Seconds a registration waits for a slot before it is rejected
+REGISTER_MAX_WAIT = number_setting("REGISTER_MAX_WAIT", float, 2.0)
+
+#
+# Idempotent registrations
+#
+
+#How long (in seconds) the response to a registration is kept, so that retries
+#of the registration (with the same Idempotency-Key header, or without one, the
+#same body) get the same response rather than registering the API again.  0 
+#disables this.
+IDEMPOTENCY_TTL = number_setting("IDEMPOTENCY_TTL", int, 86400)
+
+#Where responses are kept: "memory" (recognizing retries handled by the same 
+#worker process) or "sqlite" (recognizing retries handled by any worker process)
+if not "IDEMPOTENCY_STORE" in os.environ:
+  IDEMPOTENCY_STORE = "sqlite"
+else:
+  IDEMPOTENCY_STORE = os.environ['IDEMPOTENCY_STORE']
+
+#The database file used when IDEMPOTENCY_STORE is "sqlite"
+if not "IDEMPOTENCY_STORE_PATH" in os.environ:
+  IDEMPOTENCY_STORE_PATH = "/tmp/argg-idempotency.sqlite3"
+else:
+  IDEMPOTENCY_STORE_PATH = os.environ['IDEMPOTENCY_STORE_PATH']
+
+#How long (in seconds) a retry waits for the original registration to finish
+IDEMPOTENCY_WAIT_TIMEOUT = number_setting("IDEMPOTENCY_WAIT_TIMEOUT", int, 60)
+
+#
+# Batch registrations
+#
+
+#The number of registrations from batches that each worker process completes 
+#at the same time
+BATCH_CONCURRENCY = number_setting("BATCH_CONCURRENCY", int, 4)
+
+#The maximum number of registrations in one batch
+BATCH_MAX_SIZE = number_setting("BATCH_MAX_SIZE", int, 500)
+
 #
 # Notification Emails
 #
 
 #The SMTP server to use for sending notification emails when new APIs are registered
 if not "SMTP_SERVER" in os.environ:
-  raise ValueError("Missing 'SMTP_SERVER' environment variable.  Must specify which server to use for sending emails.")
+  CONFIG_ERRORS.append("Missing 'SMTP_SERVER' environment variable.  Must specify which server to use for sending emails.")
+  SMTP_SERVER = None
 else:
   SMTP_SERVER = os.environ['SMTP_SERVER']
 
 #The port used to access the SMTP server
 if not "SMTP_PORT" in os.environ:
-  raise ValueError("Missing 'SMTP_PORT' environment variable.  Must specify the port to send emails through the SMTP server.")
+  CONFIG_ERRORS.append("Missing 'SMTP_PORT' environment variable.  Must specify the port to send emails through the SMTP server.")
+  SMTP_PORT = None
 else:
   SMTP_PORT = os.environ['SMTP_PORT']
 
 #The email address from which all notification emails will be sent
 if not "FROM_EMAIL_ADDRESS" in os.environ:
-  raise ValueError("Missing 'FROM_EMAIL_ADDRESS' environment variable.")
+  CONFIG_ERRORS.append("Missing 'FROM_EMAIL_ADDRESS' environment variable.")
+  FROM_EMAIL_ADDRESS = None
 else:
   FROM_EMAIL_ADDRESS = os.environ['FROM_EMAIL_ADDRESS']
 
 #The password for the account from which all notification emails will be sent
 if not "FROM_EMAIL_PASSWORD" in os.environ:
-  raise ValueError("Missing 'FROM_EMAIL_PASSWORD' environment variable.")
+  CONFIG_ERRORS.append("Missing 'FROM_EMAIL_PASSWORD' environment variable.")
+  FROM_EMAIL_PASSWORD = None
 else:
   FROM_EMAIL_PASSWORD = os.environ['FROM_EMAIL_PASSWORD']
 
 #A comma-separated list of email addresses which will receive notifications about newly 
 #registered APIs
 if not "TARGET_EMAIL_ADDRESSES" in os.environ:
-  raise ValueError("Missing 'TARGET_EMAIL_ADDRESSES' environment variable. Must specify a csv list of email addresses.")
+  CONFIG_ERRORS.append("Missing 'TARGET_EMAIL_ADDRESSES' environment variable. Must specify a csv list of email addresses.")
+  TARGET_EMAIL_ADDRESSES = None
 else:
-  TARGET_EMAIL_ADDRESSES = os.environ['TARGET_EMAIL_ADDRESSES']
\ No newline at end of file
+  TARGET_EMAIL_ADDRESSES = os.environ['TARGET_EMAIL_ADDRESSES']
+
+#If "true", the stylesheet of notification emails is pruned to the rules the
+#email uses and inlined as style attributes.  Otherwise the whole stylesheet
+#is included in each email.
+if not "EMAIL_INLINE_CSS" in os.environ:
+  EMAIL_INLINE_CSS = True
+else:
+  EMAIL_INLINE_CSS = os.environ['EMAIL_INLINE_CSS'].lower() in ["true", "1", "yes"]
+
+#The SQLite file in which notification emails are queued until they are sent.
+#Set to an empty string to send notification emails immediately instead.
+if not "EMAIL_OUTBOX_PATH" in os.environ:
+  EMAIL_OUTBOX_PATH = "/tmp/argg-outbox.sqlite3"
+else:
+  EMAIL_OUTBOX_PATH = os.environ['EMAIL_OUTBOX_PATH']
+
+#The maximum number of seconds between checks of the outbox for emails to send
+EMAIL_OUTBOX_POLL_INTERVAL = number_setting("EMAIL_OUTBOX_POLL_INTERVAL", float, 5)
+
+#The number of attempts to send an email before giving up on it
+EMAIL_MAX_ATTEMPTS = number_setting("EMAIL_MAX_ATTEMPTS", int, 8)
+
+#How long (in seconds) to wait before retrying an email the first time.  The wait 
+#doubles after each failed attempt.
+EMAIL_RETRY_BACKOFF = number_setting("EMAIL_RETRY_BACKOFF", float, 30)
@@ -0,0 +1,64 @@
+"""
+Purpose: Helpers for the SQLite databases used to share state between worker
+processes on a host (such as the job store and the email outbox).
+"""
+import os
+import socket
+import sqlite3
+
+def connect(path):
+  """
+  Opens a connection to a SQLite database for a single operation.  Use as a 
+  context manager: the transaction is committed on success (or rolled back on
+  error) and the connection is closed.
+    with connect(path) as conn:
+      conn.execute(...)
+  """
+  return _ClosingConnection(sqlite3.connect(path, timeout=10))
+
+def enable_wal(path):
+  """
+  Switches a database to write-ahead logging so that readers don't block writers
+  """
+  with connect(path) as conn:
+    conn.execute("PRAGMA journal_mode=WAL")
+
+class _ClosingConnection(object):
+  """
+  Like a sqlite3 connection used as a context manager, but also closes the 
+  connection
+  """
+
+  def __init__(self, conn):
+    self.conn = conn
+
+  def __enter__(self):
+    return self.conn
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    try:
+      self.conn.__exit__(exc_type, exc_value, traceback)
+    finally:
+      self.conn.close()
+
+def process_owner():
+  """
+  Identifies this process (as "hostname:pid") when it claims a row
+  """
+  return "{}:{}".format(socket.gethostname(), os.getpid())
+
+def owner_is_alive(owner):
+  """
+  True unless the given owner (see process_owner) is a process on this host 
+  which no longer exists
+  """
+  hostname, _, pid = (owner or "").rpartition(":")
+  if hostname != socket.gethostname() or not pid.isdigit():
+    return True
+  try:
+    os.kill(int(pid), 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
@@ -0,0 +1,130 @@
+"""
+Purpose: Time the phases of each request (validation, each request to BCDC,
+URL probes, rendering and sending the notification email), so that a slow
+request can be explained.  The phases are reported in the response's
+Server-Timing header and in one log line per request (see main.py).
+
+The trace of a request is kept in a thread local, which under gunicorn's gevent
+worker is local to the request's greenlet.  Work which concurrency.WorkerPool
+runs for the request (such as looking up organizations) is timed in the same
+trace.  Code which runs without a trace (background jobs, the ASGI app) isn't
+timed, and span() costs next to nothing there.
+"""
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+#Request ids given by clients (in an X-Request-ID header) are used if they look
+#like ids.  Otherwise a new one is generated.
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+_local = threading.local()
+
+class Trace(object):
+  """
+  The phases of one request
+  """
+
+  def __init__(self, request_id):
+    self.request_id = request_id
+    self.start = time.monotonic()
+    self._spans = [] #(name, seconds).  list.append is thread safe.
+
+  def add(self, name, seconds):
+    self._spans.append((name, seconds))
+
+  def phases(self):
+    """
+    :return: a list of (name, total seconds, count) tuples, one per phase name,
+      in the order the phases first finished.  Phases which ran concurrently
+      (e.g. organization lookups) are added up.
+    """
+    totals = {}
+    names = []
+    for name, seconds in list(self._spans):
+      if name not in totals:
+        totals[name] = [0.0, 0]
+        names.append(name)
+      totals[name][0] += seconds
+      totals[name][1] += 1
+    return [(name, totals[name][0], totals[name][1]) for name in names]
+
+  def elapsed(self):
+    return time.monotonic() - self.start
+
+def start(request_id=None):
+  """
+  Starts the trace of a request handled by the current thread (or greenlet)
+  :param request_id: the id given by the client, if any
+  :return: the new Trace
+  """
+  if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+    request_id = uuid.uuid4().hex
+  _local.trace = Trace(request_id)
+  return _local.trace
+
+def finish():
+  """
+  Ends the trace of the current request
+  :return: the Trace, or None if there wasn't one
+  """
+  trace = current()
+  _local.trace = None
+  return trace
+
+def current():
+  """
+  :return: the Trace of the current request, or None
+  """
+  return getattr(_local, "trace", None)
+
+@contextmanager
+def span(name):
+  """
+  Times the body of the 'with' statement (even if it raises) as a phase of the
+  current request
+  """
+  trace = current()
+  if trace is None:
+    yield
+    return
+  start = time.monotonic()
+  try:
+    yield
+  finally:
+    trace.add(name, time.monotonic() - start)
+
+def bind(func):
+  """
+  :return: a function which calls func in the current request's trace, for
+    running in another thread or greenlet
+  """
+  trace = current()
+  if trace is None:
+    return func
+  def bound():
+    previous = current()
+    _local.trace = trace
+    try:
+      return func()
+    finally:
+      _local.trace = previous
+  return bound
+
+def server_timing(trace):
+  """
+  :return: the value of a Server-Timing header describing a trace's phases
+    (in milliseconds), followed by the total
+  """
+  metrics = ["{};dur={:.1f}".format(name, seconds * 1000) for name, seconds, _ in trace.phases()]
+  metrics.append("total;dur={:.1f}".format(trace.elapsed() * 1000))
+  return ", ".join(metrics)
+
+def summary(trace):
+  """
+  :return: a dictionary (for a structured log line) of the total milliseconds
+    and count of each of a trace's phases
+  """
+  return dict((name, {"ms": round(seconds * 1000, 1), "count": count}) for name, seconds, count in trace.phases())
@@ -0,0 +1,198 @@
+"""
+Purpose: Compare the two ways of serving registrations: the WSGI app under
+gevent (as in the Dockerfile) and the ASGI app (argg_api.asgi) under asyncio.
+For each number of concurrent registrations, a fresh process sends that many
+registrations at once to the app (called directly, without an HTTP server) and
+reports (after a first round to warm up caches and connection pools):
+- the wall time to complete them all, and the resulting throughput
+- the CPU time used per registration
+- the memory used per registration in progress: the peak of the Python heap
+  (tracemalloc) and the growth of the process's peak RSS, divided by the
+  number of registrations
+
+The fake catalogue (tests/fakes/ckan.py) runs in this process with a fixed
+latency, so every registration spends most of its time waiting for it, as it
+would with BCDC.  Notification emails are queued in an outbox file, as in
+production.  Admission control is off, and the BCDC bulkhead allows 50 requests at
+once (in both modes) and never rejects any: this measures the serving model
+rather than the limits.
+
+Usage:
+  python benchmarks/bench_asgi.py [--concurrency 50,200,500] [--catalogue-latency 0.2]
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+def registration(org_id, sub_org_id, api_base_url, index):
+  from tests.conftest import REGISTRATION
+  req_data = copy.deepcopy(REGISTRATION)
+  req_data["metadata_details"]["title"] = "benchmark api {} {}".format(os.getpid(), index)
+  for person in [req_data["metadata_details"]["owner"], req_data["submitted_by_person"]]:
+    person["org_id"] = org_id
+    person["sub_org_id"] = sub_org_id
+  req_data["existing_api"]["base_url"] = api_base_url
+  return req_data
+
+#------------------------------------------------------------------------------
+# Worker processes (one per mode and concurrency)
+#------------------------------------------------------------------------------
+
+def run_gevent(n, make_registration):
+  from argg_api.main import app
+  import gevent
+
+  def post(i):
+    start = time.perf_counter()
+    r = app.test_client().post("/register", json=make_registration(i))
+    return r.status_code, time.perf_counter() - start
+
+  def post_all(first):
+    return [g.value for g in gevent.joinall([gevent.spawn(post, i) for i in range(first, first + n)])]
+
+  post_all(n) #warm up (e.g. fill the connection pool)
+  return measure(lambda: post_all(0))
+
+def run_asgi(n, make_registration):
+  import asyncio
+  from argg_api.asgi import app
+
+  async def post(i):
+    body = json.dumps(make_registration(i)).encode("utf-8")
+    scope = {"type": "http", "method": "POST", "path": "/register", "scheme": "http", "root_path": "",
+      "headers": [(b"content-type", b"application/json")], "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80)}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    async def receive():
+      return messages.pop(0)
+    status = {}
+    async def send(message):
+      if message["type"] == "http.response.start":
+        status["code"] = message["status"]
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return status["code"], time.perf_counter() - start
+
+  async def post_all(first):
+    return await asyncio.gather(*[post(i) for i in range(first, first + n)])
+
+  loop = asyncio.get_event_loop()
+  loop.run_until_complete(post_all(n)) #warm up (e.g. fill the connection pool)
+  return measure(lambda: loop.run_until_complete(post_all(0)))
+
+def measure(run):
+  """
+  :param run: a function which sends the registrations and returns a list of
+    (status code, latency) tuples
+  """
+  import resource
+  import tracemalloc
+  rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  tracemalloc.start()
+  heap_before = tracemalloc.get_traced_memory()[0]
+  start = time.perf_counter()
+  cpu_start = time.process_time()
+  results = run()
+  wall = time.perf_counter() - start
+  cpu = time.process_time() - cpu_start
+  heap_peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  latencies = sorted(latency for status, latency in results)
+  statuses = {}
+  for status, latency in results:
+    statuses[status] = statuses.get(status, 0) + 1
+  return {
+    "wall": wall,
+    "cpu": cpu,
+    "p50": latencies[len(latencies) // 2],
+    "max": latencies[-1],
+    "statuses": statuses,
+    "heap": heap_peak - heap_before,
+    #ru_maxrss is in KiB on Linux
+    "rss": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) * 1024
+  }
+
+def worker(mode, n):
+  if mode == "gevent":
+    from gevent import monkey
+    monkey.patch_all()
+  from tests.fakes.ckan import DEFAULT_ORGANIZATIONS
+  org_id, sub_org_id = DEFAULT_ORGANIZATIONS[0]["id"], DEFAULT_ORGANIZATIONS[1]["id"]
+  api_base_url = os.environ["BCDC_BASE_URL"] + "/api/3"
+  make_registration = lambda i: registration(org_id, sub_org_id, api_base_url, i)
+  result = (run_gevent if mode == "gevent" else run_asgi)(n, make_registration)
+  print(json.dumps(result))
+
+#------------------------------------------------------------------------------
+# Main process
+#------------------------------------------------------------------------------
+
+def start_fakes(catalogue_latency):
+  from tests.fakes.ckan import FakeCkan, DEFAULT_ORGANIZATIONS
+  from tests.fakes.smtp import FakeSmtp
+  catalogue = FakeCkan(latency=catalogue_latency).start()
+  smtp = FakeSmtp(max_messages=10).start()
+  return {
+    "BCDC_BASE_URL": catalogue.base_url,
+    "BCDC_API_PATH": "/api/3",
+    "BCDC_API_KEY": "benchmark",
+    "BCDC_GROUP_ID": "benchmark",
+    "BCDC_PACKAGE_OWNER_ORG_ID": DEFAULT_ORGANIZATIONS[0]["id"],
+    "BCDC_PACKAGE_OWNER_SUB_ORG_ID": DEFAULT_ORGANIZATIONS[1]["id"],
+    "SMTP_SERVER": smtp.host,
+    "SMTP_PORT": "{}".format(smtp.port),
+    "FROM_EMAIL_ADDRESS": "benchmark@example.com",
+    "FROM_EMAIL_PASSWORD": "",
+    "TARGET_EMAIL_ADDRESSES": "benchmark@example.com",
+    "METRICS_DIR": "",
+    "LOG_LEVEL": "ERROR",
+    "JOB_STORE": "memory",
+    "IDEMPOTENCY_STORE": "memory",
+    "RATE_LIMIT_STORE": "memory",
+    "RATE_LIMIT_SUBMITTER_RATE": "0",
+    "RATE_LIMIT_IP_RATE": "0",
+    "REGISTER_MAX_CONCURRENT": "0",
+    #at most 50 requests to the catalogue at once (in either mode), and the
+    #rest wait for as long as it takes
+    "BCDC_MAX_CONCURRENT_REQUESTS": "50",
+    "BCDC_POOL_SIZE": "50",
+    "BCDC_BULKHEAD_MAX_WAIT": "600",
+    #organizations are looked up (concurrently, by the ASGI app) rather than indexed
+    "ORG_INDEX_REFRESH_INTERVAL": "0"
+  }
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares serving registrations with gevent (WSGI) and asyncio (ASGI)")
+  parser.add_argument("--concurrency", default="50,200,500", help="comma separated numbers of concurrent registrations")
+  parser.add_argument("--catalogue-latency", type=float, default=0.2, help="seconds added to each catalogue response")
+  parser.add_argument("--worker", nargs=2, metavar=("MODE", "N"), help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.worker:
+    worker(args.worker[0], int(args.worker[1]))
+    return
+
+  env = dict(os.environ, **start_fakes(args.catalogue_latency))
+  outbox_dir = tempfile.mkdtemp()
+  print("{:<7} {:>6} {:>8} {:>8} {:>8} {:>8} {:>10} {:>12} {:>12}  {}".format(
+    "mode", "n", "wall(s)", "req/s", "p50(s)", "max(s)", "cpu/req", "heap/req", "rss/req", "statuses"))
+  for n in [int(n) for n in args.concurrency.split(",")]:
+    for mode in ["gevent", "asgi"]:
+      worker_env = dict(env, **{
+        "EMAIL_OUTBOX_PATH": os.path.join(outbox_dir, "{}-{}.db".format(mode, n))
+      })
+      output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--worker", mode, "{}".format(n)], env=worker_env, cwd=ROOT)
+      result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+      print("{:<7} {:>6} {:>8.2f} {:>8.1f} {:>8.2f} {:>8.2f} {:>8.1f}ms {:>10.1f}KB {:>10.1f}KB  {}".format(
+        mode, n, result["wall"], n / result["wall"], result["p50"], result["max"], result["cpu"] / n * 1000,
+        result["heap"] / n / 1024.0, result["rss"] / n / 1024.0, result["statuses"]))
+
+if __name__ == "__main__":
+  main()
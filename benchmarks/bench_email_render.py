@@ -0,0 +1,85 @@
+"""
+Purpose: Measure the time and memory allocated to render the notification email.
+"before" emulates the original prepare_email_body, which read the stylesheet from 
+disk and compiled a new jinja2.Template for every email.  "after" renders the 
+templates precompiled by argg_api.email_templates.
+
+Exits with status 1 if the rendered notification is larger than
+email_templates.NOTIFICATION_SIZE_BUDGET (which tests/test_email_templates.py
+also checks).
+
+Usage:
+  python benchmarks/bench_email_render.py [iterations]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+for name in ["BCDC_BASE_URL", "BCDC_API_PATH", "BCDC_API_KEY", "BCDC_GROUP_ID", "BCDC_PACKAGE_OWNER_ORG_ID", 
+    "BCDC_PACKAGE_OWNER_SUB_ORG_ID", "SMTP_SERVER", "SMTP_PORT", "FROM_EMAIL_ADDRESS", "FROM_EMAIL_PASSWORD", 
+    "TARGET_EMAIL_ADDRESSES"]:
+  os.environ.setdefault(name, "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from jinja2 import Template
+from argg_api import email_templates
+
+SIZE_BUDGET = email_templates.NOTIFICATION_SIZE_BUDGET
+
+REQ_DATA = {
+  "submitted_by_person": {"name": "Submitter", "business_email": "s@example.com", "business_phone": "250-555-0100", "role": "Developer"},
+  "metadata_details": {
+    "title": "Benchmark API", "description": "An API used to benchmark notification emails",
+    "owner": {"org_id": "org", "contact_person": {"name": "Contact", "business_email": "c@example.com", "business_phone": "250-555-0101", "role": "pointOfContact"}}
+  },
+  "existing_api": {"base_url": "https://example.com/api", "openapi_spec_url": "https://example.com/api/spec", "supports": {"cors": True}},
+  "gateway": {"use_gateway": True, "use_throttling": False, "restrict_access": True},
+  "validated": {"owner_org_name": "Ministry", "owner_sub_org_name": "Branch", "owner_contact_org_name": "Ministry", 
+    "submitted_by_person_org_name": "Ministry"}
+}
+PARAMS = {"req_data": REQ_DATA, "metadata": {"web_url": "https://catalogue.example.com/dataset/benchmark-api"}}
+
+with open(os.path.join(email_templates.TEMPLATES_DIR, "notification.html")) as f:
+  LEGACY_SOURCE = f.read()
+
+def render_before():
+  with open(email_templates.CSS_FILENAME, 'r') as css_file:
+    css = css_file.read()
+  return Template(LEGACY_SOURCE.replace("{{ css }}", css)).render(PARAMS)
+
+def render_after():
+  return email_templates.render("notification.html", **PARAMS)
+
+def measure(render, iterations):
+  render() #warm up
+  start = time.perf_counter()
+  for i in range(iterations):
+    render()
+  elapsed = (time.perf_counter() - start) / iterations
+
+  tracemalloc.start()
+  snapshot_before = tracemalloc.take_snapshot()
+  render()
+  snapshot_after = tracemalloc.take_snapshot()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  allocated = sum(stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename") if stat.size_diff > 0)
+  return elapsed, peak, allocated, len(render())
+
+def main():
+  print("{:<8} {:>14} {:>16} {:>18} {:>14}".format("", "ms per render", "peak KB", "KB retained", "output KB"))
+  for label, render, iterations in [("before", render_before, max(1, ITERATIONS // 10)), ("after", render_after, ITERATIONS)]:
+    elapsed, peak, allocated, size = measure(render, iterations)
+    print("{:<8} {:>14.3f} {:>16.1f} {:>18.1f} {:>14.1f}".format(label, elapsed * 1000, peak / 1024.0, allocated / 1024.0, size / 1024.0))
+
+  size = len(render_after().encode("utf-8"))
+  if size > SIZE_BUDGET:
+    print("FAIL: the notification is {} bytes, which exceeds the budget of {} bytes".format(size, SIZE_BUDGET))
+    sys.exit(1)
+  print("OK: the notification is {} bytes (budget: {} bytes)".format(size, SIZE_BUDGET))
+
+if __name__ == "__main__":
+  main()
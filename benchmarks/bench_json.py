@@ -0,0 +1,115 @@
+"""
+Purpose: Measure the time taken to encode and decode the JSON exchanged with
+BCDC, with each backend of argg_api.jsoncodec.  The payloads are shaped like
+real CKAN responses: organization_show (an organization with its extras and
+users) and package_create (a new package with its resources, echoed back).
+"before" is the original path: the body is converted to a str (as
+requests' Response.text does) and then decoded with the standard library.
+
+Usage:
+  python benchmarks/bench_json.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+for name in ["BCDC_BASE_URL", "BCDC_API_PATH", "BCDC_API_KEY", "BCDC_GROUP_ID", "BCDC_PACKAGE_OWNER_ORG_ID",
+    "BCDC_PACKAGE_OWNER_SUB_ORG_ID", "SMTP_SERVER", "SMTP_PORT", "FROM_EMAIL_ADDRESS", "FROM_EMAIL_PASSWORD",
+    "TARGET_EMAIL_ADDRESSES"]:
+  os.environ.setdefault(name, "benchmark")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from argg_api import jsoncodec
+
+def organization():
+  return {
+    "id": "d5316a1b-2646-4c19-9671-c12231c4ec8b",
+    "name": "ministry-of-jobs-tourism-and-skills-training",
+    "title": "Ministry of Jobs, Tourism and Skills Training",
+    "type": "organization",
+    "description": "The Ministry of Jobs, Tourism and Skills Training supports economic growth in British Columbia. " * 3,
+    "image_url": "https://www2.gov.bc.ca/assets/gov/british-columbians-our-governments/organizational-structure/logo.png",
+    "created": "2014-06-12T14:35:05.173838",
+    "is_organization": True,
+    "approval_status": "approved",
+    "state": "active",
+    "package_count": 412,
+    "num_followers": 3,
+    "display_name": "Ministry of Jobs, Tourism and Skills Training",
+    "revision_id": "0f1a9a0e-3b14-4dc7-9a36-5a2b9d1e0c11",
+    "extras": [{"key": "url", "value": "https://www.gov.bc.ca/jtst", "state": "active"}, {"key": "org_type", "value": "Ministry", "state": "active"}],
+    "groups": [{"name": "government-of-british-columbia", "capacity": "public"}],
+    "tags": [],
+    "users": [
+      {"id": "user-{}".format(i), "name": "idir-user-{}".format(i), "display_name": "IDIR User {}".format(i), "capacity": "editor",
+       "email_hash": "5f4dcc3b5aa765d61d8327deb882cf99", "sysadmin": False, "state": "active", "created": "2019-02-01T10:00:00"}
+      for i in range(12)]
+  }
+
+def package():
+  return {
+    "id": "9678ca27cc5a4ec8ac3926ba3125c3e5",
+    "name": "example-api",
+    "title": "Example API",
+    "notes": "An API which provides access to example data for the province of British Columbia. " * 4,
+    "owner_org": "c1222ef5-5013-4d9a-a9a0-373c54241e77",
+    "org": "d5316a1b-2646-4c19-9671-c12231c4ec8b",
+    "sub_org": "c1222ef5-5013-4d9a-a9a0-373c54241e77",
+    "state": "active",
+    "type": "WebService",
+    "private": False,
+    "metadata_created": "2020-06-01T17:22:31.512311",
+    "metadata_modified": "2020-06-01T17:22:31.512311",
+    "edc_state": "DRAFT",
+    "resource_status": "completed",
+    "license_id": "2",
+    "license_title": "Open Government Licence - British Columbia",
+    "license_url": "https://www2.gov.bc.ca/gov/content/data/open-data/open-government-licence-bc",
+    "security_class": "LOW-PUBLIC",
+    "view_audience": "Public",
+    "download_audience": "Public",
+    "metadata_visibility": "Public",
+    "sector": "Service",
+    "tags": [{"name": "API", "id": "a4a3f3c4-0f0e-4c39-9c2b-5c0e1f0a7c55", "state": "active", "display_name": "API"}],
+    "groups": [{"id": "test-group", "name": "data-catalogue-apis", "title": "Data Catalogue APIs", "description": "", "image_display_url": ""}],
+    "contacts": [{"name": "Contact Person", "organization": "d5316a1b-2646-4c19-9671-c12231c4ec8b", "branch": "c1222ef5-5013-4d9a-a9a0-373c54241e77",
+      "email": "contact@example.com", "role": "pointOfContact", "private": "Display"}],
+    "resources": [
+      {"id": "10f2fe7717984608971ea9cdf43271aa", "package_id": "9678ca27cc5a4ec8ac3926ba3125c3e5", "name": "API root", "url": "https://example.gov.bc.ca/api",
+       "format": "json", "state": "active", "position": 0, "created": "2020-06-01T17:22:31.600000", "resource_type": None, "mimetype": None},
+      {"id": "21a3ef8828a95719a82fb0dee54382bb", "package_id": "9678ca27cc5a4ec8ac3926ba3125c3e5", "name": "API specification", "url": "https://example.gov.bc.ca/api/openapi.json",
+       "format": "openapi-json", "state": "active", "position": 1, "created": "2020-06-01T17:22:31.700000", "resource_type": None, "mimetype": None}
+    ],
+    "num_resources": 2,
+    "num_tags": 1
+  }
+
+def timed(func, iterations):
+  start = time.perf_counter()
+  for _ in range(iterations):
+    func()
+  return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+  payloads = [
+    ("organization_show", {"help": "https://catalogue.data.gov.bc.ca/api/3/action/help_show?name=organization_show", "success": True, "result": organization()}),
+    ("package_create", {"help": "https://catalogue.data.gov.bc.ca/api/3/action/help_show?name=package_create", "success": True, "result": package()})
+  ]
+  backends = ["json"] + (["orjson"] if jsoncodec.orjson else [])
+  print("{:<18} {:>7}  {:<8} {:>10} {:>10}".format("payload", "bytes", "backend", "decode us", "encode us"))
+  for name, payload in payloads:
+    body = json.dumps(payload).encode("utf-8")
+    before = timed(lambda: json.loads(body.decode("utf-8")), ITERATIONS)
+    print("{:<18} {:>7}  {:<8} {:>10.1f} {:>10.1f}".format(name, len(body), "before", before, timed(lambda: json.dumps(payload).encode("utf-8"), ITERATIONS)))
+    for backend in backends:
+      jsoncodec.BACKEND = backend
+      assert jsoncodec.loads(body) == payload
+      decode = timed(lambda: jsoncodec.loads(body), ITERATIONS)
+      encode = timed(lambda: jsoncodec.dumps_bytes(payload), ITERATIONS)
+      print("{:<18} {:>7}  {:<8} {:>10.1f} {:>10.1f}".format("", "", backend, decode, encode))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,140 @@
+"""
+Purpose: Compare the schema validator compiled from the OpenAPI specification
+(clean_req_data) with the hand-written checks it replaced (legacy_clean_req_data,
+below), on a valid request and on a request with several problems.  Neither
+looks organizations up, so this measures only the structural validation.
+
+The hand-written checks stop at the first problem, so for the invalid request
+the number of problems each reports is printed too.
+
+Usage:
+  python benchmarks/bench_schema_validation.py [iterations]
+"""
+import copy
+import os
+import sys
+import time
+
+ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+VALID = {
+  "submitted_by_person": {"name": "S", "org_id": "org-4", "sub_org_id": "org-5", "business_email": "s@example.com"},
+  "metadata_details": {
+    "title": "Benchmark", "description": "Benchmark",
+    "owner": {"org_id": "org-0", "sub_org_id": "org-1",
+      "contact_person": {"name": "C", "business_email": "c@example.com", "role": "pointOfContact"}},
+    "security": {"download_audience": "Public", "view_audience": "Public", "metadata_visibility": "Public", "security_class": "LOW-PUBLIC"},
+    "license": {"license_id": "2"}
+  },
+  "existing_api": {"base_url": "https://example.com", "openapi_spec_url": None, "supports": {"https": True, "cors": None}},
+  "gateway": {"use_gateway": False}
+}
+
+INVALID = copy.deepcopy(VALID)
+del INVALID["metadata_details"]["title"]
+INVALID["metadata_details"]["security"]["view_audience"] = ""
+INVALID["submitted_by_person"]["org_id"] = None
+INVALID["existing_api"]["base_url"] = None
+
+def legacy_clean_req_data(req_data):
+  """
+  The hand-written checks (and defaults) of clean_req_data before it was
+  generated from the specification
+  """
+  if not req_data:
+    req_data = {}
+  if not req_data.get("submitted_by_person"):
+    req_data["submitted_by_person"] = {}
+  if not req_data.get("metadata_details"):
+    req_data["metadata_details"] = {}
+  if not req_data["metadata_details"].get("owner"):
+    req_data["metadata_details"]["owner"] = {}
+  if not req_data["metadata_details"]["owner"].get("contact_person"):
+    req_data["metadata_details"]["owner"]["contact_person"] = {}
+  if not req_data["metadata_details"].get("security"):
+    req_data["metadata_details"]["security"] = {}
+  if not req_data["metadata_details"].get("license"):
+    req_data["metadata_details"]["license"] = {}
+  if not req_data.get("existing_api"):
+    req_data["existing_api"] = {}
+  if not req_data.get("gateway"):
+    req_data["gateway"] = {}
+
+  if not req_data["metadata_details"].get("title"):
+    raise ValueError("Missing '$.metadata_details.title'")
+  if not req_data["metadata_details"].get("description"):
+    raise ValueError("Missing '$.metadata_details.description'")
+  if not req_data["metadata_details"]["owner"].get("org_id"):
+    raise ValueError("Missing '$.metadata_details.owner.org_id'")
+  if not req_data["metadata_details"]["owner"]["contact_person"].get("name"):
+    raise ValueError("Missing '$.metadata_details.owner.contact_person.name'")
+  if not req_data["metadata_details"]["owner"]["contact_person"].get("business_email"):
+    raise ValueError("Missing '$.metadata_details.owner.contact_person.business_email'")
+  if not req_data["metadata_details"]["security"].get("download_audience"):
+    raise ValueError("Missing '$.metadata_details.security.download_audience'")
+  if not req_data["metadata_details"]["security"].get("view_audience"):
+    raise ValueError("Missing '$.metadata_details.security.view_audience'")
+  if not req_data["metadata_details"]["security"].get("metadata_visibility"):
+    raise ValueError("Missing '$.metadata_details.security.metadata_visibility'")
+  if not req_data["metadata_details"]["security"].get("security_class"):
+    raise ValueError("Missing '$.metadata_details.security.security_class'")
+  if not req_data["metadata_details"]["license"].get("license_id"):
+    raise ValueError("Missing '$.metadata_details.license.license_id'")
+  if not req_data["submitted_by_person"].get("name"):
+    raise ValueError("Missing '$.submitted_by_person.name'")
+  if not req_data["submitted_by_person"].get("org_id") and not req_data["submitted_by_person"].get("org_name"):
+    raise ValueError("Missing one of '$.submitted_by_person.org_id' or '$submitted_by_person.org_name'")
+  if not req_data["submitted_by_person"].get("business_email"):
+    raise ValueError("Missing '$.submitted_by_person.business_email'")
+  if not req_data["existing_api"].get("base_url"):
+    raise ValueError("Missing '$.existing_api.base_url'")
+
+  if not req_data["metadata_details"]["owner"]["contact_person"].get("org_id"):
+    req_data["metadata_details"]["owner"]["contact_person"]["org_id"] = req_data["metadata_details"]["owner"].get("org_id")
+  if not req_data["metadata_details"]["owner"]["contact_person"].get("sub_org_id"):
+    req_data["metadata_details"]["owner"]["contact_person"]["sub_org_id"] = req_data["metadata_details"]["owner"].get("sub_org_id")
+  return req_data
+
+def problems(validate, req_data):
+  try:
+    validate(copy.deepcopy(req_data))
+  except ValueError as e:
+    return len(getattr(e, "errors", [e]))
+  return 0
+
+def measure(validate, req_data):
+  #both validators modify the request, so each run gets its own copy (made in advance)
+  best = None
+  for i in range(3):
+    copies = [copy.deepcopy(req_data) for j in range(ITERATIONS)]
+    start = time.perf_counter()
+    for c in copies:
+      try:
+        validate(c)
+      except ValueError:
+        pass
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best / ITERATIONS * 1e6
+
+def main():
+  #importing argg_api.main needs its required settings
+  for name in ["BCDC_BASE_URL", "BCDC_API_PATH", "BCDC_API_KEY", "BCDC_GROUP_ID", "BCDC_PACKAGE_OWNER_ORG_ID",
+      "BCDC_PACKAGE_OWNER_SUB_ORG_ID", "SMTP_SERVER", "SMTP_PORT", "FROM_EMAIL_ADDRESS", "FROM_EMAIL_PASSWORD",
+      "TARGET_EMAIL_ADDRESSES"]:
+    os.environ.setdefault(name, "benchmark")
+  os.environ.update({"ORG_INDEX_REFRESH_INTERVAL": "0", "PACKAGE_NAME_INDEX_REFRESH_INTERVAL": "0", "WARM_UP": "false", "IDEMPOTENCY_STORE": "memory", "METRICS_DIR": "", "EMAIL_OUTBOX_PATH": ""})
+  sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+  from argg_api.main import clean_req_data
+
+  print("{:<10} {:>22} {:>22} {:>10}".format("request", "hand-written (us/req)", "compiled (us/req)", "problems"))
+  for name, req_data in [("valid", VALID), ("invalid", INVALID)]:
+    print("{:<10} {:>22.2f} {:>22.2f} {:>5} / {:<4}".format(
+      name,
+      measure(legacy_clean_req_data, req_data),
+      measure(clean_req_data, req_data),
+      problems(legacy_clean_req_data, req_data),
+      problems(clean_req_data, req_data)))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,87 @@
+"""
+Purpose: Measure the latency of clean_and_validate_req_data against a slow stand-in
+for the BC Data Catalog.  Each organization lookup takes LOOKUP_DELAY seconds, so
+sequential lookups take about 6 x LOOKUP_DELAY while concurrent lookups should take
+about 1 x LOOKUP_DELAY.
+
+Usage:
+  python benchmarks/bench_validation.py [lookup_delay_seconds] [iterations]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+LOOKUP_DELAY = float(sys.argv[1]) if len(sys.argv) > 1 else 0.2
+ITERATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+ORG_IDS = ["org-{}".format(i) for i in range(6)]
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+class SlowCatalogueHandler(BaseHTTPRequestHandler):
+  """
+  Responds to organization_show after a fixed delay
+  """
+  def do_GET(self):
+    time.sleep(LOOKUP_DELAY)
+    org_id = parse_qs(urlparse(self.path).query).get("id", [""])[0]
+    body = json.dumps({"success": True, "result": {"id": org_id, "name": org_id, "title": org_id.title()}}).encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+def main():
+  server = ThreadingHTTPServer(("127.0.0.1", 0), SlowCatalogueHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  #point the application at the stand-in catalogue, with the organization index
+  #and cache disabled so that every validation performs all its lookups
+  os.environ.update({
+    "BCDC_BASE_URL": "http://127.0.0.1:{}".format(server.server_port),
+    "BCDC_API_PATH": "/api/3",
+    "ORG_INDEX_REFRESH_INTERVAL": "0",
+    "ORG_CACHE_MAX_SIZE": "0"
+  })
+  for name in ["BCDC_API_KEY", "BCDC_GROUP_ID", "BCDC_PACKAGE_OWNER_ORG_ID", "BCDC_PACKAGE_OWNER_SUB_ORG_ID",
+      "SMTP_SERVER", "SMTP_PORT", "FROM_EMAIL_ADDRESS", "FROM_EMAIL_PASSWORD", "TARGET_EMAIL_ADDRESSES"]:
+    os.environ.setdefault(name, "benchmark")
+  sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+  from argg_api.main import clean_and_validate_req_data
+
+  def req_data():
+    return {
+      "submitted_by_person": {"name": "S", "org_id": ORG_IDS[4], "sub_org_id": ORG_IDS[5], "business_email": "s@example.com"},
+      "metadata_details": {
+        "title": "Benchmark", "description": "Benchmark",
+        "owner": {"org_id": ORG_IDS[0], "sub_org_id": ORG_IDS[1], 
+          "contact_person": {"name": "C", "org_id": ORG_IDS[2], "sub_org_id": ORG_IDS[3], "business_email": "c@example.com"}},
+        "security": {"download_audience": "Public", "view_audience": "Public", "metadata_visibility": "Public", "security_class": "LOW-PUBLIC"},
+        "license": {"license_id": 2}
+      },
+      "existing_api": {"base_url": "https://example.com"}
+    }
+
+  timings = []
+  for i in range(ITERATIONS):
+    start = time.perf_counter()
+    clean_and_validate_req_data(req_data())
+    timings.append(time.perf_counter() - start)
+
+  print("organization lookups per validation: {}".format(len(ORG_IDS)))
+  print("latency of a single lookup:          {:.3f}s".format(LOOKUP_DELAY))
+  print("validation latency (min/mean/max):   {:.3f}s / {:.3f}s / {:.3f}s".format(
+    min(timings), sum(timings) / len(timings), max(timings)))
+  server.shutdown()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,337 @@
+"""
+Purpose: Load test the API.  Sends a configurable mix of concurrent requests
+(valid, invalid and duplicate registrations, and GET /) and reports the
+throughput and the p50/p95/p99 latency of each kind of request.  The results
+can be saved as a baseline, and later runs fail (exit with status 1) if they
+regress from the baseline by more than a threshold.
+
+The target is any running instance of the API (e.g. under gunicorn with the
+gevent worker as in the Dockerfile, pointed at the fakes in tests/fakes), or
+with --local, an instance started in this process against the fakes.
+
+Usage:
+  python benchmarks/loadgen.py --local [--catalogue-latency 0.05]
+  python benchmarks/loadgen.py --base-url http://localhost:8000 --concurrency 20 --duration 30
+  python benchmarks/loadgen.py --local --save-baseline benchmarks/loadgen-baseline.json
+  python benchmarks/loadgen.py --local --baseline benchmarks/loadgen-baseline.json --threshold 0.25
+
+To compare worker classes and counts, e.g.:
+  python -m tests.fakes.ckan --port 8765 --latency 0.05 &
+  python -m tests.fakes.smtp --port 2525 &
+  BCDC_BASE_URL=http://127.0.0.1:8765 ... gunicorn -k gevent -w 4 -b :8000 argg_api.main:app &
+  python benchmarks/loadgen.py --base-url http://127.0.0.1:8000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+#The kinds of request sent, and the statuses expected for each
+SCENARIOS = {
+  "valid": [200, 202],
+  "invalid": [400],
+  "duplicate": [200, 202, 400],
+  "root": [200]
+}
+
+DEFAULT_MIX = "valid=4,invalid=2,duplicate=1,root=3"
+
+#The measures compared with a baseline.  For each, True if higher is better.
+#Latencies are compared per scenario, and throughput for all requests (since
+#the throughput of each scenario depends on the random mix of requests).
+MEASURES = {
+  "throughput": True,
+  "p50": False,
+  "p95": False,
+  "p99": False
+}
+SCENARIO_MEASURES = ["p50", "p95", "p99"]
+TOTAL_MEASURES = ["throughput"]
+
+def registration(org_id, sub_org_id, title, base_url):
+  return {
+    "metadata_details": {
+      "title": title,
+      "description": "Registered by the load generator",
+      "owner": {
+        "org_id": org_id,
+        "sub_org_id": sub_org_id,
+        "contact_person": {"name": "Load Generator", "business_email": "loadgen@example.com", "role": "pointOfContact"}
+      },
+      "security": {"view_audience": "Public", "download_audience": "Public", "metadata_visibility": "Public", "security_class": "LOW-PUBLIC"},
+      "license": {"license_id": "2"}
+    },
+    "submitted_by_person": {"name": "Load Generator", "org_id": org_id, "business_email": "loadgen@example.com", "role": "pointOfContact"},
+    "existing_api": {"base_url": base_url, "supports": {}},
+    "gateway": {"use_gateway": False}
+  }
+
+class LoadGenerator(object):
+  """
+  Sends requests to an instance of the API from several threads, and records
+  the latency and status of each
+  """
+
+  def __init__(self, base_url, mix, org_id, sub_org_id, api_base_url):
+    self.base_url = base_url.rstrip("/")
+    self.mix = mix
+    self.org_id = org_id
+    self.sub_org_id = sub_org_id
+    self.api_base_url = api_base_url
+    self.run_id = uuid.uuid4().hex[:8]
+    self.results = dict((scenario, []) for scenario in mix)
+    self.unexpected = dict((scenario, 0) for scenario in mix)
+    self._lock = threading.Lock()
+    self._local = threading.local()
+
+  def run(self, concurrency, duration=None, requests_per_thread=None):
+    """
+    Sends requests from 'concurrency' threads, for 'duration' seconds or until
+    each thread has sent 'requests_per_thread' requests
+    :return: the elapsed time in seconds
+    """
+    deadline = time.monotonic() + duration if duration else None
+    threads = [threading.Thread(target=self._run_thread, args=(deadline, requests_per_thread)) for _ in range(concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return time.monotonic() - start
+
+  def _run_thread(self, deadline, requests_per_thread):
+    scenarios = list(self.mix.keys())
+    weights = list(self.mix.values())
+    count = 0
+    while (deadline is None or time.monotonic() < deadline) and (requests_per_thread is None or count < requests_per_thread):
+      self.send(random.choices(scenarios, weights)[0])
+      count += 1
+
+  def send(self, scenario):
+    session = getattr(self._local, "session", None)
+    if session is None:
+      session = self._local.session = requests.Session()
+
+    start = time.monotonic()
+    try:
+      if scenario == "root":
+        r = session.get(self.base_url + "/", timeout=60)
+      else:
+        r = session.post(self.base_url + "/register", json=self.body(scenario), timeout=60)
+      status = r.status_code
+    except requests.exceptions.RequestException:
+      status = None
+    elapsed = time.monotonic() - start
+
+    with self._lock:
+      self.results[scenario].append(elapsed)
+      if status not in SCENARIOS[scenario]:
+        self.unexpected[scenario] += 1
+
+  def body(self, scenario):
+    if scenario == "valid":
+      title = "loadgen {} {}".format(self.run_id, uuid.uuid4().hex[:12])
+    else:
+      #every duplicate has the same title, so all but the first collide
+      title = "loadgen {} duplicate".format(self.run_id)
+    body = registration(self.org_id, self.sub_org_id, title, self.api_base_url)
+    if scenario == "invalid":
+      del body["metadata_details"]["title"]
+    return body
+
+  def report(self, elapsed):
+    """
+    :return: the measures of each scenario (and of all requests, as "all")
+    """
+    report = {}
+    everything = []
+    unexpected = 0
+    for scenario, latencies in self.results.items():
+      everything.extend(latencies)
+      unexpected += self.unexpected[scenario]
+      if latencies:
+        report[scenario] = summarize(latencies, self.unexpected[scenario], elapsed)
+    report["all"] = summarize(everything, unexpected, elapsed)
+    return report
+
+def summarize(latencies, unexpected, elapsed):
+  latencies = sorted(latencies)
+  return {
+    "requests": len(latencies),
+    "unexpected": unexpected,
+    "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0,
+    "p50": round(percentile(latencies, 50), 4),
+    "p95": round(percentile(latencies, 95), 4),
+    "p99": round(percentile(latencies, 99), 4)
+  }
+
+def percentile(sorted_values, p):
+  """
+  The nearest-rank percentile of a sorted list
+  """
+  if not sorted_values:
+    return 0
+  rank = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+  return sorted_values[rank]
+
+def regressions(report, baseline, threshold, min_delta=0):
+  """
+  Compares a report with a baseline
+  :param threshold: the allowed relative change (e.g. 0.2 for 20%)
+  :param min_delta: latency changes smaller than this (in seconds) are ignored,
+    however large they are relative to the baseline
+  :return: a list of descriptions of the measures which regressed
+  """
+  found = []
+  for scenario, measures in baseline.items():
+    if scenario not in report:
+      continue
+    for measure in (TOTAL_MEASURES if scenario == "all" else SCENARIO_MEASURES):
+      expected = measures.get(measure)
+      actual = report[scenario].get(measure)
+      if not expected or actual is None:
+        continue
+      change = (actual - expected) / expected
+      if MEASURES[measure]:
+        regressed = change < -threshold
+      else:
+        regressed = change > threshold and actual - expected > min_delta
+      if regressed:
+        found.append("{} {}: {} (baseline {}, {:+.0%})".format(scenario, measure, actual, expected, change))
+  return found
+
+def parse_mix(mix):
+  weights = {}
+  for part in mix.split(","):
+    scenario, _, weight = part.partition("=")
+    scenario = scenario.strip()
+    if scenario not in SCENARIOS:
+      raise ValueError("Unknown scenario '{}'.  Expecting some of {}".format(scenario, ", ".join(SCENARIOS)))
+    weights[scenario] = float(weight or 1)
+  return dict((scenario, weight) for scenario, weight in weights.items() if weight > 0)
+
+def start_local(catalogue_latency, smtp_latency):
+  """
+  Starts a fake catalogue, a fake SMTP server and the API (in this process)
+  :return: the base URL of the API, and the ids of an organization and a
+    sub-organization known to the catalogue
+  """
+  from tests.fakes.ckan import FakeCkan, DEFAULT_ORGANIZATIONS
+  from tests.fakes.smtp import FakeSmtp
+  catalogue = FakeCkan(latency=catalogue_latency).start()
+  smtp = FakeSmtp(latency=smtp_latency, max_messages=10).start()
+  os.environ.update({
+    "BCDC_BASE_URL": catalogue.base_url,
+    "BCDC_API_PATH": "/api/3",
+    "BCDC_API_KEY": "loadgen",
+    "BCDC_GROUP_ID": "loadgen",
+    "BCDC_PACKAGE_OWNER_ORG_ID": DEFAULT_ORGANIZATIONS[0]["id"],
+    "BCDC_PACKAGE_OWNER_SUB_ORG_ID": DEFAULT_ORGANIZATIONS[1]["id"],
+    "SMTP_SERVER": smtp.host,
+    "SMTP_PORT": "{}".format(smtp.port),
+    "FROM_EMAIL_ADDRESS": "loadgen@example.com",
+    "FROM_EMAIL_PASSWORD": "",
+    "TARGET_EMAIL_ADDRESSES": "loadgen@example.com",
+    "EMAIL_OUTBOX_PATH": "",
+    "METRICS_DIR": "",
+    "LOG_LEVEL": "ERROR",
+    #every request comes from one submitter and address, so admission control
+    #would measure itself rather than the registration path
+    "RATE_LIMIT_SUBMITTER_RATE": "0",
+    "RATE_LIMIT_IP_RATE": "0",
+    "REGISTER_MAX_CONCURRENT": "0"
+  })
+  from werkzeug.serving import make_server, WSGIRequestHandler
+  from argg_api.main import app
+
+  class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+      pass
+
+  server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return "http://127.0.0.1:{}".format(server.server_port), DEFAULT_ORGANIZATIONS[0]["id"], DEFAULT_ORGANIZATIONS[1]["id"]
+
+def print_report(report):
+  print("{:<10} {:>8} {:>10} {:>10} {:>8} {:>8} {:>8}".format("scenario", "requests", "unexpected", "req/s", "p50", "p95", "p99"))
+  for scenario, measures in report.items():
+    print("{:<10} {:>8} {:>10} {:>10} {:>8} {:>8} {:>8}".format(scenario, measures["requests"], measures["unexpected"],
+      measures["throughput"], measures["p50"], measures["p95"], measures["p99"]))
+
+def main():
+  parser = argparse.ArgumentParser(description="Load tests the API and compares the results with a baseline")
+  parser.add_argument("--base-url", help="the base URL of the API to test")
+  parser.add_argument("--local", action="store_true", help="test an instance started in this process against fake services")
+  parser.add_argument("--catalogue-latency", type=float, default=0.05, help="with --local, seconds added to each catalogue response")
+  parser.add_argument("--smtp-latency", type=float, default=0.01, help="with --local, seconds taken to accept each email")
+  parser.add_argument("--concurrency", type=int, default=10, help="number of concurrent clients")
+  parser.add_argument("--duration", type=float, default=10, help="seconds to send requests for")
+  parser.add_argument("--requests", type=int, help="requests per client (instead of --duration)")
+  parser.add_argument("--mix", default=DEFAULT_MIX, help="relative weights of the scenarios (default: {})".format(DEFAULT_MIX))
+  parser.add_argument("--org-id", help="the organization of registrations (default: one known to the fake catalogue)")
+  parser.add_argument("--sub-org-id", help="the sub-organization of registrations")
+  parser.add_argument("--api-base-url", default="http://127.0.0.1:9/", help="the existing_api.base_url of registrations")
+  parser.add_argument("--baseline", help="a baseline file to compare the results with")
+  parser.add_argument("--threshold", type=float, default=0.5, help="allowed regression from the baseline (default: 0.5, i.e. 50%%)")
+  parser.add_argument("--min-delta", type=float, default=0.02, help="ignore latency regressions smaller than this many seconds (default: 0.02)")
+  parser.add_argument("--seed", type=int, default=1, help="seed for the random mix of requests")
+  parser.add_argument("--save-baseline", help="save the results as a baseline file")
+  parser.add_argument("--output", help="save the results (as JSON) to this file")
+  args = parser.parse_args()
+
+  if bool(args.base_url) == bool(args.local):
+    parser.error("Specify one of --base-url or --local")
+
+  random.seed(args.seed)
+  if args.local:
+    base_url, org_id, sub_org_id = start_local(args.catalogue_latency, args.smtp_latency)
+  else:
+    from tests.fakes.ckan import DEFAULT_ORGANIZATIONS
+    base_url, org_id, sub_org_id = args.base_url, DEFAULT_ORGANIZATIONS[0]["id"], DEFAULT_ORGANIZATIONS[1]["id"]
+
+  generator = LoadGenerator(base_url, parse_mix(args.mix), args.org_id or org_id, args.sub_org_id or sub_org_id, args.api_base_url)
+  #warm up (e.g. load caches and open connections) before measuring
+  generator.send("root")
+  generator.send("valid")
+  generator.results = dict((scenario, []) for scenario in generator.mix)
+  generator.unexpected = dict((scenario, 0) for scenario in generator.mix)
+
+  elapsed = generator.run(args.concurrency, None if args.requests else args.duration, args.requests)
+  report = generator.report(elapsed)
+  print("{} requests from {} clients in {:.1f}s against {}".format(report["all"]["requests"], args.concurrency, elapsed, base_url))
+  print_report(report)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  if args.save_baseline:
+    with open(args.save_baseline, "w") as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+    print("Saved baseline to {}".format(args.save_baseline))
+
+  failed = report["all"]["unexpected"] > 0
+  if failed:
+    print("FAIL: {} requests had an unexpected status".format(report["all"]["unexpected"]))
+
+  if args.baseline:
+    with open(args.baseline, "r") as f:
+      baseline = json.load(f)
+    found = regressions(report, baseline, args.threshold, args.min_delta)
+    for regression in found:
+      print("REGRESSION {}".format(regression))
+    if found:
+      failed = True
+    else:
+      print("No regressions beyond {:.0%} of the baseline".format(args.threshold))
+
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
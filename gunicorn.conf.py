@@ -0,0 +1,38 @@
+"""
+Purpose: gunicorn settings for serving argg_api.main:app (see Dockerfile).
+
+The application is preloaded: it is imported and warmed up (see
+argg_api/lifecycle.py) once in the master process, before any worker is
+forked, so workers start ready and share the master's memory.  The master
+serves no requests, so it doesn't start background threads (job queue, email
+outbox, index refreshes...).  Each worker starts those, and restarts what
+doesn't survive a fork (connections, metrics), in post_fork.
+
+Settings can be overridden on the command line, or with GUNICORN_CMD_ARGS.
+"""
+import os
+
+bind = ":8000"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+preload_app = True
+
+#gevent must patch the standard library before the application creates any
+#locks, threads or sockets, which (with preload_app) is in the master process
+if worker_class == "gevent":
+  from gevent import monkey
+  monkey.patch_all()
+
+#the master only loads the application and forks its workers
+if preload_app:
+  from argg_api.lifecycle import defer_background
+  defer_background()
+
+def post_fork(server, worker):
+  #os.register_at_fork does these on python 3.7+.  The worker's metrics start
+  #empty rather than with the master's (and before its warm-up records any).
+  from argg_api import metrics
+  from argg_api.main import lifecycle
+  if not hasattr(os, "register_at_fork"):
+    metrics.registry.reset()
+  lifecycle.after_fork()
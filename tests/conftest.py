@@ -0,0 +1,129 @@
+"""
+Starts a fake catalogue and a fake SMTP server, and points argg_api's settings
+at them.  argg_api reads its settings when it is imported, so the environment
+is prepared (in pytest_configure) before any test module imports it.
+"""
+import copy
+import os
+import uuid
+import pytest
+from tests.fakes.ckan import FakeCkan, DEFAULT_ORGANIZATIONS
+from tests.fakes.smtp import FakeSmtp
+
+OWNER_ORG_ID = DEFAULT_ORGANIZATIONS[0]["id"]
+OWNER_SUB_ORG_ID = DEFAULT_ORGANIZATIONS[1]["id"]
+
+#A valid registration (as in the JMeter test plan)
+REGISTRATION = {
+  "metadata_details": {
+    "title": "example api",
+    "description": "An example API",
+    "owner": {
+      "org_id": OWNER_ORG_ID,
+      "sub_org_id": OWNER_SUB_ORG_ID,
+      "contact_person": {
+        "name": "Contact Person",
+        "business_email": "contact@example.com",
+        "business_phone": "250-555-1234",
+        "role": "pointOfContact"
+      }
+    },
+    "security": {
+      "view_audience": "Public",
+      "download_audience": "Public",
+      "metadata_visibility": "Public",
+      "security_class": "LOW-PUBLIC"
+    },
+    "license": {
+      "license_id": "2"
+    }
+  },
+  "submitted_by_person": {
+    "name": "Submitter",
+    "org_id": OWNER_ORG_ID,
+    "sub_org_id": OWNER_SUB_ORG_ID,
+    "business_email": "submitter@example.com",
+    "business_phone": "250-555-4321",
+    "role": "pointOfContact"
+  },
+  "existing_api": {
+    "supports": {
+      "https": True,
+      "cors": None
+    },
+    "base_url": None,
+    "openapi_spec_url": None
+  },
+  "gateway": {
+    "use_gateway": False
+  }
+}
+
+fake_catalogue = FakeCkan()
+fake_smtp = FakeSmtp()
+
+def pytest_configure(config):
+  fake_catalogue.start()
+  fake_smtp.start()
+  os.environ.update({
+    "BCDC_BASE_URL": fake_catalogue.base_url,
+    "BCDC_API_PATH": "/api/3",
+    "BCDC_API_KEY": "test-api-key",
+    "BCDC_GROUP_ID": "test-group",
+    "BCDC_PACKAGE_OWNER_ORG_ID": OWNER_ORG_ID,
+    "BCDC_PACKAGE_OWNER_SUB_ORG_ID": OWNER_SUB_ORG_ID,
+    "SMTP_SERVER": fake_smtp.host,
+    "SMTP_PORT": "{}".format(fake_smtp.port),
+    "FROM_EMAIL_ADDRESS": "argg@example.com",
+    "FROM_EMAIL_PASSWORD": "",
+    "TARGET_EMAIL_ADDRESSES": "data@example.com",
+    #send emails immediately, so tests can wait for them
+    "EMAIL_OUTBOX_PATH": "",
+    "JOB_STORE": "memory",
+    "IDEMPOTENCY_STORE": "memory",
+    #rate limits are tested separately (test_admission.py)
+    "RATE_LIMIT_STORE": "memory",
+    "RATE_LIMIT_SUBMITTER_RATE": "0",
+    "RATE_LIMIT_IP_RATE": "0",
+    "METRICS_DIR": "",
+    #look organizations up on demand, so catalogue calls are predictable
+    "ORG_INDEX_REFRESH_INTERVAL": "0",
+    "PROBE_CONNECT_TIMEOUT": "1",
+    "PROBE_READ_TIMEOUT": "1"
+  })
+
+def pytest_unconfigure(config):
+  fake_catalogue.stop()
+  fake_smtp.stop()
+
+@pytest.fixture
+def catalogue():
+  fake_catalogue.reset()
+  yield fake_catalogue
+  fake_catalogue.reset()
+
+@pytest.fixture
+def smtp():
+  fake_smtp.reset()
+  return fake_smtp
+
+@pytest.fixture
+def app():
+  from argg_api import main, bcdc
+  main.inline_resources_supported = main.settings.BCDC_INLINE_RESOURCES
+  bcdc.breakers.reset()
+  return main.app
+
+@pytest.fixture
+def client(app):
+  return app.test_client()
+
+@pytest.fixture
+def registration():
+  """
+  A valid registration with a unique title
+  """
+  registration = copy.deepcopy(REGISTRATION)
+  registration["metadata_details"]["title"] = "example api {}".format(uuid.uuid4().hex[:8])
+  registration["existing_api"]["base_url"] = "{}/api/3".format(fake_catalogue.base_url)
+  return registration
@@ -0,0 +1,8 @@
+"""
+Stand-ins for the services argg_api depends on (the BC Data Catalog's CKAN
+action API and an SMTP server), so the application can be tested and load
+tested offline.  Each can be run on its own, e.g.
+
+  python -m tests.fakes.ckan --port 8765 --latency 0.2 --error-rate 0.01
+  python -m tests.fakes.smtp --port 2525
+"""
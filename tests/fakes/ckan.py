@@ -0,0 +1,281 @@
+"""
+A fake BC Data Catalog: the CKAN action API endpoints used by argg_api (and by
+the JMeter test plan), with configurable latency, error rate and package name
+collisions.  Packages are kept in memory.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+API_PATH = "/api/3"
+
+#The organizations the catalogue starts with
+DEFAULT_ORGANIZATIONS = [
+  {"id": "d5316a1b-2646-4c19-9671-c12231c4ec8b", "name": "ministry-of-citizens-services", "title": "Ministry of Citizens' Services"},
+  {"id": "c1222ef5-5013-4d9a-a9a0-373c54241e77", "name": "databc", "title": "DataBC"},
+  {"id": "0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0", "name": "ministry-of-health", "title": "Ministry of Health"}
+]
+
+class FakeCkan(object):
+  """
+  A fake CKAN catalogue served over HTTP from a background thread
+  """
+
+  def __init__(self, host="127.0.0.1", port=0, latency=0, jitter=0, error_rate=0, collision_rate=0, reject_inline_resources=False, organizations=None):
+    """
+    :param port: the port to listen on (0 picks a free port)
+    :param latency: seconds added to every response
+    :param jitter: up to this many more seconds (chosen at random) added to every response
+    :param error_rate: the fraction of requests (0 to 1) answered with HTTP 503
+    :param collision_rate: the fraction of package_create requests (0 to 1)
+      rejected with HTTP 409 as if the package name were already taken
+    :param reject_inline_resources: if True, package_create rejects packages
+      which include resources (as some catalogues do)
+    :param organizations: the organizations in the catalogue (defaults to
+      DEFAULT_ORGANIZATIONS)
+    """
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.collision_rate = collision_rate
+    self.reject_inline_resources = reject_inline_resources
+    self.organizations = [dict(o) for o in (organizations or DEFAULT_ORGANIZATIONS)]
+    self.packages = {}
+    self.calls = []
+    self._lock = threading.Lock()
+    self._server = _ThreadingHTTPServer((host, port), _handler(self))
+    self._thread = None
+
+  @property
+  def base_url(self):
+    host, port = self._server.server_address[:2]
+    return "http://{}:{}".format(host, port)
+
+  def start(self):
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def reset(self):
+    """
+    Removes all packages and recorded calls, and turns off latency and errors
+    """
+    with self._lock:
+      self.packages = {}
+      self.calls = []
+    self.latency = 0
+    self.jitter = 0
+    self.error_rate = 0
+    self.collision_rate = 0
+    self.reject_inline_resources = False
+
+  def call_count(self, action):
+    with self._lock:
+      return sum(1 for _, a in self.calls if a == action)
+
+  #--------------------------------------------------------------------------
+  # Actions.  Each returns a tuple (http status code, response body dictionary)
+  #--------------------------------------------------------------------------
+
+  def site_read(self, params, headers):
+    return _success(True)
+
+  def organization_show(self, params, headers):
+    for organization in self.organizations:
+      if params.get("id") in (organization["id"], organization["name"]):
+        return _success(organization)
+    return _error(404, {"message": "Not found", "__type": "Not Found Error"})
+
+  def organization_list(self, params, headers):
+    offset = int(params.get("offset", 0))
+    limit = int(params.get("limit", 1000))
+    page = self.organizations[offset:offset + limit]
+    if params.get("all_fields", "false").lower() != "true":
+      page = [o["name"] for o in page]
+    return _success(page)
+
+  def package_list(self, params, headers):
+    offset = int(params.get("offset", 0))
+    limit = int(params.get("limit", 1000))
+    with self._lock:
+      names = sorted(p["name"] for p in self.packages.values() if _visible(p, False, False))
+    return _success(names[offset:offset + limit])
+
+  def package_search(self, params, headers):
+    """
+    Supports only the parameters used to list the names of all packages (and
+    always sorts by name)
+    """
+    start = int(params.get("start", 0))
+    rows = int(params.get("rows", 10))
+    authorized = bool(headers.get("Authorization"))
+    include_private = authorized and params.get("include_private", "false").lower() == "true"
+    include_drafts = authorized and params.get("include_drafts", "false").lower() == "true"
+    with self._lock:
+      packages = sorted((p for p in self.packages.values() if _visible(p, include_private, include_drafts)), key=lambda p: p["name"])
+    results = [{"name": p["name"]} if params.get("fl") == "name" else p for p in packages[start:start + rows]]
+    return _success({"count": len(packages), "results": results})
+
+  def package_show(self, params, headers):
+    package = self._find_package(params.get("id"))
+    if not package:
+      return _error(404, {"message": "Not found", "__type": "Not Found Error"})
+    return _success(package)
+
+  def package_create(self, params, headers):
+    if not headers.get("Authorization"):
+      return _error(403, {"message": "Access denied", "__type": "Authorization Error"})
+    if not params.get("name") or not params.get("title"):
+      return _error(409, {"name": ["Missing value"], "__type": "Validation Error"})
+    if self.reject_inline_resources and params.get("resources"):
+      return _error(409, {"resources": ["Resources can't be created with a package"], "__type": "Validation Error"})
+    with self._lock:
+      taken = any(p["name"] == params["name"] for p in self.packages.values())
+      if taken or random.random() < self.collision_rate:
+        return _error(409, {"name": ["That URL is already in use."], "__type": "Validation Error"})
+      package = dict(params, id=uuid.uuid4().hex, state=params.get("state", "active"))
+      package["resources"] = [dict(r, id=uuid.uuid4().hex, package_id=package["id"]) for r in params.get("resources", [])]
+      self.packages[package["id"]] = package
+      return _success(package)
+
+  def resource_create(self, params, headers):
+    if not headers.get("Authorization"):
+      return _error(403, {"message": "Access denied", "__type": "Authorization Error"})
+    package = self._find_package(params.get("package_id"))
+    if not package:
+      return _error(409, {"package_id": ["Not found: Dataset"], "__type": "Validation Error"})
+    with self._lock:
+      resource = dict(params, id=uuid.uuid4().hex)
+      package["resources"].append(resource)
+      return _success(resource)
+
+  def package_delete(self, params, headers):
+    if not headers.get("Authorization"):
+      return _error(403, {"message": "Access denied", "__type": "Authorization Error"})
+    package = self._find_package(params.get("id"))
+    if not package:
+      return _error(404, {"message": "Not found", "__type": "Not Found Error"})
+    package["state"] = "deleted"
+    return _success(None)
+
+  def dataset_purge(self, params, headers):
+    if not headers.get("Authorization"):
+      return _error(403, {"message": "Access denied", "__type": "Authorization Error"})
+    package = self._find_package(params.get("id"))
+    if not package:
+      return _error(404, {"message": "Not found", "__type": "Not Found Error"})
+    with self._lock:
+      del self.packages[package["id"]]
+    return _success(None)
+
+  ACTIONS = ["site_read", "organization_show", "organization_list", "package_list", "package_search", "package_show", "package_create", "resource_create", "package_delete", "dataset_purge"]
+
+  def handle(self, method, path, params, headers):
+    """
+    Handles a request to the action API
+    :return: a tuple (http status code, response body dictionary)
+    """
+    prefix = API_PATH + "/action/"
+    action = path[len(prefix):] if path.startswith(prefix) else None
+    with self._lock:
+      self.calls.append((method, action))
+
+    delay = self.latency + random.random() * self.jitter
+    if delay:
+      time.sleep(delay)
+    if random.random() < self.error_rate:
+      return _error(503, {"message": "Service Unavailable"})
+    if action not in self.ACTIONS:
+      return _error(400, {"message": "Bad request - Action name not known: {}".format(action)})
+    return getattr(self, action)(params, headers)
+
+  def _find_package(self, id_or_name):
+    with self._lock:
+      for package in self.packages.values():
+        if id_or_name in (package["id"], package["name"]):
+          return package
+    return None
+
+def _visible(package, include_private, include_drafts):
+  """
+  Whether a package is listed (by package_list and package_search)
+  """
+  if package["state"] == "deleted" or (package["state"] == "draft" and not include_drafts):
+    return False
+  return include_private or not package.get("private")
+
+def _success(result):
+  return 200, {"success": True, "result": result}
+
+def _error(status, error):
+  return status, {"success": False, "error": error}
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+  #accept bursts of concurrent connections (load tests, benchmarks)
+  request_queue_size = 256
+
+def _handler(catalogue):
+  """
+  A request handler class which passes requests to the given catalogue
+  """
+  class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+      pass
+
+    def do_GET(self):
+      url = urlparse(self.path)
+      params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+      self._respond(*catalogue.handle("GET", url.path, params, self.headers))
+
+    def do_POST(self):
+      url = urlparse(self.path)
+      body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+      try:
+        params = json.loads(body.decode("utf-8")) if body else {}
+      except ValueError:
+        return self._respond(400, {"success": False, "error": {"message": "JSON Error"}})
+      self._respond(*catalogue.handle("POST", url.path, params, self.headers))
+
+    def _respond(self, status, body):
+      content = json.dumps(body).encode("utf-8")
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json;charset=utf-8")
+      self.send_header("Content-Length", str(len(content)))
+      self.end_headers()
+      self.wfile.write(content)
+
+  return Handler
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs a fake BC Data Catalog (CKAN action API)")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  parser.add_argument("--latency", type=float, default=0, help="seconds added to every response")
+  parser.add_argument("--jitter", type=float, default=0, help="up to this many more seconds added at random")
+  parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with HTTP 503")
+  parser.add_argument("--collision-rate", type=float, default=0, help="fraction of package_create requests rejected with HTTP 409")
+  parser.add_argument("--reject-inline-resources", action="store_true")
+  args = parser.parse_args()
+
+  catalogue = FakeCkan(args.host, args.port, args.latency, args.jitter, args.error_rate, args.collision_rate, args.reject_inline_resources)
+  print("Fake catalogue listening on {}{}".format(catalogue.base_url, API_PATH))
+  try:
+    catalogue._server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,158 @@
+"""
+A fake SMTP server which accepts every message and keeps the most recent ones
+in memory.  (The standard library's smtpd module, which could otherwise be
+used, was removed in Python 3.12.)
+"""
+import argparse
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+class FakeSmtp(object):
+  """
+  An SMTP sink served from a background thread.  The most recently received 
+  messages are in 'messages', as dictionaries with the envelope sender 
+  ("mail_from"), the envelope recipients ("rcpt_to") and the parsed message 
+  ("message").  'received' counts all messages.
+  """
+
+  def __init__(self, host="127.0.0.1", port=0, latency=0, max_messages=1000):
+    """
+    :param port: the port to listen on (0 picks a free port).  Don't use 465 or
+      587: argg_api connects to those ports with TLS.
+    :param latency: seconds to wait before accepting each message
+    :param max_messages: the number of received messages kept
+    """
+    self.latency = latency
+    self.max_messages = max_messages
+    self.messages = []
+    self.received = 0
+    self._lock = threading.Lock()
+    self._received = threading.Condition(self._lock)
+    self._server = _ThreadingTCPServer((host, port), _handler(self))
+    self._thread = None
+
+  @property
+  def host(self):
+    return self._server.server_address[0]
+
+  @property
+  def port(self):
+    return self._server.server_address[1]
+
+  def start(self):
+    self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def reset(self):
+    with self._lock:
+      self.messages = []
+      self.received = 0
+    self.latency = 0
+
+  def wait_for(self, count, timeout=10):
+    """
+    Waits until at least 'count' messages have been received
+    :return: the kept messages
+    """
+    deadline = time.monotonic() + timeout
+    with self._received:
+      while self.received < count:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          break
+        self._received.wait(remaining)
+      return list(self.messages)
+
+  def receive(self, mail_from, rcpt_to, data):
+    if self.latency:
+      time.sleep(self.latency)
+    with self._received:
+      self.messages.append({"mail_from": mail_from, "rcpt_to": rcpt_to, "message": message_from_bytes(data)})
+      del self.messages[:-self.max_messages]
+      self.received += 1
+      self._received.notify_all()
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+def _handler(sink):
+  """
+  A request handler class which speaks just enough SMTP for smtplib, and
+  passes received messages to the given sink
+  """
+  class Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+      mail_from = None
+      rcpt_to = []
+      self._reply("220 localhost fake SMTP ready")
+      while True:
+        line = self.rfile.readline()
+        if not line:
+          return
+        command, _, argument = line.decode("utf-8", "replace").strip().partition(" ")
+        command = command.upper()
+        if command == "EHLO":
+          self._reply("250-localhost", "250-8BITMIME", "250 SIZE 10485760")
+        elif command == "HELO":
+          self._reply("250 localhost")
+        elif command == "MAIL":
+          mail_from = argument.partition(":")[2].strip().strip("<>")
+          rcpt_to = []
+          self._reply("250 OK")
+        elif command == "RCPT":
+          rcpt_to.append(argument.partition(":")[2].strip().strip("<>"))
+          self._reply("250 OK")
+        elif command == "DATA":
+          self._reply("354 End data with <CR><LF>.<CR><LF>")
+          sink.receive(mail_from, rcpt_to, self._read_data())
+          self._reply("250 OK")
+        elif command in ("RSET", "NOOP"):
+          if command == "RSET":
+            mail_from, rcpt_to = None, []
+          self._reply("250 OK")
+        elif command == "QUIT":
+          self._reply("221 Bye")
+          return
+        else:
+          self._reply("502 Command not implemented")
+
+    def _read_data(self):
+      lines = []
+      while True:
+        line = self.rfile.readline()
+        if not line or line in (b".\r\n", b".\n"):
+          return b"".join(lines)
+        if line.startswith(b".."):
+          line = line[1:]
+        lines.append(line)
+
+    def _reply(self, *lines):
+      self.wfile.write("".join(line + "\r\n" for line in lines).encode("utf-8"))
+
+  return Handler
+
+def main():
+  parser = argparse.ArgumentParser(description="Runs a fake SMTP server which accepts all messages")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=2525)
+  parser.add_argument("--latency", type=float, default=0, help="seconds to wait before accepting each message")
+  args = parser.parse_args()
+
+  sink = FakeSmtp(args.host, args.port, args.latency)
+  print("Fake SMTP server listening on {}:{}".format(sink.host, sink.port))
+  try:
+    sink._server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,112 @@
+"""
+Tests of admission control on POST /register (and /register/batch): rate
+limits and the limit on concurrent registrations
+"""
+import threading
+import pytest
+from argg_api.admission import RateLimiter, TokenBucket, MemoryRateLimitStore, SQLiteRateLimitStore
+from argg_api.breaker import Bulkhead
+from tests.test_batch import batch_of, read_lines
+
+@pytest.fixture
+def limits(app, monkeypatch):
+  """
+  Limits each submitter to a burst of 2 registrations
+  """
+  from argg_api import main
+  limiter = RateLimiter(MemoryRateLimitStore(), {"submitter": TokenBucket(1, 2), "ip": None})
+  monkeypatch.setattr(main, "rate_limiter", limiter)
+  return limiter
+
+def test_register_rate_limits_each_submitter(client, catalogue, smtp, registration, limits):
+  for i in range(2):
+    registration["metadata_details"]["title"] += " {}".format(i)
+    assert client.post("/register", json=registration).status_code == 200
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 429
+  assert int(r.headers["Retry-After"]) > 0
+  assert catalogue.call_count("package_create") == 2
+  registration["metadata_details"]["title"] += " 2"
+  registration["submitted_by_person"]["business_email"] = "someone.else@example.com"
+  assert client.post("/register", json=registration).status_code == 200
+
+def test_register_rate_limits_each_client_behind_a_local_proxy(client, catalogue, smtp, registration, monkeypatch):
+  from argg_api import main
+  monkeypatch.setattr(main, "rate_limiter", RateLimiter(MemoryRateLimitStore(), {"submitter": None, "ip": TokenBucket(1, 1)}))
+  #the test client's requests come from 127.0.0.1, as the sidecar's do
+  assert client.post("/register", json=registration, headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 200
+  registration["metadata_details"]["title"] += " 2"
+
+  assert client.post("/register", json=registration, headers={"X-Forwarded-For": "10.0.0.1"}).status_code == 429
+  #only the address added by the proxy counts, not those sent by the client
+  assert client.post("/register", json=registration, headers={"X-Forwarded-For": "10.0.0.2, 10.0.0.1"}).status_code == 429
+  assert client.post("/register", json=registration, headers={"X-Forwarded-For": "10.0.0.1, 10.0.0.2"}).status_code == 200
+
+def test_register_rejects_registrations_beyond_the_queue(app, catalogue, smtp, registration, monkeypatch):
+  from argg_api import main
+  monkeypatch.setattr(main, "register_slots", Bulkhead("/register", 1, max_wait=5, max_waiting=0))
+  catalogue.latency = 0.5
+  statuses = []
+  def post(title):
+    body = dict(registration, metadata_details=dict(registration["metadata_details"], title=title))
+    with app.test_client() as client:
+      statuses.append(client.post("/register", json=body).status_code)
+  threads = [threading.Thread(target=post, args=("{} {}".format(registration["metadata_details"]["title"], i),)) for i in range(2)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert sorted(statuses) == [200, 429]
+
+def test_sqlite_store_shares_buckets_and_forgets_full_ones(tmp_path):
+  path = str(tmp_path / "limits.sqlite3")
+  bucket = TokenBucket(60, 1)
+  first, second = SQLiteRateLimitStore(path, purge_interval=0), SQLiteRateLimitStore(path, purge_interval=0)
+
+  assert first.update([("ip:a", bucket)], 100) == [0]
+  assert second.update([("ip:a", bucket)], 100.5) == [0.5]
+  #once the bucket has refilled, the key is deleted
+  assert second.update([("ip:b", bucket)], 102) == [0]
+  assert [key for key, in _keys(path)] == ["ip:b"]
+
+def _keys(path):
+  import sqlite3
+  conn = sqlite3.connect(path)
+  try:
+    return conn.execute("SELECT key FROM rate_limits").fetchall()
+  finally:
+    conn.close()
+
+def test_batch_counts_once_against_the_rate_limits(client, catalogue, smtp, registration, limits):
+  assert client.post("/register", json=registration).status_code == 200
+  assert read_lines(client.post("/register/batch", json=batch_of(registration, 2)))[-1]["summary"]["succeeded"] == 2
+
+  r = client.post("/register/batch", json=batch_of(registration, 1))
+
+  assert r.status_code == 429
+  assert int(r.headers["Retry-After"]) > 0
+  assert catalogue.call_count("package_create") == 3
+
+def test_batch_larger_than_the_burst_is_allowed(client, catalogue, smtp, registration, limits):
+  r = client.post("/register/batch", json=batch_of(registration, 3))
+
+  assert read_lines(r)[-1]["summary"]["succeeded"] == 3
+  assert catalogue.call_count("package_create") == 3
+
+def test_batch_holds_a_register_slot_until_its_results_are_sent(client, catalogue, smtp, registration, monkeypatch):
+  from argg_api import main
+  slots = Bulkhead("/register", 1, max_wait=0, max_waiting=0)
+  monkeypatch.setattr(main, "register_slots", slots)
+
+  with slots.slot():
+    r = client.post("/register/batch", json=batch_of(registration, 2))
+    assert r.status_code == 429
+    assert catalogue.call_count("package_create") == 0
+
+  r = client.post("/register/batch", json=batch_of(registration, 2))
+  assert read_lines(r)[-1]["summary"]["succeeded"] == 2
+  r.close()
+  assert slots.stats()["in_use"] == 0
@@ -0,0 +1,154 @@
+"""
+Tests of the ASGI entry point (argg_api.asgi) against the fake catalogue and
+SMTP server
+"""
+import asyncio
+import json
+import time
+import pytest
+
+@pytest.fixture
+def asgi(app):
+  from argg_api import asgi
+  from argg_api.bcdc_async import AsyncBcdcClient
+  loop = asyncio.new_event_loop()
+  asgi.bcdc_client = AsyncBcdcClient()
+  yield AsgiClient(asgi.app, loop)
+  loop.run_until_complete(asgi.bcdc_client.aclose())
+  loop.close()
+
+class AsgiClient(object):
+  """
+  Calls an ASGI app directly (without a server)
+  """
+
+  def __init__(self, app, loop):
+    self.app = app
+    self.loop = loop
+
+  def request(self, method, path, body=b"", headers=None):
+    return self.loop.run_until_complete(self.request_async(method, path, body, headers))
+
+  def gather(self, *requests):
+    async def gather():
+      return await asyncio.gather(*[self.request_async(*request) for request in requests])
+    return self.loop.run_until_complete(gather())
+
+  async def request_async(self, method, path, body=b"", headers=None):
+    if not isinstance(body, bytes):
+      body = json.dumps(body).encode("utf-8")
+      headers = dict(headers or {}, **{"Content-Type": "application/json"})
+    scope = {
+      "type": "http", "method": method, "path": path, "scheme": "http", "root_path": "",
+      "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+      "client": ("127.0.0.1", 50000), "server": ("testserver", 80)
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    async def receive():
+      return messages.pop(0)
+    sent = []
+    async def send(message):
+      sent.append(message)
+    await self.app(scope, receive, send)
+    response_headers = dict((name.decode(), value.decode()) for name, value in sent[0]["headers"])
+    return sent[0]["status"], response_headers, sent[1]["body"]
+
+def test_root_serves_api_spec_with_etag(asgi):
+  status, headers, body = asgi.request("GET", "/", headers={"Host": "api.example.com"})
+  assert status == 200
+  assert "http://api.example.com" in body.decode()
+
+  status, headers, body = asgi.request("GET", "/", headers={"Host": "api.example.com", "If-None-Match": headers["etag"]})
+  assert status == 304
+
+def test_register_creates_package_with_resources(asgi, catalogue, smtp, registration):
+  registration["existing_api"]["openapi_spec_url"] = "{}/spec.json".format(catalogue.base_url)
+
+  status, headers, body = asgi.request("POST", "/register", registration)
+
+  assert status == 200
+  package_id = json.loads(body.decode())["new_metadata_record"]["id"]
+  resources = catalogue.packages[package_id]["resources"]
+  assert [resource["name"] for resource in resources] == ["API root", "API specification"]
+  messages = smtp.wait_for(1)
+  assert messages[0]["message"]["Subject"] == "New API Registered - {}".format(registration["metadata_details"]["title"])
+
+def test_register_reports_errors_as_the_wsgi_app_does(asgi, client, catalogue, registration):
+  del registration["metadata_details"]["title"]
+  registration["metadata_details"]["owner"]["org_id"] = "unknown-org"
+
+  status, headers, body = asgi.request("POST", "/register", registration)
+
+  r = client.post("/register", json=registration)
+  assert (status, json.loads(body.decode())) == (r.status_code, r.get_json())
+  assert status == 400
+
+def test_concurrent_duplicate_registrations_create_one_package(asgi, catalogue, smtp, registration):
+  results = asgi.gather(*[("POST", "/register", registration, {"Idempotency-Key": "asgi-duplicate"}) for i in range(3)])
+
+  assert [status for status, headers, body in results] == [200, 200, 200]
+  assert len(set(body for status, headers, body in results)) == 1
+  assert catalogue.call_count("package_create") == 1
+
+def test_register_checks_rate_limits_without_blocking_the_event_loop(asgi, catalogue, smtp, registration, monkeypatch):
+  from argg_api import main
+  from argg_api.admission import RateLimiter, MemoryRateLimitStore, TokenBucket
+  class SlowStore(MemoryRateLimitStore):
+    #as a SQLite store waiting for another process's write lock
+    def update(self, buckets, now):
+      time.sleep(0.5)
+      return super(SlowStore, self).update(buckets, now)
+  monkeypatch.setattr(main, "rate_limiter", RateLimiter(SlowStore(), {"ip": TokenBucket(60, 10)}))
+  started = time.monotonic()
+  finished = {}
+  async def request(*args):
+    result = await asgi.request_async(*args)
+    finished[args[1]] = time.monotonic() - started
+    return result
+
+  async def register_and_probe():
+    return await asyncio.gather(request("POST", "/register", registration), request("GET", "/healthz"))
+  results = asgi.loop.run_until_complete(register_and_probe())
+
+  assert [status for status, headers, body in results] == [200, 200]
+  assert finished["/healthz"] < 0.25
+  assert finished["/register"] >= 0.5
+
+def test_concurrent_lookups_of_an_organization_share_one_fetch(asgi, catalogue, smtp, registration):
+  from argg_api import bcdc
+  bcdc._organization_cache.clear()
+  catalogue.latency = 0.2
+  requests = []
+  for i in range(3):
+    body = dict(registration, metadata_details=dict(registration["metadata_details"], title="{} {}".format(registration["metadata_details"]["title"], i)))
+    requests.append(("POST", "/register", body))
+
+  results = asgi.gather(*requests)
+
+  assert [status for status, headers, body in results] == [200, 200, 200]
+  #the owner organization and its sub organization, once each
+  assert catalogue.call_count("organization_show") == 2
+
+def test_stale_values_are_refreshed_for_coroutines():
+  from argg_api.cache import TTLCache
+  cache = TTLCache(ttl=0.05, max_size=10, stale_ttl=10)
+  loads = []
+  async def loader(key):
+    loads.append(key)
+    await asyncio.sleep(0.01)
+    return len(loads)
+  async def lookups():
+    first = await cache.get_async("key", loader)
+    await asyncio.sleep(0.1)
+    stale = await asyncio.gather(*[cache.get_async("key", loader) for i in range(3)])
+    await asyncio.sleep(0.05)
+    return first, stale, await cache.get_async("key", loader)
+
+  loop = asyncio.new_event_loop()
+  try:
+    first, stale, refreshed = loop.run_until_complete(lookups())
+  finally:
+    loop.close()
+
+  assert (first, stale, refreshed) == (1, [1, 1, 1], 2)
+  assert cache.stats()["refreshes"] == 1
@@ -0,0 +1,73 @@
+"""
+Tests of registering batches of APIs (POST /register/batch)
+"""
+import copy
+import json
+import time
+import uuid
+
+def batch_of(registration, count):
+  batch = []
+  for i in range(count):
+    item = copy.deepcopy(registration)
+    item["metadata_details"]["title"] = "{} {}".format(registration["metadata_details"]["title"], i)
+    batch.append(item)
+  return batch
+
+def read_lines(response):
+  return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_batch_streams_results_and_sends_one_email(client, catalogue, smtp, registration):
+  batch = batch_of(registration, 3)
+  batch[1]["metadata_details"]["title"] = ""
+
+  r = client.post("/register/batch", json=batch)
+
+  assert r.status_code == 200
+  assert r.mimetype == "application/x-ndjson"
+  lines = read_lines(r)
+  results = dict((line["index"], line) for line in lines if "index" in line)
+  assert results[0]["status_code"] == 200
+  assert results[1]["status_code"] == 400
+  assert results[2]["status_code"] == 200
+  assert lines[-1] == {"summary": {"total": 3, "succeeded": 2, "failed": 1}}
+  messages = smtp.wait_for(1)
+  assert len(messages) == 1
+  assert messages[0]["message"]["Subject"] == "2 New APIs Registered"
+
+def test_batch_accepts_ndjson(client, catalogue, smtp, registration):
+  body = "\n".join(json.dumps(item) for item in batch_of(registration, 2))
+
+  r = client.post("/register/batch", data=body, content_type="application/x-ndjson")
+
+  assert read_lines(r)[-1] == {"summary": {"total": 2, "succeeded": 2, "failed": 0}}
+
+def test_batch_completes_registrations_concurrently(client, catalogue, smtp, registration):
+  batch = batch_of(registration, 4)
+  client.post("/register", json=registration) #probe the registration's urls (and cache the results)
+  catalogue.latency = 0.3
+
+  start = time.monotonic()
+  lines = read_lines(client.post("/register/batch", json=batch))
+  elapsed = time.monotonic() - start
+
+  assert lines[-1]["summary"]["succeeded"] == 4
+  #one package_create per registration, four at a time
+  assert elapsed < 4 * 0.3
+
+def test_retried_batch_replays_each_registration(client, catalogue, smtp, registration):
+  batch = batch_of(registration, 2)
+  headers = {"Idempotency-Key": uuid.uuid4().hex}
+  first = read_lines(client.post("/register/batch", json=batch, headers=headers))
+  smtp.wait_for(1)
+
+  retry = read_lines(client.post("/register/batch", json=batch, headers=headers))
+
+  assert catalogue.call_count("package_create") == 2
+  by_index = lambda lines: dict((line["index"], line) for line in lines if "index" in line)
+  for index, line in by_index(retry).items():
+    assert line["replayed"] is True
+    assert line["result"] == by_index(first)[index]["result"]
+  assert retry[-1] == {"summary": {"total": 2, "succeeded": 2, "failed": 0}}
+  time.sleep(0.2)
+  assert len(smtp.messages) == 1
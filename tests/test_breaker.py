@@ -0,0 +1,52 @@
+"""
+Tests of the circuit breaker and bulkhead which guard requests to the catalogue
+"""
+import threading
+import time
+import pytest
+from argg_api.breaker import CircuitBreaker, Bulkhead, CircuitOpen, BulkheadFull
+
+def call(breaker, failed=False):
+  with breaker.call() as set_failed:
+    set_failed(failed)
+
+def test_breaker_opens_on_failures_and_closes_after_a_successful_trial():
+  breaker = CircuitBreaker("test", window=4, min_calls=4, failure_rate=0.5, open_duration=0.2)
+  for failed in [False, True, False, True]:
+    call(breaker, failed)
+  assert breaker.state == "open"
+
+  with pytest.raises(CircuitOpen) as e:
+    call(breaker)
+  assert e.value.retry_after == 1
+
+  time.sleep(0.2)
+  call(breaker)
+  assert breaker.state == "closed"
+
+def test_breaker_opens_on_slow_calls():
+  breaker = CircuitBreaker("test", window=2, min_calls=2, slow_call_duration=0.05, slow_call_rate=1)
+  for i in range(2):
+    with breaker.call():
+      time.sleep(0.05)
+  assert breaker.state == "open"
+
+def test_bulkhead_rejects_calls_beyond_its_limit():
+  bulkhead = Bulkhead("test", 1, max_wait=0.05)
+  entered = threading.Event()
+  release = threading.Event()
+  def hold():
+    with bulkhead.slot():
+      entered.set()
+      release.wait()
+  thread = threading.Thread(target=hold)
+  thread.start()
+  entered.wait()
+
+  with pytest.raises(BulkheadFull):
+    with bulkhead.slot():
+      pass
+  release.set()
+  thread.join()
+  with bulkhead.slot():
+    assert bulkhead.stats()["in_use"] == 1
@@ -0,0 +1,18 @@
+"""
+Tests of the notification email templates (argg_api.email_templates)
+"""
+from argg_api import email_templates
+
+def test_notification_is_within_its_size_budget(app, catalogue, registration):
+  from argg_api import main
+  registration["metadata_details"]["description"] = "An API which provides access to example data for the province of British Columbia. " * 3
+  registration["existing_api"]["openapi_spec_url"] = registration["existing_api"]["base_url"] + "/openapi.json"
+  registration["gateway"] = {"use_gateway": True, "use_throttling": True, "restrict_access": True}
+  req_data = main.clean_and_validate_req_data(registration)
+
+  body = main.prepare_email_body(req_data, "https://catalogue.data.gov.bc.ca/dataset/example-api")
+
+  assert registration["metadata_details"]["title"] in body
+  size = len(body.encode("utf-8"))
+  assert size <= email_templates.NOTIFICATION_SIZE_BUDGET, \
+    "the notification is {} bytes, which exceeds the budget of {} bytes".format(size, email_templates.NOTIFICATION_SIZE_BUDGET)
@@ -0,0 +1,55 @@
+"""
+Tests of the JSON codec (argg_api.jsoncodec) with each available backend
+"""
+import json
+import pytest
+from argg_api import jsoncodec
+
+BACKENDS = ["json"] + (["orjson"] if jsoncodec.orjson else [])
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+  original = jsoncodec.BACKEND
+  jsoncodec.BACKEND = request.param
+  yield request.param
+  jsoncodec.BACKEND = original
+
+def test_decodes_bytes_and_str(backend):
+  payload = {"success": True, "result": {"title": "Ministère", "count": 3, "tags": [None, 1.5]}}
+  body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+  assert jsoncodec.loads(body) == payload
+  assert jsoncodec.loads(body.decode("utf-8")) == payload
+
+def test_decodes_utf_16_and_32(backend):
+  payload = {"title": "Ministère", "count": 3}
+  for encoding in ["utf-16", "utf-16-le", "utf-32", "utf-8-sig"]:
+    assert jsoncodec.loads(json.dumps(payload, ensure_ascii=False).encode(encoding)) == payload
+
+def test_sorts_keys_if_asked(backend):
+  payload = {"b": 1, "a": {"d": 2, "c": 3}}
+
+  assert jsoncodec.dumps(payload) == '{"b":1,"a":{"d":2,"c":3}}'
+  assert jsoncodec.dumps(payload, sort_keys=True) == '{"a":{"c":3,"d":2},"b":1}'
+  assert jsoncodec.dumps_bytes(payload, sort_keys=True) == b'{"a":{"c":3,"d":2},"b":1}'
+
+def test_responses_have_sorted_keys_as_flask_sorts_them(backend, client):
+  r = client.get("/healthz")
+  keys = list(json.loads(r.get_data(as_text=True), object_pairs_hook=lambda pairs: pairs))
+  assert [key for key, value in keys] == sorted(r.get_json())
+
+def test_encodes_what_json_encodes(backend):
+  payload = {"title": "Ministère", "big": 2 ** 70, 1: "non-string key"}
+
+  assert json.loads(jsoncodec.dumps_bytes(payload).decode("utf-8")) == json.loads(json.dumps(payload))
+  assert json.loads(jsoncodec.dumps(payload)) == json.loads(json.dumps(payload))
+
+def test_invalid_json_raises_value_error(backend):
+  with pytest.raises(ValueError):
+    jsoncodec.loads(b"{not json")
+
+def test_register_rejects_invalid_json(client):
+  r = client.post("/register", data="{not json", content_type="application/json")
+
+  assert r.status_code == 400
+  assert r.get_json() == {"msg": "content req_data is not valid json"}
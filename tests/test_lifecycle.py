@@ -0,0 +1,145 @@
+"""
+Tests of the startup lifecycle (argg_api.lifecycle) and the health and
+readiness endpoints
+"""
+import os
+import time
+import pytest
+from argg_api import lifecycle as lifecycle_module
+from argg_api.bcdc import _RefreshedIndex
+from argg_api.lifecycle import Lifecycle, READY, MISCONFIGURED
+
+def in_child(func):
+  """
+  Calls func in a forked process
+  :return: what func returned (a str)
+  """
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    try:
+      os.write(write_fd, func().encode())
+    finally:
+      os._exit(0)
+  os.close(write_fd)
+  os.waitpid(pid, 0)
+  result = os.read(read_fd, 1024).decode()
+  os.close(read_fd)
+  return result
+
+def test_health_and_readiness_endpoints(client):
+  r = client.get("/healthz")
+  assert r.status_code == 200
+  assert r.get_json()["status"] == "alive"
+
+  r = client.get("/readyz")
+  assert r.status_code == 200
+  readiness = r.get_json()
+  assert readiness["ready"] is True
+  assert readiness["warm_up"]["bcdc_connection"]["ok"] is True
+
+def test_misconfigured_process_reports_errors_and_starts_nothing():
+  started = []
+  lifecycle = Lifecycle(["Missing 'BCDC_BASE_URL' environment variable."])
+  lifecycle.add_warm_up("task", lambda: started.append("task"))
+  lifecycle.add_background("thread", lambda: started.append("thread"))
+
+  lifecycle.start()
+
+  assert started == []
+  assert lifecycle.state == MISCONFIGURED
+  assert lifecycle.readiness() == {
+    "ready": False,
+    "state": MISCONFIGURED,
+    "warm_up": {},
+    "config_errors": ["Missing 'BCDC_BASE_URL' environment variable."]
+  }
+  assert lifecycle.health()["status"] == "alive"
+
+def test_malformed_number_setting_is_reported_and_defaulted(monkeypatch):
+  from argg_api import settings
+  monkeypatch.setattr(settings, "CONFIG_ERRORS", [])
+  monkeypatch.setenv("BATCH_MAX_SIZE", "lots")
+  monkeypatch.setenv("REGISTER_MAX_WAIT", "2.5")
+
+  assert settings.number_setting("BATCH_MAX_SIZE", int, 100) == 100
+  assert settings.number_setting("REGISTER_MAX_WAIT", float, 10.0) == 2.5
+  assert settings.CONFIG_ERRORS == ["Invalid 'BATCH_MAX_SIZE' environment variable 'lots'.  Expecting an integer."]
+
+def test_failed_warm_up_is_reported_without_making_the_process_unready():
+  def fail():
+    raise RuntimeError("Unable to communicate with BCDC")
+  lifecycle = Lifecycle()
+  lifecycle.add_warm_up("bcdc_connection", fail)
+
+  lifecycle.start()
+
+  assert lifecycle.state == READY
+  assert lifecycle.warm_up_results["bcdc_connection"]["ok"] is False
+  assert lifecycle.warm_up_results["bcdc_connection"]["error"] == "Unable to communicate with BCDC"
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_process_restarts_per_process_work():
+  calls = []
+  lifecycle = Lifecycle()
+  lifecycle.add_warm_up("shared", lambda: calls.append(("shared", os.getpid())))
+  lifecycle.add_warm_up("connection", lambda: calls.append(("connection", os.getpid())), per_process=True)
+  lifecycle.add_background("thread", lambda: calls.append(("thread", os.getpid())))
+  lifecycle.start()
+  lifecycle.start() #already started in this process
+
+  read_fd, write_fd = os.pipe()
+  pid = os.fork()
+  if pid == 0:
+    #the child (as gunicorn's post_fork hook would)
+    try:
+      calls[:] = []
+      lifecycle.after_fork()
+      os.write(write_fd, ",".join(name for name, _ in calls).encode())
+    finally:
+      os._exit(0)
+  os.close(write_fd)
+  os.waitpid(pid, 0)
+  child_calls = os.read(read_fd, 1024).decode()
+  os.close(read_fd)
+
+  assert [name for name, _ in calls] == ["shared", "connection", "thread"]
+  assert child_calls == "connection,thread"
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_background_tasks_are_started_in_workers_not_the_preloading_master(monkeypatch):
+  calls = []
+  lifecycle = Lifecycle()
+  lifecycle.add_warm_up("shared", lambda: calls.append("shared"))
+  lifecycle.add_background("thread", lambda: calls.append("thread"))
+  monkeypatch.setattr(lifecycle_module, "_master_pid", None)
+  lifecycle_module.defer_background()
+
+  lifecycle.start()
+
+  assert calls == ["shared"]
+  assert lifecycle.state == READY
+  def worker():
+    calls[:] = []
+    lifecycle.after_fork()
+    return ",".join(calls)
+  assert in_child(worker) == "thread"
+
+class CountingIndex(_RefreshedIndex):
+  description = "things"
+
+  def load(self):
+    self._loaded(self._count + 1)
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_index_is_refreshed_in_a_forked_process():
+  index = CountingIndex()
+  index.load()
+  index.start_refresh(0.1)
+
+  def worker():
+    loaded_at = index.loaded_at
+    index.start_refresh(0.1)
+    time.sleep(0.5)
+    return "{},{}".format(index.loaded_at > loaded_at, index._refresh_thread.is_alive())
+  assert in_child(worker) == "True,True"
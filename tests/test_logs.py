@@ -0,0 +1,79 @@
+"""
+Tests of the non-blocking log pipeline (argg_api.logs)
+"""
+import io
+import json
+import logging
+from argg_api import logs, tracing
+
+def queueing_logger(name, max_size=100, format=logs.JsonFormatter()):
+  """
+  A logger whose records are queued, and (with its long interval) only written
+  when the handler is flushed
+  """
+  stream = io.StringIO()
+  handler = logs.QueueingHandler(format, max_size=max_size, stream=stream, interval=3600)
+  logger = logging.getLogger("tests.logs.{}".format(name))
+  logger.handlers = [handler]
+  logger.setLevel(logging.DEBUG)
+  logger.propagate = False
+  return logger, handler, stream
+
+def written_lines(handler, stream):
+  handler.flush()
+  return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+def test_records_are_queued_and_written_as_json():
+  logger, handler, stream = queueing_logger("json")
+  trace = tracing.start("request-1")
+  try:
+    args = ["original"]
+    logger.info("message %s", args, extra={"fields": {"status": 200}})
+    args.append("changed later")
+  finally:
+    tracing.finish()
+  assert stream.getvalue() == ""
+
+  lines = written_lines(handler, stream)
+
+  assert len(lines) == 1
+  assert lines[0]["msg"] == "message ['original']"
+  assert lines[0]["level"] == "INFO"
+  assert lines[0]["request_id"] == "request-1"
+  assert lines[0]["status"] == 200
+
+def test_exceptions_are_formatted_when_logged():
+  logger, handler, stream = queueing_logger("exc")
+  try:
+    raise ValueError("boom")
+  except ValueError:
+    logger.exception("failed")
+
+  lines = written_lines(handler, stream)
+
+  assert "ValueError: boom" in lines[0]["exc"]
+
+def test_records_are_dropped_and_counted_when_the_queue_is_full():
+  logger, handler, stream = queueing_logger("full", max_size=2)
+  dropped_before = logs.records_dropped.samples()[0][1] if logs.records_dropped.samples() else 0
+
+  for i in range(5):
+    logger.warning("record %d", i)
+
+  lines = written_lines(handler, stream)
+
+  assert [line["msg"] for line in lines] == ["record 0", "record 1", "3 log records were dropped because the log queue was full"]
+  assert logs.records_dropped.samples()[0][1] - dropped_before == 3
+
+def test_text_format_includes_fields():
+  logger, handler, stream = queueing_logger("text", format=logs.TextFormatter())
+  logger.info("hello", extra={"fields": {"status": 200}})
+
+  handler.flush()
+
+  assert stream.getvalue().rstrip().endswith('INFO in tests.logs.text: hello {"status": 200}')
+
+def test_truncate():
+  assert logs.truncate("abc", 5) == "abc"
+  assert logs.truncate("abcdefgh", 5) == "abcde... (3 more characters)"
+  assert logs.truncate(None, 5) is None
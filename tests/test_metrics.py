@@ -0,0 +1,15 @@
+"""
+Tests of the /metrics endpoint
+"""
+
+def test_metrics_count_catalogue_actions_and_routes(client, catalogue, smtp, registration):
+  client.post("/register", json=registration)
+
+  r = client.get("/metrics")
+
+  assert r.status_code == 200
+  assert r.headers["Content-Type"].startswith("text/plain")
+  text = r.get_data(as_text=True)
+  assert 'argg_bcdc_requests_total{action="package_create",status="200"}' in text
+  assert 'argg_http_requests_total{route="/register",method="POST",status="200"}' in text
+  assert 'argg_email_send_duration_seconds_count' in text
@@ -0,0 +1,94 @@
+"""
+Tests of the package name index: taken names are detected before packages are
+created, and (optionally) replaced with unique names
+"""
+import uuid
+from argg_api import bcdc, settings
+from argg_api.nameindex import NameSet
+
+def idempotency_key():
+  return {"Idempotency-Key": uuid.uuid4().hex}
+
+def package_name(catalogue, r):
+  return catalogue.packages[r.get_json()["new_metadata_record"]["id"]]["name"]
+
+def add_package(catalogue, name, state="active", private=False):
+  package_id = uuid.uuid4().hex
+  catalogue.packages[package_id] = {"id": package_id, "name": name, "title": name, "state": state, "private": private, "resources": []}
+
+def test_taken_name_is_rejected_without_asking_the_catalogue(client, catalogue, smtp, registration):
+  assert client.post("/register", json=registration, headers=idempotency_key()).status_code == 200
+
+  r = client.post("/register", json=registration, headers=idempotency_key())
+
+  assert r.status_code == 400
+  assert "already in use" in r.get_json()["msg"]
+  assert catalogue.call_count("package_create") == 1
+
+def test_taken_name_is_made_unique_if_enabled(client, catalogue, smtp, registration, monkeypatch):
+  monkeypatch.setattr(settings, "BCDC_AUTO_UNIQUE_NAME", True)
+  first = client.post("/register", json=registration, headers=idempotency_key())
+
+  second = client.post("/register", json=registration, headers=idempotency_key())
+
+  assert second.status_code == 200
+  assert package_name(catalogue, second) == package_name(catalogue, first) + "-2"
+  assert catalogue.call_count("package_create") == 2
+
+def test_name_taken_since_the_index_was_loaded_is_learned(client, catalogue, smtp, registration, monkeypatch):
+  name = bcdc.prepare_package_name(registration["metadata_details"]["title"])
+  add_package(catalogue, name)
+
+  r = client.post("/register", json=registration, headers=idempotency_key())
+  assert r.status_code == 400
+  assert bcdc.package_name_taken(name)
+
+  monkeypatch.setattr(settings, "BCDC_AUTO_UNIQUE_NAME", True)
+  add_package(catalogue, name + "-2")
+  r = client.post("/register", json=registration, headers=idempotency_key())
+
+  assert r.status_code == 200
+  assert package_name(catalogue, r) == name + "-3"
+  #the first registration, then the -2 name (taken), then -3
+  assert catalogue.call_count("package_create") == 3
+
+def test_index_is_loaded_from_the_catalogue_in_pages(catalogue, monkeypatch):
+  monkeypatch.setattr(settings, "PACKAGE_NAME_INDEX_PAGE_SIZE", 2)
+  names = ["package-{}".format(uuid.uuid4().hex[:8]) for i in range(5)]
+  for name in names:
+    add_package(catalogue, name)
+
+  bcdc.load_package_name_index()
+
+  assert all(bcdc.package_name_taken(name) for name in names)
+  assert not bcdc.package_name_taken("package-never-created")
+  assert bcdc.package_name_index_stats()["size"] == 5
+  assert catalogue.call_count("package_search") == 3
+
+def test_index_includes_private_and_draft_packages(catalogue):
+  private, draft = "private-{}".format(uuid.uuid4().hex[:8]), "draft-{}".format(uuid.uuid4().hex[:8])
+  add_package(catalogue, private, private=True)
+  add_package(catalogue, draft, state="draft")
+  add_package(catalogue, "deleted-package", state="deleted")
+
+  bcdc.load_package_name_index()
+
+  assert bcdc.package_name_taken(private)
+  assert bcdc.package_name_taken(draft)
+  assert not bcdc.package_name_taken("deleted-package")
+
+def test_unique_names_fit_in_the_maximum_length():
+  name = "x" * 120
+  bcdc._package_name_index.add(name[:98] + "-2")
+
+  assert bcdc.unique_package_name(name) == name[:98] + "-3"
+
+def test_name_set():
+  names = NameSet(["b", "a", "a"])
+  names.add("c")
+  names.add("c")
+
+  assert len(names) == 3
+  assert "a" in names and "b" in names and "c" in names
+  assert "d" not in names
+  assert names.size_in_bytes() == 24
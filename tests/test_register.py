@@ -0,0 +1,199 @@
+"""
+Tests of registering single APIs (GET / and POST /register) against the fake
+catalogue and SMTP server
+"""
+import copy
+import threading
+import time
+
+def test_root_serves_api_spec_with_etag(client):
+  r = client.get("/")
+  assert r.status_code == 200
+  assert r.headers["ETag"]
+
+  r = client.get("/", headers={"If-None-Match": r.headers["ETag"]})
+  assert r.status_code == 304
+
+def test_register_creates_package_with_resources_in_one_call(client, catalogue, smtp, registration):
+  registration["existing_api"]["openapi_spec_url"] = "{}/spec.json".format(catalogue.base_url)
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 200
+  package_id = r.get_json()["new_metadata_record"]["id"]
+  assert catalogue.call_count("package_create") == 1
+  assert catalogue.call_count("resource_create") == 0
+  resources = catalogue.packages[package_id]["resources"]
+  assert [resource["name"] for resource in resources] == ["API root", "API specification"]
+
+def test_register_falls_back_when_inline_resources_are_rejected(client, catalogue, smtp, registration):
+  catalogue.reject_inline_resources = True
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 200
+  package_id = r.get_json()["new_metadata_record"]["id"]
+  assert catalogue.call_count("resource_create") == 1
+  assert [resource["name"] for resource in catalogue.packages[package_id]["resources"]] == ["API root"]
+
+def test_register_sends_notification_email(client, catalogue, smtp, registration):
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 200
+  messages = smtp.wait_for(1)
+  assert messages[0]["message"]["Subject"] == "New API Registered - {}".format(registration["metadata_details"]["title"])
+  assert messages[0]["rcpt_to"] == ["data@example.com"]
+
+def test_register_fills_in_defaults_of_referenced_schemas(client, catalogue, smtp, registration):
+  del registration["gateway"]
+  del registration["existing_api"]["supports"]
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 200
+  messages = smtp.wait_for(1)
+  assert messages[0]["message"]["Subject"] == "New API Registered - {}".format(registration["metadata_details"]["title"])
+
+def test_register_reports_missing_field(client, catalogue, registration):
+  del registration["metadata_details"]["description"]
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 400
+  assert r.get_json()["msg"] == "Missing '$.metadata_details.description'"
+  assert catalogue.call_count("package_create") == 0
+
+def test_register_reports_all_schema_errors(client, catalogue, registration):
+  del registration["metadata_details"]["title"]
+  registration["metadata_details"]["security"]["view_audience"] = ""
+  registration["submitted_by_person"]["org_id"] = None
+  registration["gateway"]["use_gateway"] = "yes"
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 400
+  assert sorted(error["path"] for error in r.get_json()["errors"]) == [
+    "$.gateway.use_gateway",
+    "$.metadata_details.security.view_audience",
+    "$.metadata_details.title",
+    "$.submitted_by_person"
+  ]
+  assert "Missing one of '$.submitted_by_person.org_id' or '$.submitted_by_person.org_name'" in r.get_json()["msg"]
+  assert catalogue.call_count("organization_show") == 0
+
+def test_register_reports_unknown_organization(client, catalogue, registration):
+  registration["metadata_details"]["owner"]["org_id"] = "no-such-organization"
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 400
+  assert "$.metadata_details.owner.org_id" in r.get_json()["msg"]
+
+def test_register_reports_name_collision(client, catalogue, smtp, registration):
+  assert client.post("/register", json=registration, headers={"Idempotency-Key": "first"}).status_code == 200
+
+  r = client.post("/register", json=registration, headers={"Idempotency-Key": "second"})
+
+  assert r.status_code == 400
+  assert "already in use" in r.get_json()["msg"]
+
+def test_register_reports_unavailable_catalogue(client, catalogue, registration):
+  catalogue.error_rate = 1
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 500
+
+def test_register_fails_fast_while_catalogue_keeps_failing(client, catalogue, smtp, registration):
+  from argg_api import settings
+  min_calls = settings.BCDC_BREAKER_MIN_CALLS
+  assert client.post("/register", json=registration).status_code == 200 #caches the organizations
+  catalogue.error_rate = 1
+  for i in range(min_calls - 1):
+    registration["metadata_details"]["title"] += "!"
+    assert client.post("/register", json=registration).status_code == 500
+
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 503
+  assert int(r.headers["Retry-After"]) > 0
+  assert catalogue.call_count("package_create") == min_calls
+  assert client.get("/status").get_json()["bcdc"]["circuit_breakers"]["package_create"]["state"] == "open"
+
+def test_register_async_completes_in_background(client, catalogue, smtp, registration):
+  r = client.post("/register", json=registration, headers={"Prefer": "respond-async"})
+
+  assert r.status_code == 202
+  job_url = r.headers["Location"]
+  deadline = time.monotonic() + 10
+  while time.monotonic() < deadline:
+    job = client.get(job_url).get_json()["job"]
+    if job["status"] in ["succeeded", "failed"]:
+      break
+    time.sleep(0.05)
+  assert job["status"] == "succeeded"
+  assert job["result"]["new_metadata_record"]["id"] in catalogue.packages
+
+def test_register_replays_retried_registration(client, catalogue, smtp, registration):
+  first = client.post("/register", json=registration, headers={"Idempotency-Key": "retried"})
+
+  r = client.post("/register", json=registration, headers={"Idempotency-Key": "retried"})
+
+  assert r.status_code == 200
+  assert r.headers["Idempotent-Replayed"] == "true"
+  assert r.get_json() == first.get_json()
+  assert catalogue.call_count("package_create") == 1
+
+def test_register_rejects_reused_idempotency_key(client, catalogue, smtp, registration):
+  client.post("/register", json=registration, headers={"Idempotency-Key": "reused"})
+  registration["metadata_details"]["description"] = "A different API"
+
+  r = client.post("/register", json=registration, headers={"Idempotency-Key": "reused"})
+
+  assert r.status_code == 422
+  assert catalogue.call_count("package_create") == 1
+
+def test_register_concurrent_duplicates_create_one_package(app, catalogue, smtp, registration):
+  catalogue.latency = 0.3
+  statuses = []
+  def post():
+    with app.test_client() as client:
+      statuses.append(client.post("/register", json=registration).status_code)
+  threads = [threading.Thread(target=post) for i in range(3)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert statuses == [200, 200, 200]
+  assert catalogue.call_count("package_create") == 1
+  smtp.wait_for(1)
+  time.sleep(0.2)
+  assert len(smtp.messages) == 1
+
+def test_schema_check_agrees_with_full_validation(app, registration):
+  from argg_api.main import registration_schema
+  def paths(value, path=()):
+    yield path
+    if isinstance(value, dict):
+      for name, prop in value.items():
+        yield from paths(prop, path + (name,))
+  def replaced(path, new_value):
+    variant = copy.deepcopy(registration)
+    if not path:
+      return new_value
+    parent = variant
+    for name in path[:-1]:
+      parent = parent[name]
+    parent[path[-1]] = new_value
+    return variant
+
+  variants = 0
+  for path in list(paths(registration)):
+    for new_value in [None, "", "x", 1, 1.5, True, [], {}]:
+      checked, walked = replaced(path, new_value), replaced(path, new_value)
+      errors = []
+      registration_schema._validate(walked, errors)
+      assert registration_schema._is_valid(checked) == (not errors), (path, new_value)
+      assert checked == walked
+      variants += 1
+  assert variants > 200
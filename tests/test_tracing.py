@@ -0,0 +1,70 @@
+"""
+Tests of per-request phase timing (argg_api.tracing): the Server-Timing header,
+request ids and the request log
+"""
+import logging
+from argg_api import tracing
+from argg_api.concurrency import WorkerPool
+
+class RecordingHandler(logging.Handler):
+  def __init__(self):
+    logging.Handler.__init__(self)
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+def server_timing_names(header):
+  return [metric.split(";")[0] for metric in header.split(", ")]
+
+def test_register_reports_the_time_taken_by_each_phase(client, catalogue, smtp, registration):
+  r = client.post("/register", json=registration)
+
+  assert r.status_code == 200
+  names = server_timing_names(r.headers["Server-Timing"])
+  for name in ["validate", "probe_urls", "create_package", "bcdc_package_create", "email_render", "email_send"]:
+    assert name in names
+  assert names[-1] == "total"
+  assert len(r.headers["X-Request-ID"]) == 32
+
+def test_request_id_is_taken_from_the_request_if_valid(client):
+  r = client.get("/healthz", headers={"X-Request-ID": "abc-123"})
+  assert r.headers["X-Request-ID"] == "abc-123"
+  assert server_timing_names(r.headers["Server-Timing"]) == ["total"]
+
+  r = client.get("/healthz", headers={"X-Request-ID": "<script>"})
+  assert r.headers["X-Request-ID"] != "<script>"
+
+def test_each_request_is_logged_once(app, client, catalogue, smtp, registration):
+  from argg_api.main import request_log
+  handler = RecordingHandler()
+  request_log.addHandler(handler)
+  try:
+    r = client.post("/register", json=registration, headers={"X-Request-ID": "log-test"})
+  finally:
+    request_log.removeHandler(handler)
+
+  assert len(handler.records) == 1
+  line = handler.records[0].fields
+  assert line["request_id"] == "log-test"
+  assert line["route"] == "/register"
+  assert line["status"] == r.status_code
+  assert line["phases"]["bcdc_package_create"]["count"] == 1
+
+def test_worker_pool_times_work_as_part_of_the_request():
+  trace = tracing.start()
+  def work():
+    with tracing.span("work"):
+      return tracing.current()
+  try:
+    results = WorkerPool(4).run([work, work, work])
+  finally:
+    tracing.finish()
+
+  assert [result for result, _ in results] == [trace, trace, trace]
+  assert [(name, count) for name, _, count in trace.phases()] == [("work", 3)]
+
+def test_span_without_a_trace_does_nothing():
+  assert tracing.current() is None
+  with tracing.span("untimed"):
+    pass